@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import random
 import requests
@@ -6,15 +7,64 @@ import json
 import redis
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values, execute_batch
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import cursor as BaseCursor
 from datetime import datetime, timedelta
 import logging
 import re
+import hashlib
+import math
+import heapq
+import sqlite3
+import socket
+import atexit
 from croniter import croniter
 import threading
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# 日志级别、格式（text 或 json）以及调试级别数据项日志的采样率（0-1）
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_ITEM_SAMPLE_RATE = float(os.getenv('LOG_ITEM_SAMPLE_RATE', 0.01))
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    每条日志输出为一行 JSON，通过 extra={'fields': {...}} 传入的字段会合并到记录中，
+    与保留字段（time、level、thread、message、exception）同名的字段被忽略，不会覆盖日志本身的信息
+    """
+
+    RESERVED_FIELDS = ('time', 'level', 'thread', 'message', 'exception')
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update((key, value) for key, value in fields.items() if key not in self.RESERVED_FIELDS)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
 
 # 设置日志
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+if LOG_FORMAT == 'json':
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(JsonLogFormatter())
+    logging.basicConfig(level=LOG_LEVEL, handlers=[log_handler])
+else:
+    logging.basicConfig(level=LOG_LEVEL,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
 
 # 读取环境变量
 API_URL = os.getenv('API_URL', 'http://192.168.0.120:6688')
@@ -24,174 +74,721 @@ REDIS_DB = int(os.getenv('REDIS_DB', 0))
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')  # Redis 密码
 # Redis 缓存时间（小时），默认1小时
 REDIS_CACHE_HOURS = int(os.getenv('REDIS_CACHE_HOURS', 1))
+# 是否增量更新 Redis 有序集合（只写入变化的成员）
+REDIS_INCREMENTAL = os.getenv('REDIS_INCREMENTAL', 'false').lower() == 'true'
 # Cron 表达式，默认每30分钟执行一次
 CRON_SCHEDULE = os.getenv('CRON_SCHEDULE', '*/30 * * * *')
+# 单独的路由调度，格式：路由=cron表达式;路由=cron表达式，例如 weibo=*/5 * * * *;douban-movie=0 * * * *
+ROUTE_SCHEDULES_CONFIG = os.getenv('ROUTE_SCHEDULES', '')
+# 上一轮任务仍在运行时的处理方式：skip（跳过本次触发）或 coalesce（上一轮结束后立即补跑一次）
+SCHEDULE_OVERLAP_POLICY = os.getenv('SCHEDULE_OVERLAP_POLICY', 'coalesce').lower()
 TIMESCALEDB_HOST = os.getenv('TIMESCALEDB_HOST', 'localhost')
 TIMESCALEDB_PORT = int(os.getenv('TIMESCALEDB_PORT', 5432))
 TIMESCALEDB_USER = os.getenv('TIMESCALEDB_USER', 'postgres')
 TIMESCALEDB_PASSWORD = os.getenv('TIMESCALEDB_PASSWORD', 'password')
 TIMESCALEDB_DB = os.getenv('TIMESCALEDB_DB', 'daily_hot')  # 自定义数据库名称前缀
+# 存储模式：legacy（records_<name> 表，hot/sort_order 拼接为文本）、
+# normalized（hot_samples 时序表 + hot_items 维表）或 both（同时写入两种布局）
+STORAGE_MODE = os.getenv('STORAGE_MODE', 'legacy').lower()
+# 数据库布局：yearly（每年一个 daily_hot_<年份> 数据库）或 single（所有年份写入 TIMESCALEDB_DB 一个数据库，依靠分块管理时间）
+DB_LAYOUT = os.getenv('DB_LAYOUT', 'yearly').lower()
 # 是否启用第二个Redis
 ENABLE_REDIS2 = os.getenv('ENABLE_REDIS2', 'false').lower() == 'true'
 REDIS2_HOST = os.getenv('REDIS2_HOST', 'localhost')
 REDIS2_PORT = int(os.getenv('REDIS2_PORT', 6379))
 REDIS2_DB = int(os.getenv('REDIS2_DB', 0))
 REDIS2_PASSWORD = os.getenv('REDIS2_PASSWORD', '')
+# Redis 副本目标列表，逗号分隔的 Redis URL，例如 redis://:password@host:6379/0
+REDIS_REPLICA_URLS = [url.strip() for url in os.getenv('REDIS_REPLICA_URLS', '').split(',') if url.strip()]
+# 副本 Redis 的读写超时（秒），慢副本不会拖慢主 Redis
+REDIS_REPLICA_TIMEOUT = float(os.getenv('REDIS_REPLICA_TIMEOUT', 5))
+# 并发抓取的线程数
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 8))
+# 对同一主机的最大并发请求数
+FETCH_PER_HOST_LIMIT = int(os.getenv('FETCH_PER_HOST_LIMIT', 4))
+# 单个请求的超时时间（秒）
+FETCH_TIMEOUT = int(os.getenv('FETCH_TIMEOUT', 10))
+# 每轮任务的截止时间（秒），超时未返回的路由将被跳过
+CYCLE_DEADLINE_SECONDS = int(os.getenv('CYCLE_DEADLINE_SECONDS', 300))
+# 超过多少天的数据块启用原生压缩，0 表示不压缩
+COMPRESS_AFTER_DAYS = int(os.getenv('COMPRESS_AFTER_DAYS', 7))
+# 数据保留天数，超过的数据块会被自动删除，0 表示永久保留
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 0))
+# 是否为规范化存储创建每小时/每天的连续聚合
+ENABLE_CONTINUOUS_AGGREGATES = os.getenv('ENABLE_CONTINUOUS_AGGREGATES', 'true').lower() == 'true'
+# 连续聚合 Top-N 视图中每个路由保留的条数
+CAGG_TOP_N = int(os.getenv('CAGG_TOP_N', 10))
+# 是否根据内容哈希去重：未变化的数据项只记录新的排名/热度，而不是写入完整的一行
+# 开启后旧布局中同一天的多次抓取合并为一行，历史查询返回的行数和 hot/sort_order 格式随之改变
+ITEM_DEDUP = os.getenv('ITEM_DEDUP', 'false').lower() == 'true'
+# 启用 ITEM_DEDUP 时旧布局每行最多合并的 hot/sort_order 数量，达到后写入新的一行
+ITEM_DEDUP_MAX_SAMPLES = max(int(os.getenv('ITEM_DEDUP_MAX_SAMPLES', 24)), 1)
+# 每个路由在内存中保留的最近数据项哈希数量
+ITEM_HASH_CACHE_SIZE = int(os.getenv('ITEM_HASH_CACHE_SIZE', 1000))
+# 每个年份数据库连接池的最小/最大连接数
+DB_POOL_MIN_CONN = int(os.getenv('DB_POOL_MIN_CONN', 1))
+DB_POOL_MAX_CONN = int(os.getenv('DB_POOL_MAX_CONN', 8))
+# 同时保留连接池的年份数据库数量，超出时按 LRU 关闭最久未使用的年份
+DB_POOL_MAX_YEARS = int(os.getenv('DB_POOL_MAX_YEARS', 2))
+# 流水线各阶段之间的队列长度
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 16))
+# 流水线规范化、Redis 写入和数据库写入阶段的线程数
+PIPELINE_NORMALIZE_WORKERS = int(os.getenv('PIPELINE_NORMALIZE_WORKERS', 2))
+PIPELINE_REDIS_WORKERS = int(os.getenv('PIPELINE_REDIS_WORKERS', 4))
+PIPELINE_DB_WORKERS = int(os.getenv('PIPELINE_DB_WORKERS', 4))
+# HTTP 连接池中每个主机保留的连接数
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', FETCH_CONCURRENCY))
+# 5xx 或超时时的最大重试次数
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+# 重试的基础退避时间（秒），实际等待时间带随机抖动
+HTTP_BACKOFF_SECONDS = float(os.getenv('HTTP_BACKOFF_SECONDS', 0.5))
+# 是否根据每个路由的变化率自适应调整抓取间隔，并跳过内容未变化的数据写入
+ADAPTIVE_POLLING = os.getenv('ADAPTIVE_POLLING', 'false').lower() == 'true'
+# 自适应抓取间隔的上下限（秒），调度的触发间隔应不大于下限
+ADAPTIVE_MIN_INTERVAL = int(os.getenv('ADAPTIVE_MIN_INTERVAL', 300))
+ADAPTIVE_MAX_INTERVAL = int(os.getenv('ADAPTIVE_MAX_INTERVAL', 3600))
+# 变化率的平滑系数（0-1），越大越偏向最近一次的变化
+ADAPTIVE_SMOOTHING = float(os.getenv('ADAPTIVE_SMOOTHING', 0.5))
+# Prometheus /metrics 端口，0 表示不启动
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+# 只读 HTTP API 端口，0 表示不启动（默认不启动）
+READ_API_PORT = int(os.getenv('READ_API_PORT', 0))
+# 只读 HTTP API 监听地址，默认只监听本机，容器内需要对外提供时设置为 0.0.0.0
+READ_API_BIND = os.getenv('READ_API_BIND', '127.0.0.1')
+# 只读 API 响应缓存的过期时间（秒）和最大条目数
+READ_CACHE_TTL = int(os.getenv('READ_CACHE_TTL', 30))
+READ_CACHE_SIZE = int(os.getenv('READ_CACHE_SIZE', 256))
+# 数据库不可用或过慢时是否将待写入的数据缓冲到本地 SQLite 文件，恢复后重放
+SPOOL_ENABLED = os.getenv('SPOOL_ENABLED', 'true').lower() == 'true'
+# 连接数据库的超时时间（秒），数据库不可达时尽快失败并转入本地缓冲
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+# 本地缓冲文件路径和最大占用空间（MB），超出时丢弃最早的数据
+SPOOL_PATH = os.getenv('SPOOL_PATH', 'spool/spool.sqlite3')
+SPOOL_MAX_MB = int(os.getenv('SPOOL_MAX_MB', 256))
+# 重放本地缓冲的检查间隔（秒）和每批读取的条数
+SPOOL_REPLAY_INTERVAL = int(os.getenv('SPOOL_REPLAY_INTERVAL', 30))
+SPOOL_REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', 100))
+# 跨年份查询时并行查询各年份数据库的线程数
+FEDERATION_WORKERS = int(os.getenv('FEDERATION_WORKERS', 4))
+# 后台重新获取 /all 路由目录的间隔（秒），0 表示只在启动时获取
+CATALOG_REFRESH_INTERVAL = int(os.getenv('CATALOG_REFRESH_INTERVAL', 600))
+# 是否在多个 worker 之间分片路由（通过 Redis 心跳、一致性哈希和路由租约协调）
+SHARDING_ENABLED = os.getenv('SHARDING_ENABLED', 'false').lower() == 'true'
+# 当前 worker 的标识，默认为主机名和进程号
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+# worker 心跳间隔（秒）和过期时间（秒），超过过期时间没有心跳的 worker 视为已退出，其路由重新分配
+WORKER_HEARTBEAT_INTERVAL = int(os.getenv('WORKER_HEARTBEAT_INTERVAL', 10))
+WORKER_TTL = int(os.getenv('WORKER_TTL', 30))
+# 是否在采集时计算排名变化趋势并发布到 allbs:trends:<path>
+TRENDS_ENABLED = os.getenv('TRENDS_ENABLED', 'false').lower() == 'true'
+# 趋势有序集合和上一次快照在 Redis 中的保留时间（小时）
+TRENDS_STATE_HOURS = int(os.getenv('TRENDS_STATE_HOURS', 24))
+# 是否在路由数据变化和每轮结束时向 Redis Stream 追加变更事件（需要额外读取旧成员并写入事件流）
+EVENTS_ENABLED = os.getenv('EVENTS_ENABLED', 'false').lower() == 'true'
+# 每个变更事件流保留的大致最大条数（XADD MAXLEN ~）
+EVENTS_STREAM_MAXLEN = int(os.getenv('EVENTS_STREAM_MAXLEN', 1000))
 
 # Redis 缓存键
 ROUTES_CACHE_KEY = 'allbs:routes_cache'
+# 路由目录版本哈希键（version、fingerprint），多个 worker 据此判断目录是否已更新
+CATALOG_VERSION_KEY = 'allbs:routes_version'
 # 当前年份缓存键
 CURRENT_YEAR_KEY = 'allbs:current_year'
+# 规范化存储模式的表名
+SAMPLES_TABLE = 'hot_samples'
+ITEMS_TABLE = 'hot_items'
+# 只读 API 单次查询返回的最大条数
+READ_API_MAX_LIMIT = 100
+# 年份数据库列表的缓存时间（秒）
+YEAR_DATABASES_CACHE_SECONDS = 300
+# 合并年份数据库时每批复制的行数
+FOLD_BATCH_SIZE = 5000
+# 默认调度（CRON_SCHEDULE）的调度键
+DEFAULT_SCHEDULE_KEY = '*'
+# 有序集合指纹集合键前缀（只在增量同步时维护）
+FINGERPRINT_KEY_PREFIX = 'allbs:fp:'
+# 存活 worker 的有序集合（成员为 worker 标识，分数为最近一次心跳时间）
+WORKERS_KEY = 'allbs:workers'
+# 趋势有序集合键前缀（按动量排序）及上一次快照的键前缀
+TRENDS_KEY_PREFIX = 'allbs:trends:'
+TREND_STATE_KEY_PREFIX = 'allbs:trend_state:'
+# 路由变更事件流键前缀及其版本号键前缀
+EVENTS_KEY_PREFIX = 'allbs:events:'
+EVENT_VERSION_KEY_PREFIX = 'allbs:event_version:'
+# 每轮结束事件流及其版本号键
+CYCLE_EVENTS_KEY = 'allbs:cycle_events'
+CYCLE_EVENT_VERSION_KEY = 'allbs:cycle_event_version'
+# 路由租约键前缀，值为持有租约的 worker 标识
+LEASE_KEY_PREFIX = 'allbs:lease:'
+# 路由租约的有效期（秒）：覆盖一整轮（包括截止后仍在写入的数据），worker 异常退出时租约自动过期
+ROUTE_LEASE_SECONDS = CYCLE_DEADLINE_SECONDS + 2 * WORKER_TTL
+
+# 增量同步有序集合的 Lua 脚本，在脚本内根据现有成员计算差异，比较与修改原子地完成
+# KEYS[1]: 有序集合，KEYS[2]: 指纹集合（只保存成员的 SHA-1，供客户端省略未变化成员的内容）
+# ARGV: 过期秒数、(指纹, 分数, 成员)...，客户端认为已存在的成员传空字符串
+# 返回 {1, 新增指纹列表, 移除的成员列表}；省略了内容的成员实际不存在时不做修改，返回 {-1, 缺少的指纹列表}
+SYNC_SORTED_SET_LUA = """
+local ttl = tonumber(ARGV[1])
+local existing = {}
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    existing[redis.sha1hex(member)] = member
+end
+local wanted = {}
+local missing = {}
+for i = 2, #ARGV, 3 do
+    wanted[ARGV[i]] = true
+    if existing[ARGV[i]] == nil and ARGV[i + 2] == '' then
+        missing[#missing + 1] = ARGV[i]
+    end
+end
+if #missing > 0 then
+    return {-1, missing}
+end
+local added = {}
+for i = 2, #ARGV, 3 do
+    if existing[ARGV[i]] == nil then
+        redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i + 2])
+        added[#added + 1] = ARGV[i]
+    end
+end
+local removed = {}
+for fingerprint, member in pairs(existing) do
+    if not wanted[fingerprint] then
+        redis.call('ZREM', KEYS[1], member)
+        removed[#removed + 1] = member
+    end
+end
+redis.call('DEL', KEYS[2])
+local fingerprints = {}
+for i = 2, #ARGV, 3 do
+    fingerprints[#fingerprints + 1] = ARGV[i]
+    if #fingerprints == 500 then
+        redis.call('SADD', KEYS[2], unpack(fingerprints))
+        fingerprints = {}
+    end
+end
+if #fingerprints > 0 then
+    redis.call('SADD', KEYS[2], unpack(fingerprints))
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[2], ttl)
+return {1, added, removed}
+"""
+
+# 发布路由目录的 Lua 脚本，目录内容与版本号原子地一起更新
+# KEYS[1]: 路由目录缓存，KEYS[2]: 版本哈希
+# ARGV[1]: 目录指纹，ARGV[2]: 目录 JSON
+PUBLISH_CATALOG_LUA = """
+if redis.call('HGET', KEYS[2], 'fingerprint') == ARGV[1] then
+    return tonumber(redis.call('HGET', KEYS[2], 'version'))
+end
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[2], 'fingerprint', ARGV[1])
+return redis.call('HINCRBY', KEYS[2], 'version', 1)
+"""
+
+# 释放路由租约的 Lua 脚本，只删除仍由当前 worker 持有的租约
+# KEYS: 租约键，ARGV[1]: worker 标识
+RELEASE_LEASES_LUA = """
+local released = 0
+for i = 1, #KEYS do
+    if redis.call('GET', KEYS[i]) == ARGV[1] then
+        released = released + redis.call('DEL', KEYS[i])
+    end
+end
+return released
+"""
+
+# 追加变更事件的 Lua 脚本，版本号递增与追加事件原子地完成
+# KEYS[1]: 事件流，KEYS[2]: 版本号
+# ARGV[1]: 最大长度，ARGV[2...]: 字段, 值...
+PUBLISH_EVENT_LUA = """
+local version = redis.call('INCR', KEYS[2])
+local fields = {'version', version}
+for i = 2, #ARGV do
+    fields[#fields + 1] = ARGV[i]
+end
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', unpack(fields))
+return version
+"""
 
 # 确保API_URL末尾没有斜杠
 if API_URL.endswith('/'):
     API_URL = API_URL[:-1]
 
-# 初始化 Redis 连接
-try:
-    redis_client = redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        db=REDIS_DB,
-        password=REDIS_PASSWORD,  # 传递 Redis 密码
-        decode_responses=True  # 将 Redis 响应解码为字符串
-    )
-    redis_client.ping()
-    logging.info("Connected to Redis")
-except redis.exceptions.RedisError as e:
-    logging.error(f"Redis connection error: {e}")
-    exit(1)
-
-# 初始化第二个 Redis 连接（如果启用）
-redis_client2 = None
-if ENABLE_REDIS2:
-    try:
-        redis_client2 = redis.Redis(
+# Prometheus 指标
+FETCH_SECONDS = Histogram('dailyhot_fetch_seconds', 'Route fetch latency including retries', ['route'])
+HTTP_RESPONSES = Counter('dailyhot_http_responses_total', 'Upstream HTTP responses by status', ['route', 'status'])
+PAYLOAD_BYTES = Histogram('dailyhot_payload_bytes', 'Upstream response payload size', ['route'],
+                          buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+DB_ROWS = Counter('dailyhot_db_rows_total', 'Rows written to TimescaleDB', ['table', 'outcome'])
+DB_STATEMENT_SECONDS = Histogram('dailyhot_db_statement_seconds', 'TimescaleDB statement latency', ['statement'])
+REDIS_SECONDS = Histogram('dailyhot_redis_seconds', 'Redis sorted set sync latency', ['target'])
+CYCLE_SECONDS = Histogram('dailyhot_cycle_seconds', 'Duration of a periodic ingest cycle',
+                          buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+SPOOL_ENTRIES = Gauge('dailyhot_spool_entries', 'Route batches waiting in the local write spool')
+SPOOL_BATCHES = Counter('dailyhot_spool_batches_total', 'Route batches spooled, replayed or dropped', ['event'])
+LIVE_WORKERS = Gauge('dailyhot_live_workers', 'Workers with a live heartbeat when sharding is enabled')
+OWNED_ROUTES = Gauge('dailyhot_owned_routes', 'Routes assigned to this worker in the last cycle')
+PIPELINE_QUEUE_DEPTH = Gauge('dailyhot_pipeline_queue_depth', 'Batches waiting in each ingest pipeline stage queue', ['stage'])
+PIPELINE_STAGE_SECONDS = Gauge('dailyhot_pipeline_stage_seconds', 'Duration of the last batch processed by each ingest pipeline stage', ['stage'])
+PIPELINE_DROPPED = Counter('dailyhot_pipeline_dropped_batches_total', 'Batches dropped because the database stage queue was full and spooling is disabled')
+LAST_SUCCESS = Gauge('dailyhot_last_success_timestamp_seconds', 'Unix time of the last cycle that finished before its deadline without errors')
+
+def create_http_session():
+    """
+    创建共享的 HTTP 会话：连接池、keep-alive 与 gzip 协商
+    """
+    session = requests.Session()
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+
+    # 统计连接池的创建次数，用于计算连接池命中
+    new_pool = adapter.poolmanager._new_pool
+
+    def counting_new_pool(*args, **kwargs):
+        with http_stats_lock:
+            http_stats['pools_created'] += 1
+        return new_pool(*args, **kwargs)
+
+    adapter.poolmanager._new_pool = counting_new_pool
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# HTTP 请求统计
+http_stats = {
+    'requests': 0,
+    'pools_created': 0,
+    'retries': 0,
+    'not_modified': 0,
+    'errors': 0,
+}
+http_stats_lock = threading.Lock()
+
+# 条件请求缓存：url -> {'etag', 'last_modified', 'data'}
+conditional_cache = {}
+conditional_cache_lock = threading.Lock()
+
+# 共享的 HTTP 会话
+http_session = create_http_session()
+
+# 创建 Redis 客户端，首次执行命令时才建立连接，启动时在 connect_redis 中检查连接
+redis_client = redis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    password=REDIS_PASSWORD,  # 传递 Redis 密码
+    decode_responses=True  # 将 Redis 响应解码为字符串
+)
+
+# 注册增量同步脚本，调用时通过 client 参数指定目标 Redis
+sync_sorted_set_script = redis_client.register_script(SYNC_SORTED_SET_LUA)
+publish_catalog_script = redis_client.register_script(PUBLISH_CATALOG_LUA)
+release_leases_script = redis_client.register_script(RELEASE_LEASES_LUA)
+publish_event_script = redis_client.register_script(PUBLISH_EVENT_LUA)
+
+def create_redis_replicas():
+    """
+    根据 REDIS_REPLICA_URLS 和兼容的 REDIS2_* 配置创建 Redis 副本目标
+    连接失败的副本会被跳过，不影响主 Redis
+    """
+    targets = []
+    # 兼容原有的第二个 Redis 配置
+    if ENABLE_REDIS2:
+        targets.append(("second Redis", redis.Redis(
             host=REDIS2_HOST,
             port=REDIS2_PORT,
             db=REDIS2_DB,
             password=REDIS2_PASSWORD,
-            decode_responses=True
+            decode_responses=True,
+            socket_timeout=REDIS_REPLICA_TIMEOUT,
+            socket_connect_timeout=REDIS_REPLICA_TIMEOUT
+        )))
+    for url in REDIS_REPLICA_URLS:
+        client = redis.Redis.from_url(
+            url,
+            decode_responses=True,
+            socket_timeout=REDIS_REPLICA_TIMEOUT,
+            socket_connect_timeout=REDIS_REPLICA_TIMEOUT
         )
-        redis_client2.ping()
-        logging.info("Connected to second Redis")
+        kwargs = client.connection_pool.connection_kwargs
+        targets.append((f"Redis replica {kwargs.get('host')}:{kwargs.get('port')}/{kwargs.get('db', 0)}", client))
+
+    def connect(target):
+        name, client = target
+        try:
+            client.ping()
+            logging.info("Connected to %s", name)
+            return {'name': name, 'client': client, 'active': set(), 'queued': {}}
+        except redis.exceptions.RedisError as e:
+            logging.error("%s connection error: %s", name, e)
+            logging.warning("Continuing without %s", name)
+            return None
+
+    if not targets:
+        return []
+    # 并行检查各副本，启动耗时不随副本数量和超时叠加
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='redis-connect') as executor:
+        return [replica for replica in executor.map(connect, targets) if replica is not None]
+
+def connect_redis():
+    """
+    启动时检查主 Redis 连接（失败则退出），并连接尚未连接的 Redis 副本
+    """
+    try:
+        redis_client.ping()
+        logging.info("Connected to Redis")
     except redis.exceptions.RedisError as e:
-        logging.error(f"Second Redis connection error: {e}")
-        logging.warning("Continuing without second Redis")
-        redis_client2 = None
+        logging.error("Redis connection error: %s", e)
+        exit(1)
+    with redis_replicas_lock:
+        if not redis_replicas:
+            redis_replicas.extend(create_redis_replicas())
+
+# Redis 副本目标（包括第二个 Redis），在 connect_redis 中连接
+redis_replicas = []
+redis_replicas_lock = threading.Lock()
+# 副本写入线程池，副本的写入不会阻塞主 Redis
+replica_executor = ThreadPoolExecutor(max_workers=max(len(REDIS_REPLICA_URLS) + int(ENABLE_REDIS2), 1),
+                                      thread_name_prefix='redis-replica')
+
+# 每个主机的并发请求信号量
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+# 表结构元数据缓存，键为 (数据库名, 表名)，值为唯一约束、hypertable 与列信息
+# 仅在执行 DDL 或连接重建时失效，写入路径直接读取而不再查询系统目录
+schema_cache = {}
+schema_cache_lock = threading.Lock()
+# 串行化表检查与建表，避免并发写入时重复执行 DDL
+table_bootstrap_lock = threading.Lock()
+
+# 每个路由最近见过的数据项：缓存名 -> OrderedDict(item_id -> 内容哈希等)，按 LRU 淘汰
+recent_item_cache = {}
+recent_item_cache_lock = threading.Lock()
 
-# 全局连接变量
-conn = None
-cursor = None
+# 自适应抓取的路由状态：路由 -> {'interval', 'last_polled', 'change_rate', 'payload_hash', 'item_ids'}
+route_poll_state = {}
+route_poll_state_lock = threading.Lock()
 
-# 表检查缓存，避免重复检查表结构
-table_checked_cache = set()
+# 当前使用的路由目录 {'version', 'data', 'added', 'removed'}，只在每轮开始时切换
+route_catalog = None
+# 后台刷新准备好、等待下一轮开始时切换的路由目录
+pending_route_catalog = None
+route_catalog_lock = threading.Lock()
+
+# 每个路由上一次快照的排名和热度：路由 -> {'collected_at', 'items': {item_id: [rank, hot, title, url]}}
+trend_state = {}
+trend_state_lock = threading.Lock()
+
+# 最近一次读取到的存活 worker 列表，Redis 不可用时沿用
+live_workers = [WORKER_ID]
+# 分片模式下当前 worker 负责的路由，路由被分配给其他 worker 时清理其在内存中的状态
+owned_route_keys = set()
+
+# 单独配置调度的路由：路由 -> cron 表达式
+ROUTE_SCHEDULES = {}
+# 调度器
+scheduler = None
+
+# 正在运行的采集流水线及上一轮流水线的统计
+current_pipeline = None
+last_pipeline_stats = {}
+
+# 最近一次写入 Redis 的年份，避免每次写入都读取 CURRENT_YEAR_KEY
+latest_year = None
 
 def get_db_name_for_year(year):
     """
-    根据年份生成数据库名称
+    根据年份生成数据库名称，single 布局下所有年份共用 TIMESCALEDB_DB
     """
+    if DB_LAYOUT == 'single':
+        return TIMESCALEDB_DB
     return f"{TIMESCALEDB_DB}_{year}"
 
+def get_table_metadata(db_name, table_name):
+    """
+    从缓存中读取表结构元数据，未缓存时返回 None
+    """
+    with schema_cache_lock:
+        return schema_cache.get((db_name, table_name))
+
+def invalidate_schema_cache(db_name=None, table_name=None):
+    """
+    使表结构元数据缓存失效：指定表、指定数据库的全部表，或全部缓存
+    """
+    with schema_cache_lock:
+        if db_name is None:
+            schema_cache.clear()
+            return
+        for key in list(schema_cache.keys()):
+            if key[0] == db_name and (table_name is None or key[1] == table_name):
+                del schema_cache[key]
+
+def load_table_metadata(cursor, db_name, table_name):
+    """
+    查询表的唯一约束、hypertable 状态和列布局，并写入缓存
+    """
+    cursor.execute("""
+        SELECT
+            EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype = 'u'
+            ),
+            ARRAY(
+                SELECT attname::text FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                ORDER BY attnum
+            )
+    """, [table_name, table_name])
+    has_unique_constraint, columns = cursor.fetchone()
+
+    try:
+        cursor.execute("""
+            SELECT count(*) FROM _timescaledb_catalog.hypertable
+            WHERE table_name = %s
+        """, [table_name])
+        is_hypertable = cursor.fetchone()[0] > 0
+    except psycopg2.Error as e:
+        logging.warning("Unable to check hypertable status of %s: %s", table_name, e)
+        is_hypertable = False
+
+    metadata = {
+        'has_unique_constraint': has_unique_constraint,
+        'is_hypertable': is_hypertable,
+        'columns': list(columns),
+    }
+    with schema_cache_lock:
+        schema_cache[(db_name, table_name)] = metadata
+    return metadata
+
+def get_db_connect_kwargs(db_name):
+    """
+    生成连接指定数据库所需的参数
+    """
+    return {
+        'host': TIMESCALEDB_HOST,
+        'port': TIMESCALEDB_PORT,
+        'user': TIMESCALEDB_USER,
+        'password': TIMESCALEDB_PASSWORD,
+        'dbname': db_name,
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+    }
+
+def create_database_if_missing(db_name):
+    """
+    连接到默认的 postgres 数据库，若指定数据库不存在则创建
+    """
+    temp_conn = psycopg2.connect(**get_db_connect_kwargs("postgres"))
+    try:
+        temp_conn.autocommit = True
+        with temp_conn.cursor() as temp_cursor:
+            # 检查数据库是否已存在
+            temp_cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", [db_name])
+            exists = temp_cursor.fetchone()
+
+            if not exists:
+                # 创建数据库
+                temp_cursor.execute(sql.SQL("CREATE DATABASE {}").format(
+                    sql.Identifier(db_name)
+                ))
+                logging.info("Created database %s", db_name)
+            else:
+                logging.info("Database %s already exists but connection failed", db_name)
+    finally:
+        temp_conn.close()
+
+class YearDatabasePools:
+    """
+    按年份数据库（daily_hot_<year>）管理的 psycopg2 连接池
+    每个年份一个 ThreadedConnectionPool，超过 max_years 时按 LRU 关闭最久未使用且空闲的年份，
+    跨年时新旧年份的连接池同时保留，无需重连
+    """
+
+    def __init__(self, max_years, min_conn, max_conn):
+        self.max_years = max_years
+        self.min_conn = min_conn
+        self.max_conn = max_conn
+        # db_name -> {'pool', 'semaphore', 'in_use'}，按最近使用排序
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        # db_name -> 创建连接池时持有的锁，连接和建库在全局锁之外进行，只阻塞同一数据库的调用方
+        self._creation_locks = {}
+
+    def _create_pool(self, db_name):
+        """
+        为指定数据库创建连接池，数据库不存在时先创建，并启用 TimescaleDB 扩展
+        """
+        try:
+            pool = ThreadedConnectionPool(self.min_conn, self.max_conn, **get_db_connect_kwargs(db_name))
+        except psycopg2.OperationalError as e:
+            # 如果数据库不存在，则创建它
+            logging.info("Database %s does not exist or connection failed: %s", db_name, e)
+            logging.info("Attempting to create database %s...", db_name)
+            create_database_if_missing(db_name)
+            pool = ThreadedConnectionPool(self.min_conn, self.max_conn, **get_db_connect_kwargs(db_name))
+        logging.info("Created connection pool for TimescaleDB database: %s", db_name)
+
+        # 检查TimescaleDB扩展是否已安装
+        conn = pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;")
+            logging.info("TimescaleDB extension enabled")
+        except psycopg2.Error as e:
+            logging.error("Error enabling TimescaleDB extension: %s", e)
+            logging.warning("Some features may not be available without TimescaleDB extension")
+        finally:
+            pool.putconn(conn)
+        return pool
+
+    def _evict_idle(self, keep):
+        """
+        按 LRU 关闭超出上限且没有连接被借出的年份连接池
+        """
+        for db_name in list(self._pools.keys()):
+            if len(self._pools) <= self.max_years:
+                break
+            entry = self._pools[db_name]
+            if db_name == keep or entry['in_use'] > 0:
+                continue
+            del self._pools[db_name]
+            entry['pool'].closeall()
+            invalidate_schema_cache(db_name)
+            logging.info("Closed idle connection pool for %s", db_name)
+
+    def get_entry(self, year, checkout=False):
+        """
+        获取年份对应的连接池条目，不存在则创建
+        checkout 为 True 时同时登记一次借出，防止条目在使用前被淘汰
+        """
+        db_name = get_db_name_for_year(year)
+        with self._lock:
+            entry = self._pools.get(db_name)
+            if entry is not None:
+                return self._use_entry(db_name, entry, checkout)
+            creation_lock = self._creation_locks.setdefault(db_name, threading.Lock())
+
+        # 网络连接和建库检查可能很慢，不能持有全局锁，否则数据库不可达时其他年份的调用方也会排队
+        with creation_lock:
+            with self._lock:
+                entry = self._pools.get(db_name)
+                if entry is not None:
+                    return self._use_entry(db_name, entry, checkout)
+            pool = self._create_pool(db_name)
+            with self._lock:
+                entry = {
+                    'pool': pool,
+                    'semaphore': threading.BoundedSemaphore(self.max_conn),
+                    'in_use': 0,
+                }
+                self._pools[db_name] = entry
+                return self._use_entry(db_name, entry, checkout)
+
+    def _use_entry(self, db_name, entry, checkout):
+        """
+        在持有全局锁时更新条目的 LRU 顺序和借出计数，并淘汰超出上限的空闲年份
+        """
+        self._pools.move_to_end(db_name)
+        if checkout:
+            entry['in_use'] += 1
+        self._evict_idle(keep=db_name)
+        return entry
+
+    @contextmanager
+    def connection(self, year):
+        """
+        借出指定年份数据库的连接，连接池满时阻塞等待
+        连接出现 OperationalError 时将其关闭而不是放回池中
+        """
+        entry = self.get_entry(year, checkout=True)
+        entry['semaphore'].acquire()
+        conn = None
+        broken = False
+        try:
+            conn = entry['pool'].getconn()
+            conn.autocommit = True
+            yield conn
+        except psycopg2.OperationalError:
+            # 连接需要重建，表结构缓存随之失效
+            broken = True
+            invalidate_schema_cache(get_db_name_for_year(year))
+            raise
+        finally:
+            if conn is not None:
+                entry['pool'].putconn(conn, close=broken or bool(conn.closed))
+            with self._lock:
+                entry['in_use'] -= 1
+            entry['semaphore'].release()
+
+    def close_all(self):
+        """
+        关闭所有年份的连接池
+        """
+        with self._lock:
+            for entry in self._pools.values():
+                entry['pool'].closeall()
+            self._pools.clear()
+        invalidate_schema_cache()
+
+# 按年份数据库管理的连接池
+db_pools = YearDatabasePools(DB_POOL_MAX_YEARS, DB_POOL_MIN_CONN, DB_POOL_MAX_CONN)
+
+class TimedCursor(BaseCursor):
+    """
+    记录每条语句耗时的游标，按语句类型（INSERT/UPDATE/SELECT 等）汇总到 DB_STATEMENT_SECONDS
+    """
+
+    def statement_kind(self, query):
+        """
+        获取语句的第一个关键字作为语句类型
+        """
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        if isinstance(query, bytes):
+            query = query[:64].decode('utf-8', 'ignore')
+        words = query.split(None, 1)
+        return words[0].upper() if words else 'UNKNOWN'
+
+    def execute(self, query, vars=None):
+        with DB_STATEMENT_SECONDS.labels(statement=self.statement_kind(query)).time():
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with DB_STATEMENT_SECONDS.labels(statement=self.statement_kind(query)).time():
+            return super().executemany(query, vars_list)
+
+@contextmanager
+def db_cursor(year=None):
+    """
+    从年份连接池中获取一个自动提交的游标，用完后归还连接
+    """
+    if year is None:
+        year = datetime.now().year
+    with db_pools.connection(year) as conn:
+        with conn.cursor(cursor_factory=TimedCursor) as cursor:
+            yield cursor
+
 # 初始化 TimescaleDB 连接
 def init_db_connection(year=None):
     """
-    初始化数据库连接，如果指定了年份，则连接到对应年份的数据库
+    初始化数据库连接池，如果指定了年份，则连接到对应年份的数据库
+    连接池在导入时不会创建，启动时由 initialize 调用，失败时返回 None
     """
     if year is None:
         year = datetime.now().year
-    
-    db_name = get_db_name_for_year(year)
-    
+
     try:
-        # 先尝试连接到指定年份的数据库
-        try:
-            conn = psycopg2.connect(
-                host=TIMESCALEDB_HOST,
-                port=TIMESCALEDB_PORT,
-                user=TIMESCALEDB_USER,
-                password=TIMESCALEDB_PASSWORD,
-                dbname=db_name
-            )
-            conn.autocommit = True
-            cursor = conn.cursor()
-            logging.info(f"Connected to TimescaleDB database: {db_name}")
-            
-            # 检查TimescaleDB扩展是否已安装
-            try:
-                cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;")
-                logging.info("TimescaleDB extension enabled")
-            except psycopg2.Error as e:
-                logging.error(f"Error enabling TimescaleDB extension: {e}")
-                logging.warning("Some features may not be available without TimescaleDB extension")
-            
-            return conn, cursor, db_name
-        except psycopg2.OperationalError as e:
-            # 如果数据库不存在，则创建它
-            logging.info(f"Database {db_name} does not exist or connection failed: {e}")
-            logging.info(f"Attempting to create database {db_name}...")
-            
-            # 连接到默认的postgres数据库
-            try:
-                temp_conn = psycopg2.connect(
-                    host=TIMESCALEDB_HOST,
-                    port=TIMESCALEDB_PORT,
-                    user=TIMESCALEDB_USER,
-                    password=TIMESCALEDB_PASSWORD,
-                    dbname="postgres"
-                )
-                temp_conn.autocommit = True
-                temp_cursor = temp_conn.cursor()
-                
-                # 检查数据库是否已存在
-                temp_cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{db_name}'")
-                exists = temp_cursor.fetchone()
-                
-                if not exists:
-                    # 创建数据库
-                    temp_cursor.execute(sql.SQL("CREATE DATABASE {}").format(
-                        sql.Identifier(db_name)
-                    ))
-                    logging.info(f"Created database {db_name}")
-                else:
-                    logging.info(f"Database {db_name} already exists but connection failed")
-                
-                temp_cursor.close()
-                temp_conn.close()
-            except psycopg2.Error as e:
-                logging.error(f"Error connecting to postgres database or creating {db_name}: {e}")
-                raise
-            
-            # 连接到新创建的数据库
-            try:
-                conn = psycopg2.connect(
-                    host=TIMESCALEDB_HOST,
-                    port=TIMESCALEDB_PORT,
-                    user=TIMESCALEDB_USER,
-                    password=TIMESCALEDB_PASSWORD,
-                    dbname=db_name
-                )
-                conn.autocommit = True
-                cursor = conn.cursor()
-                
-                # 检查TimescaleDB扩展是否已安装
-                try:
-                    cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;")
-                    logging.info("TimescaleDB extension enabled")
-                except psycopg2.Error as e:
-                    logging.error(f"Error enabling TimescaleDB extension: {e}")
-                    logging.warning("Some features may not be available without TimescaleDB extension")
-                
-                return conn, cursor, db_name
-            except psycopg2.Error as e:
-                logging.error(f"Error connecting to newly created database {db_name}: {e}")
-                raise
+        db_pools.get_entry(year)
+        return get_db_name_for_year(year)
     except Exception as e:
-        logging.error(f"Unexpected error during database initialization: {e}")
-        exit(1)
-
-# 初始化当前年份的数据库连接
-conn, cursor, current_db = init_db_connection()
+        logging.error("Unexpected error during database initialization: %s", e)
+        return None
 
 def sanitize_table_name(name):
     """
@@ -199,6 +796,102 @@ def sanitize_table_name(name):
     """
     return re.sub(r'\W+', '_', name)
 
+def get_http_stats():
+    """
+    获取 HTTP 客户端统计：请求数、连接池命中、新建/复用的连接数、重试与 304 次数
+    """
+    with http_stats_lock:
+        stats = dict(http_stats)
+
+    new_connections = 0
+    pool_requests = 0
+    pools = http_session.get_adapter(API_URL).poolmanager.pools
+    for pool_key in pools.keys():
+        pool = pools.get(pool_key)
+        if pool is None:
+            continue
+        new_connections += pool.num_connections
+        pool_requests += pool.num_requests
+
+    # 连接池命中：请求时对应主机的连接池已存在
+    stats['pool_hits'] = max(stats['requests'] - stats['pools_created'], 0)
+    stats['new_connections'] = new_connections
+    # 复用的连接：请求使用的是池中已建立的 keep-alive 连接
+    stats['reused_connections'] = max(pool_requests - new_connections, 0)
+    return stats
+
+def http_get_json(url, timeout=FETCH_TIMEOUT, deadline=None):
+    """
+    通过共享会话发起 GET 请求并解析 JSON
+    5xx 和超时会带抖动地指数退避重试；上游返回 ETag/Last-Modified 时使用条件请求，
+    304 时直接返回上次的结果
+    返回 (data, not_modified)
+    """
+    headers = {}
+    route_label = urlparse(url).path.strip('/') or '/'
+    with conditional_cache_lock:
+        cached = conditional_cache.get(url)
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    attempt = 0
+    while True:
+        request_timeout = timeout
+        if deadline is not None:
+            request_timeout = min(timeout, deadline - time.monotonic())
+            if request_timeout <= 0:
+                raise TimeoutError(f"Deadline reached before requesting {url}")
+
+        with http_stats_lock:
+            http_stats['requests'] += 1
+        try:
+            response = http_session.get(url, headers=headers, timeout=request_timeout)
+            HTTP_RESPONSES.labels(route=route_label, status=str(response.status_code)).inc()
+            if response.status_code < 500:
+                break
+            error = requests.HTTPError(f"{response.status_code} Server Error for url: {url}", response=response)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            HTTP_RESPONSES.labels(route=route_label, status='timeout' if isinstance(e, requests.Timeout) else 'error').inc()
+            error = e
+
+        # 计算带抖动的退避时间，超过重试次数或截止时间则放弃
+        backoff = HTTP_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+        if attempt >= HTTP_MAX_RETRIES or (deadline is not None and time.monotonic() + backoff >= deadline):
+            with http_stats_lock:
+                http_stats['errors'] += 1
+            raise error
+        attempt += 1
+        with http_stats_lock:
+            http_stats['retries'] += 1
+        logging.warning("Request to %s failed (%s), retry %s/%s in %.2fs", url, error, attempt, HTTP_MAX_RETRIES, backoff)
+        time.sleep(backoff)
+
+    if response.status_code == 304 and cached:
+        with http_stats_lock:
+            http_stats['not_modified'] += 1
+        return cached['data'], True
+
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        with http_stats_lock:
+            http_stats['errors'] += 1
+        raise
+    PAYLOAD_BYTES.labels(route=route_label).observe(len(response.content))
+    data = response.json()
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    with conditional_cache_lock:
+        if etag or last_modified:
+            conditional_cache[url] = {'etag': etag, 'last_modified': last_modified, 'data': data}
+        else:
+            conditional_cache.pop(url, None)
+    return data, False
+
 def fetch_all_routes():
     """
     获取 /all 接口的数据
@@ -210,29 +903,40 @@ def fetch_all_routes():
         else:
             all_url = f"{API_URL}/all"
             
-        logging.info(f"Fetching routes from: {all_url}")
-        response = requests.get(all_url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        logging.info("Fetching routes from: %s", all_url)
+        data, _ = http_get_json(all_url)
         if data.get("code") == 200:
             logging.info("Fetched routes successfully")
             return data
         else:
-            logging.error(f"API returned error code: {data.get('code')}")
+            logging.error("API returned error code: %s", data.get('code'))
             return None
-    except requests.RequestException as e:
-        logging.error(f"Error fetching /all routes: {e}")
+    except (requests.RequestException, ValueError, TimeoutError) as e:
+        logging.error("Error fetching /all routes: %s", e)
         return None
 
+def catalog_fingerprint(data):
+    """
+    计算路由目录的指纹，路由顺序不影响结果
+    """
+    routes = sorted(data.get('routes', []), key=lambda route: str(route.get('path')))
+    return hashlib.md5(json.dumps(routes, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
 def cache_routes(data):
     """
-    将 /all 接口的结果缓存到 Redis
+    将 /all 接口的结果缓存到 Redis，并原子地更新目录版本号
+    内容未变化时不修改版本号；返回当前版本号，Redis 不可用时返回 None
     """
     try:
-        redis_client.set(ROUTES_CACHE_KEY, json.dumps(data))
-        logging.info("Cached /all routes to Redis")
+        version = int(publish_catalog_script(
+            keys=[ROUTES_CACHE_KEY, CATALOG_VERSION_KEY],
+            args=[catalog_fingerprint(data), json.dumps(data)]
+        ))
+        logging.info("Cached /all routes to Redis (catalog version %s)", version)
+        return version
     except redis.exceptions.RedisError as e:
-        logging.error(f"Error caching routes in Redis: {e}")
+        logging.error("Error caching routes in Redis: %s", e)
+        return None
 
 def get_cached_routes():
     """
@@ -246,579 +950,3344 @@ def get_cached_routes():
             logging.error("No cached routes found in Redis")
             return None
     except redis.exceptions.RedisError as e:
-        logging.error(f"Error retrieving cached routes from Redis: {e}")
+        logging.error("Error retrieving cached routes from Redis: %s", e)
+        return None
+
+def apply_timescale_policies(cursor, table_name, segment_by, order_by):
+    """
+    为 hypertable 配置原生压缩（按 segment_by 分段、按 order_by 排序）、压缩策略和可选的保留策略
+    已经启用压缩的表不会重复修改压缩设置
+    """
+    if COMPRESS_AFTER_DAYS > 0:
+        try:
+            cursor.execute("""
+                SELECT compression_enabled FROM timescaledb_information.hypertables
+                WHERE hypertable_name = %s
+            """, [table_name])
+            row = cursor.fetchone()
+            if row is not None and not row[0]:
+                cursor.execute(sql.SQL("""
+                    ALTER TABLE {} SET (
+                        timescaledb.compress,
+                        timescaledb.compress_segmentby = %s,
+                        timescaledb.compress_orderby = %s
+                    )
+                """).format(sql.Identifier(table_name)), [segment_by, order_by])
+                logging.info("Enabled compression on %s segmented by %s", table_name, segment_by)
+            cursor.execute("""
+                SELECT add_compression_policy(%s, make_interval(days => %s), if_not_exists => TRUE)
+            """, [table_name, COMPRESS_AFTER_DAYS])
+        except psycopg2.Error as e:
+            logging.error("Error configuring compression for %s: %s", table_name, e)
+
+    if RETENTION_DAYS > 0:
+        try:
+            cursor.execute("""
+                SELECT add_retention_policy(%s, make_interval(days => %s), if_not_exists => TRUE)
+            """, [table_name, RETENTION_DAYS])
+        except psycopg2.Error as e:
+            logging.error("Error configuring retention for %s: %s", table_name, e)
+
+def ensure_continuous_aggregates(cursor):
+    """
+    为 hot_samples 创建每小时和每天的连续聚合及刷新策略，
+    并创建按路由取排名前 CAGG_TOP_N 的 Top-N 视图
+    """
+    aggregates = [
+        # (视图名, 时间桶, 刷新起点, 刷新间隔)
+        (f"{SAMPLES_TABLE}_hourly", '1 hour', '3 hours', '30 minutes'),
+        (f"{SAMPLES_TABLE}_daily", '1 day', '3 days', '1 hour'),
+    ]
+    for view_name, bucket, start_offset, schedule_interval in aggregates:
+        try:
+            cursor.execute(sql.SQL("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+                WITH (timescaledb.continuous) AS
+                SELECT time_bucket(INTERVAL {bucket}, ingestion_time) AS bucket,
+                       route,
+                       item_id,
+                       max(hot) AS max_hot,
+                       min(rank) AS best_rank,
+                       count(*) AS samples
+                FROM {samples}
+                GROUP BY bucket, route, item_id
+                WITH NO DATA
+            """).format(
+                view=sql.Identifier(view_name),
+                bucket=sql.Literal(bucket),
+                samples=sql.Identifier(SAMPLES_TABLE)
+            ))
+            cursor.execute("""
+                SELECT add_continuous_aggregate_policy(%s,
+                    start_offset => %s::interval,
+                    end_offset => INTERVAL '1 hour',
+                    schedule_interval => %s::interval,
+                    if_not_exists => TRUE)
+            """, [view_name, start_offset, schedule_interval])
+
+            cursor.execute(sql.SQL("""
+                CREATE OR REPLACE VIEW {top_view} AS
+                SELECT ranked.bucket, ranked.route, ranked.position, ranked.item_id,
+                       i.title, i.url, ranked.max_hot, ranked.best_rank, ranked.samples
+                FROM (
+                    SELECT a.*, row_number() OVER (
+                        PARTITION BY a.route, a.bucket
+                        ORDER BY a.best_rank, a.max_hot DESC NULLS LAST
+                    ) AS position
+                    FROM {view} a
+                ) ranked
+                LEFT JOIN {items} i ON i.item_id = ranked.item_id
+                WHERE ranked.position <= {top_n}
+            """).format(
+                top_view=sql.Identifier(f"{view_name}_top"),
+                view=sql.Identifier(view_name),
+                items=sql.Identifier(ITEMS_TABLE),
+                top_n=sql.Literal(CAGG_TOP_N)
+            ))
+            logging.info("Ensured continuous aggregate %s", view_name)
+        except psycopg2.Error as e:
+            logging.error("Error creating continuous aggregate %s: %s", view_name, e)
+
+def report_timescale_stats(year=None):
+    """
+    启动检查：输出当前年份数据库中各 hypertable 的数据块数量、压缩数据块数量和压缩前后大小
+    """
+    if year is None:
+        year = datetime.now().year
+    db_name = get_db_name_for_year(year)
+    try:
+        with db_cursor(year) as cursor:
+            cursor.execute("""
+                SELECT h.hypertable_name,
+                       h.num_chunks,
+                       h.compression_enabled,
+                       COALESCE(s.number_compressed_chunks, 0),
+                       COALESCE(s.before_compression_total_bytes, 0),
+                       COALESCE(s.after_compression_total_bytes, 0),
+                       hypertable_size(format('%I.%I', h.hypertable_schema, h.hypertable_name)::regclass)
+                FROM timescaledb_information.hypertables h
+                LEFT JOIN LATERAL hypertable_compression_stats(
+                    format('%I.%I', h.hypertable_schema, h.hypertable_name)::regclass
+                ) s ON TRUE
+                ORDER BY h.hypertable_name
+            """)
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        logging.error("Error reading TimescaleDB stats from %s: %s", db_name, e)
         return None
 
-def ensure_table_exists(base_name):
+    total_chunks = total_compressed = total_size = 0
+    for table_name, num_chunks, compression_enabled, compressed_chunks, before_bytes, after_bytes, size in rows:
+        total_chunks += num_chunks or 0
+        total_compressed += compressed_chunks
+        total_size += size or 0
+        ratio = f"{before_bytes / after_bytes:.1f}x" if after_bytes else "n/a"
+        logging.info("%s.%s: %s chunks, %s compressed (compression %s, ratio %s), %s bytes",
+                     db_name, table_name, num_chunks, compressed_chunks,
+                     'on' if compression_enabled else 'off', ratio, size or 0)
+    logging.info("%s: %d hypertables, %s chunks, %s compressed, %s bytes total",
+                 db_name, len(rows), total_chunks, total_compressed, total_size)
+    return rows
+
+def legacy_table_ddl(table_name):
+    """
+    生成旧版路由表的建表语句，包含唯一约束（确保 ingestion_time 在前）
+    """
+    return sql.SQL("""
+        CREATE TABLE {table} (
+            ingestion_time TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            update_time TIMESTAMPTZ NOT NULL,
+            title TEXT,
+            "desc" TEXT,
+            cover TEXT,
+            item_timestamp BIGINT,
+            hot TEXT,
+            url TEXT,
+            mobile_url TEXT,
+            sort_order TEXT
+        );
+
+        -- 添加唯一约束（确保ingestion_time在前）
+        ALTER TABLE {table} ADD CONSTRAINT {constraint}
+        UNIQUE (ingestion_time, title, item_timestamp);
+    """).format(
+        table=sql.Identifier(table_name),
+        constraint=sql.Identifier(f"{table_name}_unique_constraint")
+    )
+
+def ensure_table_exists(base_name, year=None):
     """
     检查表是否存在，不存在则创建，并转换为 TimescaleDB 的 hypertable
     修复现有表的约束问题，使用缓存避免重复检查
+    year: 目标年份数据库，默认为当前年份
+    数据库不可达时抛出 OperationalError，表无法创建时返回 None
     """
-    global table_checked_cache
-    
+    if year is None:
+        year = datetime.now().year
+
     table_name = f"records_{base_name}"
     constraint_name = f"{table_name}_unique_constraint"
     
-    # 使用数据库名和表名作为缓存键
-    cache_key = f"{current_db}:{table_name}"
+    db_name = get_db_name_for_year(year)
     
     # 如果已经检查过该表，直接返回
-    if cache_key in table_checked_cache:
+    if get_table_metadata(db_name, table_name) is not None:
         return table_name
     
     try:
-        # 先检查表是否存在
-        cursor.execute(
-            "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = %s)",
-            [table_name]
-        )
-        table_exists = cursor.fetchone()[0]
-        
-        if not table_exists:
-            # 创建表并添加必要约束
-            create_table_query = sql.SQL("""
-                CREATE TABLE {} (
-                    ingestion_time TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                    update_time TIMESTAMPTZ NOT NULL,
-                    title TEXT,
-                    "desc" TEXT,
-                    cover TEXT,
-                    item_timestamp BIGINT,
-                    hot TEXT,
-                    url TEXT,
-                    mobile_url TEXT,
-                    sort_order TEXT
-                );
-                
-                -- 添加唯一约束（确保ingestion_time在前）
-                ALTER TABLE {} ADD CONSTRAINT {} 
-                UNIQUE (ingestion_time, title, item_timestamp);
-            """).format(
-                sql.Identifier(table_name),
-                sql.Identifier(table_name),
-                sql.Identifier(constraint_name)
+        # 串行化表检查，避免并发写入时重复建表
+        with table_bootstrap_lock, db_cursor(year) as cursor:
+            if get_table_metadata(db_name, table_name) is not None:
+                return table_name
+
+            # 先检查表是否存在
+            cursor.execute(
+                "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = %s)",
+                [table_name]
             )
+            table_exists = cursor.fetchone()[0]
+        
+            if not table_exists:
+                # 创建表并添加必要约束
+                cursor.execute(legacy_table_ddl(table_name))
+                logging.info("Table %s created with explicit unique constraint", table_name)
             
-            cursor.execute(create_table_query)
-            logging.info(f"Table {table_name} created with explicit unique constraint")
-            
-            # 创建hypertable并按时间自动分片（新表可以直接转换）
-            try:
-                create_hypertable_query = """
-                    SELECT create_hypertable(%s, 'ingestion_time', 
-                                          chunk_time_interval => INTERVAL '1 day', 
-                                          if_not_exists => TRUE);
-                """
-                cursor.execute(create_hypertable_query, [table_name])
-                logging.info(f"Table {table_name} converted to hypertable")
-            except psycopg2.Error as e:
-                logging.error(f"Error converting {table_name} to hypertable: {e}")
-                # 即使转换为hypertable失败，表仍然可以使用
-                logging.warning(f"Will use {table_name} as a regular table")
-        else:
-            # 表已存在，需要检查和修复约束
-            logging.info(f"Table {table_name} already exists, checking constraints...")
-            
-            # 检查是否存在正确的唯一约束（包含ingestion_time）
-            cursor.execute("""
-                SELECT conname FROM pg_constraint 
-                WHERE conrelid = %s::regclass 
-                AND contype = 'u' 
-                AND array_to_string(conkey, ',') = (
-                    SELECT array_to_string(array_agg(attnum ORDER BY attnum), ',')
-                    FROM pg_attribute 
-                    WHERE attrelid = %s::regclass 
-                    AND attname IN ('ingestion_time', 'title', 'item_timestamp')
-                    AND NOT attisdropped
-                )
-            """, [table_name, table_name])
-            correct_constraint = cursor.fetchone()
+                # 创建hypertable并按时间自动分片（新表可以直接转换）
+                try:
+                    create_hypertable_query = """
+                        SELECT create_hypertable(%s, 'ingestion_time', 
+                                              chunk_time_interval => INTERVAL '1 day', 
+                                              if_not_exists => TRUE);
+                    """
+                    cursor.execute(create_hypertable_query, [table_name])
+                    logging.info("Table %s converted to hypertable", table_name)
+                except psycopg2.Error as e:
+                    logging.error("Error converting %s to hypertable: %s", table_name, e)
+                    # 即使转换为hypertable失败，表仍然可以使用
+                    logging.warning("Will use %s as a regular table", table_name)
+            else:
+                # 表已存在，需要检查和修复约束
+                logging.info("Table %s already exists, checking constraints...", table_name)
             
-            if not correct_constraint:
-                # 删除所有现有的唯一约束
+                # 检查是否存在正确的唯一约束（包含ingestion_time）
                 cursor.execute("""
                     SELECT conname FROM pg_constraint 
-                    WHERE conrelid = %s::regclass AND contype = 'u'
-                """, [table_name])
-                existing_constraints = cursor.fetchall()
+                    WHERE conrelid = %s::regclass 
+                    AND contype = 'u' 
+                    AND array_to_string(conkey, ',') = (
+                        SELECT array_to_string(array_agg(attnum ORDER BY attnum), ',')
+                        FROM pg_attribute 
+                        WHERE attrelid = %s::regclass 
+                        AND attname IN ('ingestion_time', 'title', 'item_timestamp')
+                        AND NOT attisdropped
+                    )
+                """, [table_name, table_name])
+                correct_constraint = cursor.fetchone()
+            
+                if not correct_constraint:
+                    # 删除所有现有的唯一约束
+                    cursor.execute("""
+                        SELECT conname FROM pg_constraint 
+                        WHERE conrelid = %s::regclass AND contype = 'u'
+                    """, [table_name])
+                    existing_constraints = cursor.fetchall()
                 
-                for (constraint,) in existing_constraints:
-                    try:
-                        drop_constraint_query = sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
-                            sql.Identifier(table_name),
-                            sql.Identifier(constraint)
-                        )
-                        cursor.execute(drop_constraint_query)
-                        logging.info(f"Dropped existing constraint {constraint} from {table_name}")
-                    except psycopg2.Error as e:
-                        logging.error(f"Error dropping constraint {constraint}: {e}")
+                    for (constraint,) in existing_constraints:
+                        try:
+                            drop_constraint_query = sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+                                sql.Identifier(table_name),
+                                sql.Identifier(constraint)
+                            )
+                            cursor.execute(drop_constraint_query)
+                            logging.info("Dropped existing constraint %s from %s", constraint, table_name)
+                        except psycopg2.Error as e:
+                            logging.error("Error dropping constraint %s: %s", constraint, e)
                 
-                # 添加正确的唯一约束
-                add_constraint_query = sql.SQL("""
-                    ALTER TABLE {} ADD CONSTRAINT {} 
-                    UNIQUE (ingestion_time, title, item_timestamp);
-                """).format(
-                    sql.Identifier(table_name),
-                    sql.Identifier(constraint_name)
-                )
-                try:
-                    cursor.execute(add_constraint_query)
-                    logging.info(f"Added correct unique constraint to existing table {table_name}")
-                except psycopg2.Error as e:
-                    logging.error(f"Error adding unique constraint to {table_name}: {e}")
-                    # 如果还是失败，可能是数据重复，尝试清理重复数据
+                    # 添加正确的唯一约束
+                    add_constraint_query = sql.SQL("""
+                        ALTER TABLE {} ADD CONSTRAINT {} 
+                        UNIQUE (ingestion_time, title, item_timestamp);
+                    """).format(
+                        sql.Identifier(table_name),
+                        sql.Identifier(constraint_name)
+                    )
                     try:
-                        # 删除重复数据，只保留最早的记录
-                        dedupe_query = sql.SQL("""
-                            DELETE FROM {} WHERE ctid NOT IN (
-                                SELECT min(ctid) FROM {} 
-                                GROUP BY ingestion_time, title, item_timestamp
-                            );
-                        """).format(sql.Identifier(table_name), sql.Identifier(table_name))
-                        cursor.execute(dedupe_query)
-                        deleted_count = cursor.rowcount
-                        logging.info(f"Removed {deleted_count} duplicate rows from {table_name}")
-                        
-                        # 重新尝试添加约束
                         cursor.execute(add_constraint_query)
-                        logging.info(f"Successfully added unique constraint after deduplication")
-                    except psycopg2.Error as e2:
-                        logging.error(f"Failed to add constraint even after deduplication: {e2}")
-                        # 作为最后手段，不使用约束
-                        logging.warning(f"Will use {table_name} without unique constraint")
+                        logging.info("Added correct unique constraint to existing table %s", table_name)
+                    except psycopg2.Error as e:
+                        logging.error("Error adding unique constraint to %s: %s", table_name, e)
+                        # 如果还是失败，可能是数据重复，尝试清理重复数据
+                        try:
+                            # 删除重复数据，只保留最早的记录
+                            dedupe_query = sql.SQL("""
+                                DELETE FROM {} WHERE ctid NOT IN (
+                                    SELECT min(ctid) FROM {} 
+                                    GROUP BY ingestion_time, title, item_timestamp
+                                );
+                            """).format(sql.Identifier(table_name), sql.Identifier(table_name))
+                            cursor.execute(dedupe_query)
+                            deleted_count = cursor.rowcount
+                            logging.info("Removed %s duplicate rows from %s", deleted_count, table_name)
+                        
+                            # 重新尝试添加约束
+                            cursor.execute(add_constraint_query)
+                            logging.info("Successfully added unique constraint after deduplication")
+                        except psycopg2.Error as e2:
+                            logging.error("Failed to add constraint even after deduplication: %s", e2)
+                            # 作为最后手段，不使用约束
+                            logging.warning("Will use %s without unique constraint", table_name)
             
-            # 检查表是否已经是hypertable
-            cursor.execute("""
-                SELECT count(*) FROM _timescaledb_catalog.hypertable
-                WHERE table_name = %s
-            """, [table_name])
-            is_hypertable = cursor.fetchone()[0] > 0
+                # 检查表是否已经是hypertable
+                cursor.execute("""
+                    SELECT count(*) FROM _timescaledb_catalog.hypertable
+                    WHERE table_name = %s
+                """, [table_name])
+                is_hypertable = cursor.fetchone()[0] > 0
             
-            if not is_hypertable:
-                try:
-                    # 为现有表转换为hypertable，需要添加migrate_data参数
-                    create_hypertable_query = """
-                        SELECT create_hypertable(%s, 'ingestion_time', 
-                                            chunk_time_interval => INTERVAL '1 day',
-                                            migrate_data => true,
-                                            if_not_exists => TRUE);
-                    """
-                    cursor.execute(create_hypertable_query, [table_name])
-                    logging.info(f"Converted existing table {table_name} to hypertable with data migration")
-                except psycopg2.Error as e:
-                    logging.error(f"Error converting existing table {table_name} to hypertable: {e}")
-                    logging.warning(f"Will use {table_name} as a regular table")
+                if not is_hypertable:
+                    try:
+                        # 为现有表转换为hypertable，需要添加migrate_data参数
+                        create_hypertable_query = """
+                            SELECT create_hypertable(%s, 'ingestion_time', 
+                                                chunk_time_interval => INTERVAL '1 day',
+                                                migrate_data => true,
+                                                if_not_exists => TRUE);
+                        """
+                        cursor.execute(create_hypertable_query, [table_name])
+                        logging.info("Converted existing table %s to hypertable with data migration", table_name)
+                    except psycopg2.Error as e:
+                        logging.error("Error converting existing table %s to hypertable: %s", table_name, e)
+                        logging.warning("Will use %s as a regular table", table_name)
 
-        # 添加到缓存，避免重复检查
-        table_checked_cache.add(cache_key)
-        logging.info(f"Ensured table {table_name} exists with proper constraints")
-        return table_name
+            # DDL 完成后重新读取表结构并缓存，避免重复检查
+            metadata = load_table_metadata(cursor, db_name, table_name)
+            if metadata['is_hypertable']:
+                # 唯一约束的列必须包含在分段或排序列中
+                apply_timescale_policies(cursor, table_name, 'title', 'ingestion_time DESC, item_timestamp')
+            logging.info("Ensured table %s exists with proper constraints", table_name)
+            return table_name
+    except psycopg2.OperationalError:
+        # 数据库不可达时交给调用方缓冲后重试，其他错误说明表无法创建，返回 None
+        raise
     except Exception as e:
-        logging.error(f"Unexpected error ensuring table exists for {table_name}: {e}")
+        logging.error("Unexpected error ensuring table exists for %s: %s", table_name, e)
         return None
 
-def get_or_create_db_for_timestamp(base_name, timestamp, update_time=None):
+def load_catalog_metadata(cursor, db_name, table_names):
+    """
+    一次目录查询读取多张表的唯一约束、hypertable 状态和列布局，并写入缓存
+    返回 (已存在的表名集合, 需要修复的表名列表)：缺少正确唯一约束或不是 hypertable 的表需要修复
+    唯一约束不正确的表按没有约束缓存，修复前使用普通 INSERT 写入，修复后重新读取时才改用 ON CONFLICT
+    """
+    cursor.execute("""
+        SELECT c.relname,
+               EXISTS (
+                   SELECT 1 FROM pg_constraint con
+                   WHERE con.conrelid = c.oid AND con.contype = 'u'
+                   AND ARRAY(
+                       SELECT a.attname::text FROM pg_attribute a
+                       WHERE a.attrelid = c.oid AND a.attnum = ANY(con.conkey)
+                       ORDER BY 1
+                   ) = ARRAY['ingestion_time', 'item_timestamp', 'title']
+               ),
+               ARRAY(
+                   SELECT a.attname::text FROM pg_attribute a
+                   WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                   ORDER BY a.attnum
+               ),
+               EXISTS (
+                   SELECT 1 FROM _timescaledb_catalog.hypertable h
+                   WHERE h.schema_name = n.nspname AND h.table_name = c.relname
+               )
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = ANY(%s) AND c.relkind IN ('r', 'p') AND pg_table_is_visible(c.oid)
+    """, [list(table_names)])
+
+    found = set()
+    needs_repair = []
+    for table_name, has_correct_constraint, columns, is_hypertable in cursor.fetchall():
+        found.add(table_name)
+        with schema_cache_lock:
+            schema_cache[(db_name, table_name)] = {
+                'has_unique_constraint': has_correct_constraint,
+                'is_hypertable': is_hypertable,
+                'columns': list(columns),
+            }
+        if not has_correct_constraint or not is_hypertable:
+            needs_repair.append(table_name)
+    return found, needs_repair
+
+def bootstrap_legacy_tables(base_names, year=None):
+    """
+    启动时批量准备旧版路由表：一次目录查询读取所有表的状态，缺失的表在一个事务中一起创建，
+    约束修复和压缩、保留策略推迟到后台执行（见 run_deferred_table_work），不阻塞第一轮抓取
+    返回 (需要修复的路由表基础名列表, 需要配置策略的表名列表)，批量建表失败的表也交给后台修复
+    """
+    if year is None:
+        year = datetime.now().year
+    db_name = get_db_name_for_year(year)
+    table_bases = {f"records_{base_name}": base_name for base_name in base_names}
+    pending = [table_name for table_name in table_bases if get_table_metadata(db_name, table_name) is None]
+    if not pending:
+        return [], []
+
+    started = time.perf_counter()
+    repair = []
+    policies = []
+    created = []
+    with table_bootstrap_lock, db_cursor(year) as cursor:
+        found, needs_repair = load_catalog_metadata(cursor, db_name, pending)
+        repair.extend(needs_repair)
+        policies.extend(table_name for table_name in found if table_name not in needs_repair)
+        missing = [table_name for table_name in pending if table_name not in found]
+        if missing:
+            statements = []
+            for table_name in missing:
+                statements.append(legacy_table_ddl(table_name))
+                statements.append(sql.SQL("""
+                    SELECT create_hypertable({}, 'ingestion_time',
+                                          chunk_time_interval => INTERVAL '1 day',
+                                          if_not_exists => TRUE);
+                """).format(sql.Literal(table_name)))
+            try:
+                # 多条语句一次发送，在同一个隐式事务中执行，任一语句失败时全部回滚
+                cursor.execute(sql.Composed(statements))
+                created, needs_repair = load_catalog_metadata(cursor, db_name, missing)
+                policies.extend(created)
+                repair.extend(needs_repair)
+                logging.info("Created %d tables in %s in one transaction", len(created), db_name)
+            except psycopg2.OperationalError:
+                raise
+            except psycopg2.Error as e:
+                logging.error("Error creating %d tables in %s: %s", len(missing), db_name, e)
+                repair.extend(missing)
+
+    logging.info("Bootstrapped %d tables in %s in %.2fs (%d created, %d deferred for repair)",
+                 len(pending), db_name, time.perf_counter() - started, len(created), len(repair))
+    return [table_bases[table_name] for table_name in repair], policies
+
+def run_deferred_table_work(year, repair_bases, policy_tables):
+    """
+    后台执行启动时推迟的表维护：修复缺少正确约束或 hypertable 的表（包括批量创建失败的表），
+    为 hypertable 配置压缩与保留策略，最后输出数据块与压缩情况
+    """
+    db_name = get_db_name_for_year(year)
+    for base_name in repair_bases:
+        # 清除批量启动时写入的缓存，让 ensure_table_exists 重新检查并修复
+        invalidate_schema_cache(db_name, f"records_{base_name}")
+        try:
+            ensure_table_exists(base_name, year)
+        except psycopg2.OperationalError as e:
+            # 未修复的表会在首次写入时再次检查
+            logging.error("Database unavailable while repairing tables in %s: %s", db_name, e)
+            return
+
+    if policy_tables:
+        try:
+            with table_bootstrap_lock, db_cursor(year) as cursor:
+                for table_name in policy_tables:
+                    # 唯一约束的列必须包含在分段或排序列中
+                    apply_timescale_policies(cursor, table_name, 'title', 'ingestion_time DESC, item_timestamp')
+        except psycopg2.Error as e:
+            logging.error("Error applying TimescaleDB policies in %s: %s", db_name, e)
+
+    logging.info("Deferred table maintenance finished in %s: %d repaired, %d policy checks",
+                 db_name, len(repair_bases), len(policy_tables))
+    # 启动检查：输出当前的数据块与压缩情况
+    report_timescale_stats(year)
+
+def get_year_for_timestamp(timestamp, update_time=None):
+    """
+    根据updateTime或时间戳确定数据所属的年份
+    """
+    # 优先使用update_time的年份，如果没有则使用时间戳的年份
+    if update_time:
+        return update_time.year
+    # 将时间戳转换为datetime对象
+    try:
+        return datetime.fromtimestamp(timestamp).year
+    except (ValueError, OverflowError):
+        logging.error("Invalid timestamp %s, using current year", timestamp)
+        return datetime.now().year
+
+def get_or_create_db_for_timestamp(base_name, timestamp, update_time=None):
     """
     根据时间戳或updateTime获取或创建对应年份的数据库，并确保表存在
     update_time: 更新时间的datetime对象，优先使用此时间的年份
+    每个年份数据库都有独立的连接池，跨年时不需要重连
+    """
+    global latest_year
+
+    year = get_year_for_timestamp(timestamp, update_time)
+
+    # 记录出现过的最新年份，Redis 不可用时不影响数据库写入，下次写入时再记录
+    if latest_year is None or year > latest_year:
+        try:
+            redis_client.set(CURRENT_YEAR_KEY, year)
+            latest_year = year
+            logging.info("Year changed or initialized to %d", year)
+        except redis.exceptions.RedisError as e:
+            logging.warning("Could not record current year %d in Redis: %s", year, e)
+
+    # 确保表存在
+    return ensure_table_exists(base_name, year)
+
+def should_log_item():
+    """
+    调试级别的数据项日志按 LOG_ITEM_SAMPLE_RATE 采样，未启用 DEBUG 时直接返回 False
+    """
+    return logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < LOG_ITEM_SAMPLE_RATE
+
+def normalize_item_timestamp(timestamp_value, update_time, current_timestamp, title=None):
+    """
+    规范化数据项的时间戳：毫秒转秒，无效时间戳回退到update_time或当前时间
+    """
+    # 获取时间戳，确保即使值为None也转换为0
+    item_timestamp = 0 if timestamp_value is None else timestamp_value
+    # 字符串形式的数字按数值处理，其他类型及 NaN、Infinity 按无效时间戳处理
+    if isinstance(item_timestamp, str):
+        try:
+            item_timestamp = float(item_timestamp)
+        except ValueError:
+            item_timestamp = 0
+    if (isinstance(item_timestamp, bool) or not isinstance(item_timestamp, (int, float))
+            or not math.isfinite(item_timestamp)):
+        item_timestamp = 0
+
+    # 判断时间戳是毫秒还是秒级
+    # 如果大于 32503680000（1000年的秒数），则认为是毫秒并转换为秒
+    if item_timestamp > 32503680000:
+        item_timestamp = item_timestamp / 1000
+
+    # 允许的时间范围：1970年至当前时间后10年
+    if item_timestamp <= 0 or item_timestamp > (current_timestamp + 315360000):  # 当前时间 + 10年的秒数
+        # 对于无效时间戳，使用update_time的时间戳而不是当前时间
+        if update_time:
+            item_timestamp = int(update_time.timestamp())
+            if should_log_item():
+                logging.debug("Using update_time as timestamp for item with title '%s'", title)
+        else:
+            item_timestamp = current_timestamp
+            logging.warning("Invalid timestamp %s for item with title '%s', using current time instead", timestamp_value, title)
+
+    return item_timestamp
+
+def compute_content_hash(item, item_timestamp):
+    """
+    计算数据项内容（不含热度和排名）的哈希，用于判断数据项是否发生变化
+    """
+    content = [
+        item.get('title'), item.get('desc'), item.get('cover'),
+        item.get('url'), item.get('mobileUrl'), item_timestamp
+    ]
+    return hashlib.md5(json.dumps(content, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+class HotItem:
+    """
+    规范化后的数据项，使用 __slots__ 避免每个数据项一个属性字典
+    timestamp 为规范化后的时间戳（秒，作为 Redis 分数），item_timestamp 为数据库中存储的整数秒，
+    hot 为字符串形式的热度，hot_value 为解析后的整数热度（无法解析时为 None），
+    in_window 表示数据项不早于 updateTime 年份 10 年，raw 为原始数据项（用于序列化 Redis 成员和本地缓冲）
+    """
+
+    __slots__ = ('raw', 'title', 'desc', 'cover', 'url', 'mobile_url', 'timestamp', 'item_timestamp',
+                 'hot', 'item_id', 'content_hash', 'in_window', 'hot_value')
+
+    def __init__(self, raw, title, desc, cover, url, mobile_url, timestamp, item_timestamp,
+                 hot, item_id, content_hash, in_window, hot_value):
+        self.raw = raw
+        self.title = title
+        self.desc = desc
+        self.cover = cover
+        self.url = url
+        self.mobile_url = mobile_url
+        self.timestamp = timestamp
+        self.item_timestamp = item_timestamp
+        self.hot = hot
+        self.item_id = item_id
+        self.content_hash = content_hash
+        self.in_window = in_window
+        self.hot_value = hot_value
+
+class RouteSnapshot:
+    """
+    一次抓取得到的路由快照，由 normalize_route_snapshot 构建一次，Redis 与各数据库布局的写入共用
+    """
+
+    __slots__ = ('name', 'sanitized_name', 'key', 'update_time', 'items')
+
+    def __init__(self, name, sanitized_name, key, update_time, items):
+        self.name = name
+        self.sanitized_name = sanitized_name
+        self.key = key
+        self.update_time = update_time
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def raw_items(self):
+        """
+        原始数据项列表，写入本地缓冲时使用，重放时重新规范化
+        """
+        return [item.raw for item in self.items]
+
+def normalize_route_snapshot(name, sanitized_name, key, data_list, update_time, current_timestamp=None):
+    """
+    批量规范化一个路由的数据：一次遍历完成毫秒/秒时间戳转换、有效时间范围判断、hot 转字符串和解析，
+    并计算数据项 ID 与内容哈希；当前时间与有效范围的起点每批只计算一次
+    无法规范化的数据项单独跳过，不影响同一路由的其他数据项写入 Redis 和数据库
+    current_timestamp: 本轮的当前时间（秒），默认为调用时的时间
+    """
+    if current_timestamp is None:
+        current_timestamp = int(time.time())
+    # 早于 updateTime 年份 10 年的数据项不写入旧布局，直接比较时间戳，不必为每个数据项创建 datetime
+    window_start = datetime(update_time.year - 10, 1, 1).timestamp() if update_time else None
+
+    items = []
+    for raw in data_list:
+        try:
+            title = raw.get('title')
+            timestamp = normalize_item_timestamp(raw.get('timestamp'), update_time, current_timestamp, title)
+            # 数据库中以秒级整数存储时间戳
+            item_timestamp = int(timestamp)
+            items.append(HotItem(
+                raw, title, raw.get('desc'), raw.get('cover'), raw.get('url'), raw.get('mobileUrl'),
+                timestamp, item_timestamp, str(raw.get('hot', '')),
+                compute_item_id(sanitized_name, raw), compute_content_hash(raw, item_timestamp),
+                window_start is None or timestamp >= window_start, parse_hot_value(raw.get('hot'))
+            ))
+        except (AttributeError, TypeError, ValueError, OverflowError) as e:
+            logging.warning("Skipping malformed item in %s: %s (%r)", name, e, raw)
+    return RouteSnapshot(name, sanitized_name, key, update_time, items)
+
+def get_recent_items(cache_name, item_ids):
+    """
+    从最近数据项缓存中读取多个数据项，返回 {item_id: value}
+    """
+    with recent_item_cache_lock:
+        cache = recent_item_cache.get(cache_name)
+        if not cache:
+            return {}
+        found = {}
+        for item_id in item_ids:
+            value = cache.get(item_id)
+            if value is not None:
+                cache.move_to_end(item_id)
+                found[item_id] = value
+        return found
+
+def remember_recent_items(cache_name, entries):
+    """
+    将写入成功的数据项记入最近数据项缓存，超过 ITEM_HASH_CACHE_SIZE 时淘汰最久未见的数据项
+    """
+    with recent_item_cache_lock:
+        cache = recent_item_cache.setdefault(cache_name, OrderedDict())
+        for item_id, value in entries.items():
+            cache[item_id] = value
+            cache.move_to_end(item_id)
+        while len(cache) > ITEM_HASH_CACHE_SIZE:
+            cache.popitem(last=False)
+
+def prepare_db_rows(snapshot, sort_orders=None):
+    """
+    将一个路由快照转换为待写入的行，并合并同一批次内的重复记录
+    返回 (rows, merged_count)，rows 中的 hot/sort_order 按照与 ON CONFLICT 相同的方式拼接（新值在前），
+    并附带稳定的 item_id 与内容哈希
+    """
+    update_time = snapshot.update_time
+    rows = {}
+    merged_count = 0
+
+    for index, item in enumerate(snapshot.items):
+        sort_order = sort_orders[index] if sort_orders is not None else str(index)
+
+        # 检查数据年份是否超过updateTime年份10年，如果超过则忽略
+        if not item.in_window:
+            logging.warning("Ignoring data item with title '%s' as its year %d is more than 10 years before update time year %d",
+                            item.title, datetime.fromtimestamp(item.item_timestamp).year, update_time.year)
+            continue
+
+        row_key = (item.title, item.item_timestamp)
+        existing = rows.get(row_key)
+        if existing:
+            # 同一批次内的重复记录，在内存中按 ON CONFLICT 的语义合并
+            existing['hot'] = f"{item.hot},{existing['hot']}"
+            existing['sort_order'] = f"{sort_order},{existing['sort_order']}"
+            merged_count += 1
+            continue
+
+        rows[row_key] = {
+            'update_time': update_time,
+            'title': item.title,
+            'desc': item.desc,
+            'cover': item.cover,
+            'item_timestamp': item.item_timestamp,
+            'hot': item.hot,
+            'url': item.url,
+            'mobile_url': item.mobile_url,
+            'sort_order': sort_order,
+            'item_id': item.item_id,
+            'content_hash': item.content_hash,
+        }
+
+    return list(rows.values()), merged_count
+
+def bulk_insert_into_timescaledb(snapshot, sort_orders=None):
+    """
+    将一个路由快照的全部数据项批量写入 TimescaleDB
+    有唯一约束时使用一条 INSERT ... ON CONFLICT 语句完成写入与合并，
+    启用 ITEM_DEDUP 时内容未变化的数据项只把 hot/sort_order 追加到今天已写入的行（每行最多 ITEM_DEDUP_MAX_SAMPLES 个）；
+    没有约束时一次查询当天已存在的记录，再分别批量更新和插入
+    数据库不可用时抛出 OperationalError，由调用方写入本地缓冲；表无法创建等其他错误抛出 psycopg2.Error
+    返回 {'inserted': 插入行数, 'merged': 合并行数}
+    """
+    counts = {'inserted': 0, 'merged': 0}
+    if not snapshot.items:
+        return counts
+
+    base_name = snapshot.sanitized_name
+    update_time = snapshot.update_time
+    table_name = None
+    try:
+        rows, batch_merged = prepare_db_rows(snapshot, sort_orders)
+        counts['merged'] += batch_merged
+        if not rows:
+            return counts
+
+        # 同一路由的数据都按照updateTime的年份写入，只需获取一次数据库和表
+        year = get_year_for_timestamp(rows[0]['item_timestamp'], update_time)
+        table_name = get_or_create_db_for_timestamp(base_name, rows[0]['item_timestamp'], update_time)
+        if not table_name:
+            raise psycopg2.ProgrammingError(f"Failed to get or create table for {base_name}")
+
+        # 从表结构缓存中读取唯一约束信息，不再查询 pg_constraint
+        db_name = get_db_name_for_year(year)
+        metadata = get_table_metadata(db_name, table_name)
+        has_constraint = metadata is not None and metadata['has_unique_constraint']
+
+        with db_cursor(year) as cursor:
+            if has_constraint:
+                insert_rows = rows
+                cache_name = f"legacy:{db_name}:{table_name}"
+
+                if ITEM_DEDUP:
+                    # 内容未变化且今天已写入过的数据项，只把新的 hot/sort_order 追加到已有的行
+                    today = datetime.now().date()
+                    recent = get_recent_items(cache_name, [row['item_id'] for row in rows])
+                    append_rows = []
+                    insert_rows = []
+                    for row in rows:
+                        seen = recent.get(row['item_id'])
+                        if (seen and seen[0] == row['content_hash']
+                                and seen[1].astimezone().date() == today):
+                            append_rows.append((row, seen[1]))
+                        else:
+                            insert_rows.append(row)
+
+                    if append_rows:
+                        append_query = sql.SQL("""
+                            UPDATE {table} AS t
+                            SET hot = CONCAT(v.hot, ',', t.hot),
+                                sort_order = CONCAT(v.sort_order, ',', t.sort_order),
+                                update_time = v.update_time
+                            FROM (VALUES %s) AS v(idx, ingestion_time, title, item_timestamp, hot, sort_order, update_time)
+                            WHERE t.ingestion_time = v.ingestion_time
+                            AND t.title = v.title
+                            AND t.item_timestamp = v.item_timestamp
+                            AND length(t.sort_order) - length(replace(t.sort_order, ',', '')) + 1 < {max_samples}
+                            RETURNING v.idx
+                        """).format(table=sql.Identifier(table_name), max_samples=sql.Literal(ITEM_DEDUP_MAX_SAMPLES))
+                        appended = execute_values(cursor, append_query.as_string(cursor), [
+                            (idx, ingestion_time, row['title'], row['item_timestamp'],
+                             row['hot'], row['sort_order'], row['update_time'])
+                            for idx, (row, ingestion_time) in enumerate(append_rows)
+                        ], template="(%s, %s::timestamptz, %s::text, %s::bigint, %s::text, %s::text, %s::timestamptz)",
+                            page_size=len(append_rows), fetch=True)
+                        appended_indexes = {idx for (idx,) in appended}
+                        counts['merged'] += len(appended_indexes)
+                        # 已有的行不存在（例如被删除）或已合并 ITEM_DEDUP_MAX_SAMPLES 个值时，退回插入完整的行
+                        insert_rows.extend(row for idx, (row, _) in enumerate(append_rows) if idx not in appended_indexes)
+
+                if insert_rows:
+                    # 如果有约束，使用ON CONFLICT处理，通过 xmax 区分插入和合并
+                    insert_query = sql.SQL("""
+                        INSERT INTO {} (update_time, title, "desc", cover, item_timestamp, hot, url, mobile_url, sort_order)
+                        VALUES %s
+                        ON CONFLICT (ingestion_time, title, item_timestamp) DO UPDATE
+                        SET hot = CONCAT(EXCLUDED.hot, ',', {table}.hot),
+                            sort_order = CONCAT(EXCLUDED.sort_order, ',', {table}.sort_order)
+                        RETURNING (xmax = 0), ingestion_time, title, item_timestamp
+                    """).format(sql.Identifier(table_name), table=sql.Identifier(table_name))
+                    results = execute_values(cursor, insert_query.as_string(cursor), [
+                        (row['update_time'], row['title'], row['desc'], row['cover'], row['item_timestamp'],
+                         row['hot'], row['url'], row['mobile_url'], row['sort_order'])
+                        for row in insert_rows
+                    ], page_size=len(insert_rows), fetch=True)
+                    inserted = sum(1 for result in results if result[0])
+                    counts['inserted'] += inserted
+                    counts['merged'] += len(results) - inserted
+
+                    if ITEM_DEDUP:
+                        # 记住新写入行的内容哈希和 ingestion_time，供下一轮追加使用
+                        written = {(title, item_timestamp): ingestion_time for _, ingestion_time, title, item_timestamp in results}
+                        remember_recent_items(cache_name, {
+                            row['item_id']: (row['content_hash'], written[(row['title'], row['item_timestamp'])])
+                            for row in insert_rows
+                            if (row['title'], row['item_timestamp']) in written
+                        })
+            else:
+                # 如果没有约束，一次查出当天已存在的记录
+                check_query = sql.SQL("""
+                    SELECT DISTINCT title, item_timestamp FROM {} 
+                    WHERE title = ANY(%s)
+                    AND ingestion_time::date = CURRENT_DATE
+                """).format(sql.Identifier(table_name))
+                cursor.execute(check_query, [[row['title'] for row in rows]])
+                existing_keys = set(cursor.fetchall())
+
+                update_rows = [row for row in rows if (row['title'], row['item_timestamp']) in existing_keys]
+                insert_rows = [row for row in rows if (row['title'], row['item_timestamp']) not in existing_keys]
+
+                if update_rows:
+                    # 记录已存在，批量更新hot和sort_order
+                    update_query = sql.SQL("""
+                        UPDATE {} SET 
+                            hot = CONCAT(hot, ',', %s),
+                            sort_order = CONCAT(sort_order, ',', %s),
+                            update_time = %s
+                        WHERE title = %s AND item_timestamp = %s
+                        AND ingestion_time::date = CURRENT_DATE
+                    """).format(sql.Identifier(table_name))
+                    execute_batch(cursor, update_query.as_string(cursor), [
+                        (row['hot'], row['sort_order'], row['update_time'], row['title'], row['item_timestamp'])
+                        for row in update_rows
+                    ], page_size=len(update_rows))
+                    counts['merged'] += len(update_rows)
+
+                if insert_rows:
+                    # 记录不存在，批量插入
+                    insert_query = sql.SQL("""
+                        INSERT INTO {} (update_time, title, "desc", cover, item_timestamp, hot, url, mobile_url, sort_order)
+                        VALUES %s
+                    """).format(sql.Identifier(table_name))
+                    execute_values(cursor, insert_query.as_string(cursor), [
+                        (row['update_time'], row['title'], row['desc'], row['cover'], row['item_timestamp'],
+                         row['hot'], row['url'], row['mobile_url'], row['sort_order'])
+                        for row in insert_rows
+                    ], page_size=len(insert_rows))
+                    counts['inserted'] += len(insert_rows)
+
+        logging.debug("Bulk wrote %d rows into %s: %d inserted, %d merged", len(rows), table_name, counts['inserted'], counts['merged'])
+        DB_ROWS.labels(table=table_name, outcome='inserted').inc(counts['inserted'])
+        DB_ROWS.labels(table=table_name, outcome='merged').inc(counts['merged'])
+    except psycopg2.Error as e:
+        logging.error("Error bulk inserting data into %s: %s", table_name or base_name, e)
+        # 连接错误时该连接已被连接池丢弃，下次写入会自动建立新连接；本批数据交给调用方缓冲或移入死信表
+        raise
+    return counts
+
+def replay_legacy_batches(batches):
+    """
+    重放本地缓冲：将同一路由、同一年份的多个批次合并为一条 INSERT 写入旧布局，
+    每行使用所属批次的原始采集时间作为 ingestion_time，已写入的行按唯一键跳过，可重复执行
+    batches: [(snapshot, ingestion_time)]
+    返回 {'inserted': 插入行数, 'merged': 0}
+    """
+    counts = {'inserted': 0, 'merged': 0}
+    timed_rows = []
+    for snapshot, ingestion_time in batches:
+        rows, _ = prepare_db_rows(snapshot)
+        timed_rows.extend((ingestion_time, row) for row in rows)
+    if not timed_rows:
+        return counts
+
+    base_name = batches[0][0].sanitized_name
+    first_row = timed_rows[0][1]
+    year = get_year_for_timestamp(first_row['item_timestamp'], first_row['update_time'])
+    table_name = get_or_create_db_for_timestamp(base_name, first_row['item_timestamp'], first_row['update_time'])
+    if not table_name:
+        raise psycopg2.ProgrammingError(f"Failed to get or create table for {base_name}")
+    metadata = get_table_metadata(get_db_name_for_year(year), table_name)
+    has_constraint = metadata is not None and metadata['has_unique_constraint']
+
+    with db_cursor(year) as cursor:
+        counts['inserted'] = insert_rows_at(cursor, table_name, timed_rows, has_constraint)
+    logging.debug("Replayed %d batches into %s: %d rows inserted", len(batches), table_name, counts['inserted'])
+    DB_ROWS.labels(table=table_name, outcome='inserted').inc(counts['inserted'])
+    return counts
+
+def insert_rows_at(cursor, table_name, timed_rows, has_constraint):
+    """
+    以各行指定的 ingestion_time 插入 [(ingestion_time, row)]，已存在的行（相同的 ingestion_time、title、item_timestamp）被跳过，
+    用于幂等地重放本地缓冲；返回插入的行数
+    """
+    values = [
+        (ingestion_time, row['update_time'], row['title'], row['desc'], row['cover'], row['item_timestamp'],
+         row['hot'], row['url'], row['mobile_url'], row['sort_order'])
+        for ingestion_time, row in timed_rows
+    ]
+    if not has_constraint:
+        # 没有唯一约束时先查出这些采集时间已写入的记录
+        cursor.execute(sql.SQL("""
+            SELECT ingestion_time, title, item_timestamp FROM {}
+            WHERE ingestion_time = ANY(%s) AND title = ANY(%s)
+        """).format(sql.Identifier(table_name)), [
+            list({value[0] for value in values}), list({value[2] for value in values})
+        ])
+        existing_keys = set(cursor.fetchall())
+        values = [value for value in values if (value[0], value[2], value[5]) not in existing_keys]
+        if not values:
+            return 0
+
+    insert_query = sql.SQL("""
+        INSERT INTO {} (ingestion_time, update_time, title, "desc", cover, item_timestamp, hot, url, mobile_url, sort_order)
+        VALUES %s
+        {}
+        RETURNING 1
+    """).format(
+        sql.Identifier(table_name),
+        sql.SQL("ON CONFLICT (ingestion_time, title, item_timestamp) DO NOTHING") if has_constraint else sql.SQL("")
+    )
+    return len(execute_values(cursor, insert_query.as_string(cursor), values, page_size=len(values), fetch=True))
+
+def insert_into_timescaledb(base_name, update_time, data_item, sort_order):
+    """
+    将单条数据插入到 TimescaleDB，避免冗余数据
+    """
+    snapshot = normalize_route_snapshot(base_name, base_name, base_name, [data_item], update_time)
+    return bulk_insert_into_timescaledb(snapshot, [sort_order])
+
+def compute_item_id(route, item):
+    """
+    计算数据项在规范化存储中的 ID：md5(route + 分隔符 + url 或 title) 的前 64 位（有符号 BIGINT）
+    与迁移 SQL 中的 ITEM_ID_SQL 计算方式一致
+    """
+    identity = item.get('url') or item.get('title') or ''
+    digest = hashlib.md5(f"{route}\x1f{identity}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+# 与 compute_item_id 一致的 SQL 表达式，用于迁移旧表数据
+ITEM_ID_SQL = "('x' || substr(md5({route} || chr(31) || COALESCE(NULLIF({url}, ''), {title}, '')), 1, 16))::bit(64)::bigint"
+
+HOT_VALUE_PATTERN = re.compile(r'\s*(\d+(?:\.\d+)?)\s*(万|亿|w|W)?')
+
+def parse_hot_value(hot):
+    """
+    将热度值转换为整数，支持数字及“万”“亿”等单位，无法解析时返回 None
+    """
+    if hot is None or isinstance(hot, bool):
+        return None
+    if isinstance(hot, (int, float)):
+        # json.loads 接受 NaN 与 Infinity，它们无法转换为整数
+        if isinstance(hot, float) and not math.isfinite(hot):
+            return None
+        value = int(hot)
+    else:
+        match = HOT_VALUE_PATTERN.match(str(hot))
+        if not match:
+            return None
+        number = float(match.group(1))
+        unit = match.group(2)
+        if unit in ('万', 'w', 'W'):
+            number *= 10000
+        elif unit == '亿':
+            number *= 100000000
+        if not math.isfinite(number):
+            return None
+        value = int(number)
+    # 超出 BIGINT 范围的值无法存储
+    if not -9223372036854775808 <= value <= 9223372036854775807:
+        return None
+    return value
+
+# 与 parse_hot_value 一致的 SQL 表达式，用于迁移旧表数据
+HOT_VALUE_SQL = """
+    CASE
+        WHEN {hot} ~ '^\\s*[0-9]+(\\.[0-9]+)?\\s*亿' THEN
+            (substring({hot} from '^\\s*([0-9]+(?:\\.[0-9]+)?)')::numeric * 100000000)::bigint
+        WHEN {hot} ~ '^\\s*[0-9]+(\\.[0-9]+)?\\s*(万|w|W)' THEN
+            (substring({hot} from '^\\s*([0-9]+(?:\\.[0-9]+)?)')::numeric * 10000)::bigint
+        WHEN {hot} ~ '^\\s*[0-9]+(\\.[0-9]+)?' THEN
+            trunc(substring({hot} from '^\\s*([0-9]+(?:\\.[0-9]+)?)')::numeric)::bigint
+    END
+"""
+
+def ensure_normalized_tables(year=None):
+    """
+    确保规范化存储的 hot_samples（hypertable）与 hot_items 表存在
+    数据库不可达时抛出 OperationalError，表无法创建时返回 False
+    """
+    if year is None:
+        year = datetime.now().year
+    db_name = get_db_name_for_year(year)
+
+    if get_table_metadata(db_name, SAMPLES_TABLE) is not None and get_table_metadata(db_name, ITEMS_TABLE) is not None:
+        return True
+
+    try:
+        with table_bootstrap_lock, db_cursor(year) as cursor:
+            cursor.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {items} (
+                    item_id BIGINT PRIMARY KEY,
+                    route TEXT NOT NULL,
+                    title TEXT,
+                    "desc" TEXT,
+                    cover TEXT,
+                    url TEXT,
+                    mobile_url TEXT,
+                    item_timestamp BIGINT,
+                    content_hash TEXT,
+                    first_seen TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    -- 内容最后一次变化的时间，最近出现时间以 hot_samples 为准
+                    last_seen TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                ALTER TABLE {items} ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+                CREATE TABLE IF NOT EXISTS {samples} (
+                    ingestion_time TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    route TEXT NOT NULL,
+                    item_id BIGINT NOT NULL,
+                    rank SMALLINT,
+                    hot BIGINT,
+                    UNIQUE (ingestion_time, route, item_id)
+                );
+
+                CREATE INDEX IF NOT EXISTS {samples_route_idx} ON {samples} (route, ingestion_time DESC);
+                CREATE INDEX IF NOT EXISTS {samples_item_idx} ON {samples} (item_id, ingestion_time DESC);
+            """).format(
+                items=sql.Identifier(ITEMS_TABLE),
+                samples=sql.Identifier(SAMPLES_TABLE),
+                samples_route_idx=sql.Identifier(f"{SAMPLES_TABLE}_route_idx"),
+                samples_item_idx=sql.Identifier(f"{SAMPLES_TABLE}_item_idx")
+            ))
+
+            # 创建hypertable并按时间自动分片
+            try:
+                cursor.execute("""
+                    SELECT create_hypertable(%s, 'ingestion_time',
+                                          chunk_time_interval => INTERVAL '1 day',
+                                          migrate_data => true,
+                                          if_not_exists => TRUE);
+                """, [SAMPLES_TABLE])
+            except psycopg2.Error as e:
+                logging.error("Error converting %s to hypertable: %s", SAMPLES_TABLE, e)
+                logging.warning("Will use %s as a regular table", SAMPLES_TABLE)
+
+            load_table_metadata(cursor, db_name, ITEMS_TABLE)
+            metadata = load_table_metadata(cursor, db_name, SAMPLES_TABLE)
+            if metadata['is_hypertable']:
+                apply_timescale_policies(cursor, SAMPLES_TABLE, 'route, item_id', 'ingestion_time DESC')
+                if ENABLE_CONTINUOUS_AGGREGATES:
+                    ensure_continuous_aggregates(cursor)
+        logging.info("Ensured normalized tables exist in %s", db_name)
+        return True
+    except psycopg2.OperationalError:
+        raise
+    except Exception as e:
+        logging.error("Unexpected error ensuring normalized tables exist in %s: %s", db_name, e)
+        return False
+
+def prepare_normalized_rows(snapshot):
+    """
+    将一个路由快照转换为 hot_items 行（item_id -> 行，最后一列为内容哈希）和 hot_samples 样本
+    同一批次内重复的数据项只保留排名最靠前的一条
+    """
+    base_name = snapshot.sanitized_name
+    items = {}
+    samples = []
+    for rank, item in enumerate(snapshot.items):
+        if item.item_id in items:
+            continue
+        items[item.item_id] = (
+            item.item_id, base_name, item.title, item.desc, item.cover,
+            item.url, item.mobile_url, item.item_timestamp, item.content_hash
+        )
+        samples.append((base_name, item.item_id, min(rank, 32767), item.hot_value))
+    return items, samples
+
+def bulk_insert_normalized(snapshot):
+    """
+    以规范化布局写入一个路由快照：每个数据项在 hot_items 中只保留一行，
+    每次抓取在 hot_samples 中追加一条 (ingestion_time, route, item_id, rank, hot) 样本
+    数据库不可用时抛出 OperationalError，由调用方写入本地缓冲；表无法创建等其他错误抛出 psycopg2.Error
+    返回 {'samples': 样本数, 'items': 新增或内容变化的数据项数}
+    """
+    if not snapshot.items:
+        return {'samples': 0, 'items': 0}
+
+    base_name = snapshot.sanitized_name
+    year = get_year_for_timestamp(None, snapshot.update_time)
+    if not ensure_normalized_tables(year):
+        raise psycopg2.ProgrammingError(f"Normalized tables unavailable for {base_name}")
+
+    items, samples = prepare_normalized_rows(snapshot)
+    return write_normalized_rows(year, base_name, items, samples)
+
+def replay_normalized_batches(batches):
+    """
+    重放本地缓冲：将同一路由、同一年份的多个批次合并为一次 hot_items 和一次 hot_samples 写入，
+    样本使用所属批次的原始采集时间并按唯一键去重，可重复执行
+    batches: [(snapshot, ingestion_time)]，同一数据项以最后一个批次的内容为准
+    """
+    base_name = batches[0][0].sanitized_name
+    year = get_year_for_timestamp(None, batches[0][0].update_time)
+    items = {}
+    samples = []
+    for snapshot, ingestion_time in batches:
+        snapshot_items, snapshot_samples = prepare_normalized_rows(snapshot)
+        items.update(snapshot_items)
+        samples.extend((ingestion_time,) + sample for sample in snapshot_samples)
+    if not samples:
+        return {'samples': 0, 'items': 0}
+    if not ensure_normalized_tables(year):
+        raise psycopg2.ProgrammingError(f"Normalized tables unavailable for {base_name}")
+    return write_normalized_rows(year, base_name, items, samples, timed=True)
+
+def write_normalized_rows(year, base_name, items, samples, timed=False):
+    """
+    写入 hot_items 行和 hot_samples 样本：内容哈希未变化的数据项只写样本，最近见过的数据项直接跳过 hot_items 写入
+    timed: 样本第一列为 ingestion_time（重放本地缓冲），否则使用数据库的当前时间
+    """
+    counts = {'samples': 0, 'items': 0}
+    # 最近见过且内容未变化的数据项不需要再写入 hot_items，只记录样本
+    cache_name = f"normalized:{get_db_name_for_year(year)}:{base_name}"
+    changed_items = list(items.values())
+    if ITEM_DEDUP:
+        recent = get_recent_items(cache_name, list(items.keys()))
+        changed_items = [row for row in changed_items if recent.get(row[0]) != row[-1]]
+
+    try:
+        with db_cursor(year) as cursor:
+            if changed_items:
+                items_query = sql.SQL("""
+                    INSERT INTO {items} (item_id, route, title, "desc", cover, url, mobile_url, item_timestamp, content_hash)
+                    VALUES %s
+                    ON CONFLICT (item_id) DO UPDATE
+                    SET title = EXCLUDED.title,
+                        "desc" = EXCLUDED."desc",
+                        cover = EXCLUDED.cover,
+                        url = EXCLUDED.url,
+                        mobile_url = EXCLUDED.mobile_url,
+                        item_timestamp = EXCLUDED.item_timestamp,
+                        content_hash = EXCLUDED.content_hash,
+                        last_seen = NOW()
+                    WHERE {items}.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                """).format(items=sql.Identifier(ITEMS_TABLE))
+                execute_values(cursor, items_query.as_string(cursor), changed_items, page_size=len(changed_items))
+            counts['items'] = len(changed_items)
+
+            if timed:
+                samples_query = sql.SQL("""
+                    INSERT INTO {} (ingestion_time, route, item_id, rank, hot)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                """).format(sql.Identifier(SAMPLES_TABLE))
+            else:
+                samples_query = sql.SQL("""
+                    INSERT INTO {} (route, item_id, rank, hot)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                """).format(sql.Identifier(SAMPLES_TABLE))
+            execute_values(cursor, samples_query.as_string(cursor), samples, page_size=len(samples))
+            counts['samples'] = len(samples)
+
+        if ITEM_DEDUP:
+            remember_recent_items(cache_name, {row[0]: row[-1] for row in changed_items})
+        logging.debug("Wrote %d samples and %d changed items for %s", counts['samples'], counts['items'], base_name)
+        DB_ROWS.labels(table=SAMPLES_TABLE, outcome='inserted').inc(counts['samples'])
+        DB_ROWS.labels(table=ITEMS_TABLE, outcome='inserted').inc(counts['items'])
+    except psycopg2.Error as e:
+        logging.error("Error writing normalized data for %s: %s", base_name, e)
+        raise
+    return counts
+
+def list_year_databases():
+    """
+    列出所有按年份创建的数据库，返回 [(year, db_name)]
+    """
+    temp_conn = psycopg2.connect(**get_db_connect_kwargs("postgres"))
+    try:
+        with temp_conn.cursor() as temp_cursor:
+            temp_cursor.execute("SELECT datname FROM pg_database WHERE datname LIKE %s", [f"{TIMESCALEDB_DB}\\_%"])
+            databases = []
+            for (db_name,) in temp_cursor.fetchall():
+                suffix = db_name[len(TIMESCALEDB_DB) + 1:]
+                if suffix.isdigit():
+                    databases.append((int(suffix), db_name))
+            return sorted(databases)
+    finally:
+        temp_conn.close()
+
+def migrate_to_normalized(years=None):
+    """
+    迁移工具：将 records_<name> 旧表转换为 hot_items + hot_samples 规范化布局
+    hot/sort_order 拼接字符串会被拆分为多条样本；同一行内的多个值无法还原真实采集时间，
+    拼接串为新值在前，按从旧到新在该行 ingestion_time 基础上依次偏移 1 微秒。
+    hot 含逗号导致两个数组长度不一致的行只迁移排名。迁移可重复执行，旧表保持不变
+    """
+    if not years:
+        years = [year for year, _ in list_year_databases()]
+
+    for year in years:
+        db_name = get_db_name_for_year(year)
+        if not ensure_normalized_tables(year):
+            logging.error("Skipping migration of %s: normalized tables unavailable", db_name)
+            continue
+
+        with db_cursor(year) as cursor:
+            cursor.execute("""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = 'public' AND table_name LIKE 'records\\_%'
+                ORDER BY table_name
+            """)
+            tables = [row[0] for row in cursor.fetchall()]
+
+            for table_name in tables:
+                route = table_name[len('records_'):]
+                item_id_sql = sql.SQL(ITEM_ID_SQL.format(route='%(route)s', url='r.url', title='r.title'))
+                try:
+                    cursor.execute(sql.SQL("""
+                        INSERT INTO {items} (item_id, route, title, "desc", cover, url, mobile_url, item_timestamp, first_seen, last_seen)
+                        SELECT DISTINCT ON (item_id)
+                            item_id, %(route)s, title, "desc", cover, url, mobile_url, item_timestamp,
+                            min(ingestion_time) OVER (PARTITION BY item_id),
+                            max(ingestion_time) OVER (PARTITION BY item_id)
+                        FROM (SELECT {item_id} AS item_id, r.* FROM {table} r) AS legacy
+                        ORDER BY item_id, ingestion_time DESC
+                        ON CONFLICT (item_id) DO UPDATE
+                        SET first_seen = LEAST({items}.first_seen, EXCLUDED.first_seen),
+                            last_seen = GREATEST({items}.last_seen, EXCLUDED.last_seen)
+                    """).format(
+                        items=sql.Identifier(ITEMS_TABLE),
+                        item_id=item_id_sql,
+                        table=sql.Identifier(table_name)
+                    ), {'route': route})
+                    items_count = cursor.rowcount
+
+                    # hot 本身可能含逗号（如 "1,234"），拆分后与 sort_order 长度不一致时无法对齐，
+                    # 这些行只迁移排名，hot 置空，并在日志中报告行数
+                    cursor.execute(sql.SQL("""
+                        SELECT count(*) FROM {table}
+                        WHERE cardinality(string_to_array(hot, ',')) <> cardinality(string_to_array(sort_order, ','))
+                    """).format(table=sql.Identifier(table_name)))
+                    misaligned = cursor.fetchone()[0]
+
+                    # 拼接串为新值在前，第一个元素最新，偏移量为 (长度 - 序号)
+                    cursor.execute(sql.SQL("""
+                        INSERT INTO {samples} (ingestion_time, route, item_id, rank, hot)
+                        SELECT
+                            r.ingestion_time + (cardinality(a.ranks) - s.ord) * INTERVAL '1 microsecond',
+                            %(route)s,
+                            {item_id},
+                            CASE WHEN s.rank ~ '^[0-9]+$' THEN LEAST(s.rank::int, 32767)::smallint END,
+                            {hot_value}
+                        FROM {table} r
+                        CROSS JOIN LATERAL (
+                            SELECT string_to_array(r.sort_order, ',') AS ranks,
+                                   string_to_array(r.hot, ',') AS hots
+                        ) AS a
+                        CROSS JOIN LATERAL unnest(
+                            a.ranks,
+                            CASE WHEN cardinality(a.hots) = cardinality(a.ranks) THEN a.hots END
+                        ) WITH ORDINALITY AS s(rank, hot, ord)
+                        ON CONFLICT DO NOTHING
+                    """).format(
+                        samples=sql.Identifier(SAMPLES_TABLE),
+                        item_id=item_id_sql,
+                        hot_value=sql.SQL(HOT_VALUE_SQL.format(hot='s.hot')),
+                        table=sql.Identifier(table_name)
+                    ), {'route': route})
+                    logging.info("Migrated %s in %s: %s items, %s samples", table_name, db_name, items_count, cursor.rowcount)
+                    if misaligned:
+                        logging.warning(
+                            "%d rows in %s.%s have hot/sort_order arrays of different length; "
+                            "their samples were migrated without hot values",
+                            misaligned, db_name, table_name
+                        )
+                except psycopg2.Error as e:
+                    logging.error("Error migrating %s in %s: %s", table_name, db_name, e)
+
+def copy_table_rows(source_conn, year, table_name, conflict):
+    """
+    将源数据库中一张表的数据按批流式复制到目标数据库的同名表，只复制两边都存在的列
+    返回复制的行数
+    """
+    target_db = get_db_name_for_year(year)
+    with db_cursor(year) as cursor:
+        target_columns = set(load_table_metadata(cursor, target_db, table_name)['columns'])
+    with source_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = %s
+            ORDER BY ordinal_position
+        """, [table_name])
+        columns = [row[0] for row in cursor.fetchall() if row[0] in target_columns]
+
+    column_list = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    insert_query = sql.SQL("INSERT INTO {} ({}) VALUES %s {}").format(sql.Identifier(table_name), column_list, conflict)
+    copied = 0
+    # 使用服务端游标分批读取，避免一次性把整张表读入内存
+    with source_conn.cursor(name=f"fold_{table_name}") as source_cursor:
+        source_cursor.itersize = FOLD_BATCH_SIZE
+        source_cursor.execute(sql.SQL("SELECT {} FROM {}").format(column_list, sql.Identifier(table_name)))
+        while True:
+            rows = source_cursor.fetchmany(FOLD_BATCH_SIZE)
+            if not rows:
+                break
+            with db_cursor(year) as cursor:
+                execute_values(cursor, insert_query.as_string(cursor), rows, page_size=FOLD_BATCH_SIZE)
+            copied += len(rows)
+    source_conn.commit()
+    return copied
+
+def fold_year_databases(years=None):
+    """
+    迁移工具：将 daily_hot_<年份> 数据库中的旧表和规范化表合并到 TIMESCALEDB_DB 一个数据库中，
+    之后依靠 hypertable 分块管理时间，旧年份不再占用单独的连接池
+    需要先设置 DB_LAYOUT=single；写入使用 ON CONFLICT，可重复执行，年份数据库保持不变，确认后可手动删除
+    """
+    if DB_LAYOUT != 'single':
+        logging.error("Set DB_LAYOUT=single before folding yearly databases")
+        return
+
+    for year, source_db in list_year_databases():
+        if years and year not in years:
+            continue
+        logging.info("Folding %s into %s", source_db, get_db_name_for_year(year))
+        source_conn = psycopg2.connect(**get_db_connect_kwargs(source_db))
+        try:
+            with source_conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT table_name FROM information_schema.tables
+                    WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
+                    AND (table_name LIKE %s OR table_name IN (%s, %s))
+                    ORDER BY table_name
+                """, ['records\\_%', SAMPLES_TABLE, ITEMS_TABLE])
+                tables = [row[0] for row in cursor.fetchall()]
+            source_conn.commit()
+
+            if (SAMPLES_TABLE in tables or ITEMS_TABLE in tables) and not ensure_normalized_tables(year):
+                logging.error("Skipping normalized tables of %s: target tables unavailable", source_db)
+                tables = [table_name for table_name in tables if table_name not in (SAMPLES_TABLE, ITEMS_TABLE)]
+
+            for table_name in tables:
+                if table_name == ITEMS_TABLE:
+                    conflict = sql.SQL("""
+                        ON CONFLICT (item_id) DO UPDATE
+                        SET first_seen = LEAST({items}.first_seen, EXCLUDED.first_seen),
+                            last_seen = GREATEST({items}.last_seen, EXCLUDED.last_seen)
+                    """).format(items=sql.Identifier(ITEMS_TABLE))
+                else:
+                    if table_name != SAMPLES_TABLE and not ensure_table_exists(table_name[len('records_'):], year):
+                        logging.error("Skipping %s in %s: target table unavailable", table_name, source_db)
+                        continue
+                    conflict = sql.SQL("ON CONFLICT DO NOTHING")
+                try:
+                    copied = copy_table_rows(source_conn, year, table_name, conflict)
+                    logging.info("Folded %s rows of %s from %s", copied, table_name, source_db)
+                except psycopg2.Error as e:
+                    source_conn.rollback()
+                    logging.error("Error folding %s from %s: %s", table_name, source_db, e)
+        finally:
+            source_conn.close()
+
+def get_fingerprint_key(key):
+    """
+    获取与有序集合并存的指纹集合键，例如 allbs:news:weibo -> allbs:fp:news:weibo
+    """
+    if key.startswith('allbs:'):
+        return FINGERPRINT_KEY_PREFIX + key[len('allbs:'):]
+    return FINGERPRINT_KEY_PREFIX + key
+
+def fingerprint_member(member):
+    """
+    计算有序集合成员的指纹，与 Lua 脚本中的 redis.sha1hex 一致
+    """
+    return hashlib.sha1(member.encode('utf-8')).hexdigest()
+
+def rebuild_sorted_set(client, key, members, cache_expire_seconds, changes=None):
+    """
+    在一个 MULTI 事务中重建有序集合，读者不会看到空的键；同时删除增量模式遗留的指纹集合
+    传入 changes 时在同一事务中读取旧成员，记录新增和移除的成员
+    返回 {'added': n, 'removed': n, 'unchanged': 0}
+    """
+    pipeline = client.pipeline(transaction=True)
+    if changes is not None:
+        pipeline.zrange(key, 0, -1)
+    pipeline.zcard(key)
+    pipeline.delete(key, get_fingerprint_key(key))
+    if members:
+        pipeline.zadd(key, members)
+    pipeline.expire(key, cache_expire_seconds)
+    results = pipeline.execute()
+    if changes is not None:
+        old_members = set(results.pop(0))
+        changes['added'] = [member for member in members if member not in old_members]
+        changes['removed'] = [member for member in old_members if member not in members]
+    return {'added': len(members), 'removed': results[0], 'unchanged': 0}
+
+def sync_sorted_set(client, key, members, cache_expire_seconds, incremental=None, changes=None):
+    """
+    将 members（member -> score）同步到有序集合
+    增量模式下由 Lua 脚本根据现有成员计算差异，只 ZADD/ZREM 变化的成员并刷新过期时间；
+    指纹集合中已有的成员只发送指纹，不重复发送内容
+    changes: 传入字典时记录新增（'added'）和移除（'removed'）的成员
+    返回 {'added': n, 'removed': n, 'unchanged': n}
+    """
+    if incremental is None:
+        incremental = REDIS_INCREMENTAL
+    if not incremental:
+        return rebuild_sorted_set(client, key, members, cache_expire_seconds, changes)
+
+    fingerprint_key = get_fingerprint_key(key)
+    new_fingerprints = {fingerprint_member(member): member for member in members}
+    try:
+        known = set(client.smembers(fingerprint_key))
+    except redis.exceptions.ResponseError:
+        # 旧版本保存的是指纹哈希，按全部成员发送，脚本会重写为指纹集合
+        known = set()
+
+    def build_args(omitted):
+        args = [cache_expire_seconds]
+        for fingerprint, member in new_fingerprints.items():
+            args.extend([fingerprint, members[member], '' if fingerprint in omitted else member])
+        return args
+
+    result = sync_sorted_set_script(keys=[key, fingerprint_key], args=build_args(known), client=client)
+    if result[0] == -1:
+        # 读取指纹后成员已被其他写入者修改，发送全部成员重试
+        logging.debug("Fingerprints of %s changed concurrently, resending %d members", key, len(members))
+        result = sync_sorted_set_script(keys=[key, fingerprint_key], args=build_args(set()), client=client)
+    _, added, removed = result
+    if changes is not None:
+        changes['added'] = [new_fingerprints[fingerprint] for fingerprint in added]
+        changes['removed'] = removed
+    return {
+        'added': len(added),
+        'removed': len(removed),
+        'unchanged': len(new_fingerprints) - len(added),
+    }
+
+def prepare_redis_members(snapshot):
+    """
+    将一个路由快照序列化为有序集合成员（member -> score），使用规范化后的时间戳作为分数
+    每个路由只序列化一次，供所有 Redis 目标共用
+    """
+    members = {}
+    for item in snapshot.items:
+        # 确保item的所有值都不为None，将None转换为空字符串，timestamp为处理后的值
+        item_copy = {k: ('' if v is None else v) for k, v in item.raw.items()}
+        item_copy['timestamp'] = item.timestamp
+        members[json.dumps(item_copy, ensure_ascii=False)] = item.timestamp
+    return members
+
+def write_replica(replica, key, members, cache_expire_seconds):
+    """
+    在副本线程中将已序列化的成员写入一个 Redis 副本
+    """
+    try:
+        with REDIS_SECONDS.labels(target=replica['name']).time():
+            counts = sync_sorted_set(replica['client'], key, members, cache_expire_seconds)
+        logging.debug("Cached %d items in %s sorted set with key: %s (%d added, %d removed, %d unchanged)",
+                      len(members), replica['name'], key, counts['added'], counts['removed'], counts['unchanged'])
+    except redis.exceptions.RedisError as e:
+        logging.error("Error caching data in %s: %s", replica['name'], e)
+
+def touch_replica(replica, key, cache_expire_seconds):
+    """
+    在副本线程中刷新一个 Redis 副本中有序集合及其指纹集合的过期时间
+    """
+    try:
+        pipeline = replica['client'].pipeline(transaction=False)
+        pipeline.expire(key, cache_expire_seconds)
+        pipeline.expire(get_fingerprint_key(key), cache_expire_seconds)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error("Error refreshing expiry of %s in %s: %s", key, replica['name'], e)
+
+def run_replica_tasks(replica, key, task):
+    """
+    在副本线程中执行某个键的任务，执行期间排队的最新任务在完成后接着执行
+    """
+    while task is not None:
+        try:
+            task()
+        except Exception as e:
+            logging.error("Unexpected error in %s task for %s: %s", replica['name'], key, e)
+        with redis_replicas_lock:
+            task = replica['queued'].pop(key, None)
+            if task is None:
+                replica['active'].discard(key)
+
+def submit_replica_task(replica, key, task, supersede=True):
+    """
+    提交副本的一个键的任务（调用方需持有 redis_replicas_lock）
+    每个 (副本, 键) 同一时间只有一个任务在执行、最多一个任务排队，慢或不可用的副本不会让线程池队列无限增长；
+    supersede 为 True 时新任务替换同一键排队中的旧任务，否则已有任务排队时丢弃新任务
+    """
+    if key not in replica['active']:
+        replica['active'].add(key)
+        replica_executor.submit(run_replica_tasks, replica, key, task)
+    elif key not in replica['queued']:
+        replica['queued'][key] = task
+    elif supersede:
+        logging.debug("Superseding queued %s write for %s", replica['name'], key)
+        replica['queued'][key] = task
+
+def replicate_sorted_set(key, members, cache_expire_seconds):
+    """
+    将已序列化的成员并行写入所有 Redis 副本
+    同一键的上一次写入仍未完成时排队等待，被更新的写入替换的旧写入直接丢弃，不影响其他键
+    """
+    with redis_replicas_lock:
+        for replica in redis_replicas:
+            submit_replica_task(replica, key,
+                                lambda replica=replica: write_replica(replica, key, members, cache_expire_seconds))
+
+def publish_event(stream_key, version_key, fields):
+    """
+    向事件流追加一条事件（字段中自动加入递增的版本号），流长度限制在约 EVENTS_STREAM_MAXLEN 条
+    返回事件的版本号
+    """
+    args = [EVENTS_STREAM_MAXLEN]
+    for name, value in fields.items():
+        args.extend([name, value])
+    return publish_event_script(keys=[stream_key, version_key], args=args)
+
+def publish_route_event(route, changes, size):
+    """
+    路由数据变化后向 allbs:events:<path> 追加变更事件，
+    added/removed 为逗号分隔的成员指纹（成员 JSON 的 SHA-1），
+    被移除的成员已不在有序集合中，removed_items 另外带上它们的指纹、标题和链接
+    返回事件的版本号，Redis 出错时返回 None
+    """
+    removed_items = []
+    for member in changes['removed']:
+        item = json.loads(member)
+        removed_items.append({'fp': fingerprint_member(member), 'title': item.get('title'), 'url': item.get('url')})
+    try:
+        return publish_event(EVENTS_KEY_PREFIX + route, EVENT_VERSION_KEY_PREFIX + route, {
+            'route': route,
+            'size': size,
+            'added': ','.join(fingerprint_member(member) for member in changes['added']),
+            'removed': ','.join(item['fp'] for item in removed_items),
+            'removed_items': json.dumps(removed_items, ensure_ascii=False),
+            'ts': int(time.time()),
+        })
+    except redis.exceptions.RedisError as e:
+        logging.error("Error publishing change event for %s: %s", route, e)
+        return None
+
+def publish_cycle_event(versions, routes, seconds, deadline_reached):
+    """
+    每轮结束后向 allbs:cycle_events 追加一条事件，changed 为本轮数据发生变化的路由及其事件版本号（path:version）
+    """
+    try:
+        publish_event(CYCLE_EVENTS_KEY, CYCLE_EVENT_VERSION_KEY, {
+            'worker': WORKER_ID,
+            'routes': routes,
+            'changed': ','.join(f"{key}:{version}" for key, version in sorted(versions.items())),
+            'seconds': f"{seconds:.3f}",
+            'deadline_reached': int(deadline_reached),
+            'ts': int(time.time()),
+        })
+    except redis.exceptions.RedisError as e:
+        logging.error("Error publishing cycle event: %s", e)
+
+def cache_in_redis_sorted_set(key, snapshot):
+    """
+    使用有序集合（Sorted Set）缓存路由快照，使用 timestamp 作为分数
+    默认在一个事务中原子地替换旧数据；启用 REDIS_INCREMENTAL 时只写入变化的成员
+    数据只序列化一次，主 Redis 在当前线程写入，副本在后台线程并行写入
+    启用 EVENTS_ENABLED 时，主 Redis 中的成员有变化则追加一条变更事件
+    返回主 Redis 的 {'added': n, 'removed': n, 'unchanged': n}，追加了事件时包含事件的 'version'
+    """
+    cache_expire_seconds = REDIS_CACHE_HOURS * 3600
+    members = prepare_redis_members(snapshot)
+
+    # 副本写入在后台进行，不影响主 Redis
+    if redis_replicas:
+        replicate_sorted_set(key, members, cache_expire_seconds)
+
+    changes = {} if EVENTS_ENABLED else None
+    try:
+        with REDIS_SECONDS.labels(target='primary').time():
+            counts = sync_sorted_set(redis_client, key, members, cache_expire_seconds, changes=changes)
+        if changes and (changes['added'] or changes['removed']):
+            counts['version'] = publish_route_event(snapshot.key, changes, len(members))
+        logging.debug("Cached %d items in Redis sorted set with key: %s (%d added, %d removed, %d unchanged), expires in %d hours",
+                      len(snapshot), key, counts['added'], counts['removed'], counts['unchanged'], REDIS_CACHE_HOURS)
+        return counts
+    except redis.exceptions.RedisError as e:
+        logging.error("Error caching data in Redis: %s", e)
+        return None
+
+def refresh_redis_expiry(key):
+    """
+    内容未变化时只刷新有序集合及其指纹集合的过期时间，不重写数据
+    """
+    cache_expire_seconds = REDIS_CACHE_HOURS * 3600
+    with redis_replicas_lock:
+        for replica in redis_replicas:
+            # 已有写入排队时不替换，写入本身会刷新过期时间
+            submit_replica_task(replica, key,
+                                lambda replica=replica: touch_replica(replica, key, cache_expire_seconds),
+                                supersede=False)
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.expire(key, cache_expire_seconds)
+        pipeline.expire(get_fingerprint_key(key), cache_expire_seconds)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error("Error refreshing expiry of %s in Redis: %s", key, e)
+
+def load_trend_state(key):
+    """
+    读取路由上一次的快照，内存中没有时（例如重启后或路由刚分配到当前 worker）从 Redis 恢复
+    """
+    with trend_state_lock:
+        state = trend_state.get(key)
+    if state is not None:
+        return state
+    try:
+        cached = redis_client.get(TREND_STATE_KEY_PREFIX + key)
+    except redis.exceptions.RedisError as e:
+        logging.error("Error loading trend state of %s from Redis: %s", key, e)
+        return None
+    if not cached:
+        return None
+    state = json.loads(cached)
+    state['items'] = {int(item_id): entry for item_id, entry in state['items'].items()}
+    return state
+
+def compute_route_trends(previous, snapshot, collected_at):
+    """
+    与上一次快照比较，一次遍历计算每个数据项的排名变化、是否新上榜、热度变化速度（每小时）和动量，
+    以及跌出榜单的数据项
+    动量 = 排名变化 / 榜单长度（新上榜按从榜尾进入计算）+ 热度每小时增长率（限制在 ±1 之内）；
+    跌出榜单的数据项动量在 -2 到 -1 之间，排在最后
+    返回 (当前快照, [(动量, 趋势条目)])，没有上一次快照时趋势为 None
+    """
+    items = {}
+    for rank, item in enumerate(snapshot.items):
+        if item.item_id not in items:
+            items[item.item_id] = [rank, item.hot_value, item.title, item.url]
+    current = {'collected_at': collected_at, 'items': items}
+    if previous is None:
+        return current, None
+
+    count = max(len(items), 1)
+    elapsed_hours = (collected_at - previous['collected_at']) / 3600
+    previous_items = previous['items']
+    trends = []
+    for item_id, (rank, hot, title, url) in items.items():
+        entry = {'id': str(item_id), 'title': title, 'url': url, 'rank': rank, 'hot': hot,
+                 'rank_delta': None, 'new': False, 'dropped': False, 'hot_velocity': None}
+        prev = previous_items.get(item_id)
+        if prev is None:
+            entry['new'] = True
+            rank_score = (count - rank) / count
+            growth = 0.0
+        else:
+            entry['rank_delta'] = prev[0] - rank
+            rank_score = entry['rank_delta'] / count
+            growth = 0.0
+            if hot is not None and prev[1] is not None and elapsed_hours > 0:
+                entry['hot_velocity'] = (hot - prev[1]) / elapsed_hours
+                if prev[1] > 0:
+                    growth = max(-1.0, min(1.0, entry['hot_velocity'] / prev[1]))
+        trends.append((rank_score + growth, entry))
+
+    previous_count = max(len(previous_items), 1)
+    for item_id, (rank, hot, title, url) in previous_items.items():
+        if item_id not in items:
+            entry = {'id': str(item_id), 'title': title, 'url': url, 'rank': None, 'hot': hot,
+                     'previous_rank': rank, 'rank_delta': None, 'new': False, 'dropped': True, 'hot_velocity': None}
+            trends.append((-1.0 - (previous_count - rank) / previous_count, entry))
+    return current, trends
+
+def update_route_trends(key, snapshot, collected_at):
+    """
+    计算路由的趋势并发布到 allbs:trends:<path> 有序集合（分数为动量），同时保存本次快照供下一次比较和重启后恢复
+    返回 {'new': n, 'dropped': n, 'moved': n}，第一次见到路由时返回 None
+    """
+    previous = load_trend_state(key)
+    current, trends = compute_route_trends(previous, snapshot, collected_at)
+    with trend_state_lock:
+        trend_state[key] = current
+
+    expire_seconds = TRENDS_STATE_HOURS * 3600
+    trends_key = TRENDS_KEY_PREFIX + key
+    pipe = redis_client.pipeline()
+    if trends is not None:
+        pipe.delete(trends_key)
+        if trends:
+            pipe.zadd(trends_key, {json.dumps(entry, ensure_ascii=False): momentum for momentum, entry in trends})
+            pipe.expire(trends_key, expire_seconds)
+    pipe.set(TREND_STATE_KEY_PREFIX + key, json.dumps(current, ensure_ascii=False), ex=expire_seconds)
+    with REDIS_SECONDS.labels(target='trends').time():
+        pipe.execute()
+
+    if trends is None:
+        return None
+    entries = [entry for _, entry in trends]
+    return {
+        'new': sum(1 for entry in entries if entry['new']),
+        'dropped': sum(1 for entry in entries if entry['dropped']),
+        'moved': sum(1 for entry in entries if entry['rank_delta']),
+    }
+
+def bootstrap_route_tables(routes, db_ready=True):
+    """
+    为路由准备当前年份的数据表，约束修复和策略配置交给后台线程
+    db_ready 为 False 时跳过建表，表会在数据库恢复后首次写入时创建
+    """
+    base_names = []
+    for route in routes:
+        name = route.get("name")
+        path = route.get("path")
+        if not name or not path:
+            logging.warning("Invalid route data: %s", route)
+            continue
+        base_names.append(sanitize_table_name(name))
+
+    if not db_ready or not base_names:
+        return
+
+    current_year = datetime.now().year
+    repair_bases, policy_tables = [], []
+    # 确保表存在，使用当前年份
+    if STORAGE_MODE in ('legacy', 'both'):
+        try:
+            repair_bases, policy_tables = bootstrap_legacy_tables(base_names, current_year)
+        except psycopg2.Error as e:
+            # 表会在首次写入时逐个创建
+            logging.error("Error bootstrapping tables: %s", e)
+    if STORAGE_MODE in ('normalized', 'both'):
+        try:
+            ensure_normalized_tables(current_year)
+        except psycopg2.OperationalError as e:
+            logging.error("Error bootstrapping normalized tables: %s", e)
+    if not repair_bases and not policy_tables:
+        # 所有表都已在缓存中且无需修复（例如刷新路由目录时没有新路由），不启动后台维护
+        return
+    threading.Thread(
+        target=run_deferred_table_work,
+        args=(current_year, repair_bases, policy_tables),
+        name='table-repair',
+        daemon=True
+    ).start()
+
+def process_initial_routes(all_data, db_ready=True):
+    """
+    处理初始的 /all 路由数据，创建表并缓存，作为第一个路由目录使用
+    """
+    global latest_year, route_catalog
+
+    routes = all_data.get('routes', [])
+    if not routes:
+        logging.error("No routes found in /all data")
+        return
+
+    # 获取当前年份用于初始化
+    current_year = datetime.now().year
+    redis_client.set(CURRENT_YEAR_KEY, current_year)
+    latest_year = current_year
+
+    bootstrap_route_tables(routes, db_ready)
+
+    # 缓存 /all 结果
+    version = cache_routes(all_data)
+    with route_catalog_lock:
+        route_catalog = {'version': version or 0, 'data': all_data, 'added': routes, 'removed': []}
+
+def get_route_key(route):
+    """
+    获取路由在 Redis 键、调度和流水线中使用的 path（不含前导斜杠）
+    """
+    return (route.get("path") or '').lstrip('/')
+
+def prepare_route_catalog(data, version):
+    """
+    对比新目录与当前使用的目录，只为新增的路由准备数据表
+    返回待切换的目录 {'version', 'data', 'added', 'removed'}
+    """
+    with route_catalog_lock:
+        current = route_catalog
+    old_routes = {get_route_key(route): route for route in (current['data'].get('routes', []) if current else [])}
+    new_routes = {get_route_key(route): route for route in data.get('routes', [])}
+    added = [route for key, route in new_routes.items() if key not in old_routes]
+    removed = [route for key, route in old_routes.items() if key not in new_routes]
+    if added:
+        bootstrap_route_tables(added)
+    return {'version': version, 'data': data, 'added': added, 'removed': removed}
+
+def retire_routes(routes):
+    """
+    清理已从 /all 移除或已分配给其他 worker 的路由在内存中的状态
+    数据库中的历史数据保留，Redis 中的数据按原有的过期时间自然过期
+    """
+    for route in routes:
+        key = get_route_key(route)
+        with route_poll_state_lock:
+            route_poll_state.pop(key, None)
+        with trend_state_lock:
+            trend_state.pop(key, None)
+        with conditional_cache_lock:
+            conditional_cache.pop(build_route_url(route.get("path") or ''), None)
+        if route.get("name"):
+            base_name = sanitize_table_name(route["name"])
+            suffixes = (f":records_{base_name}", f":{base_name}")
+            with recent_item_cache_lock:
+                for cache_name in [cache_name for cache_name in recent_item_cache if cache_name.endswith(suffixes)]:
+                    del recent_item_cache[cache_name]
+        read_cache.invalidate_route(key)
+
+def activate_route_catalog(catalog):
+    """
+    切换到新的路由目录并清理被移除的路由，只在两轮之间调用
+    """
+    global route_catalog
+
+    with route_catalog_lock:
+        route_catalog = catalog
+    retire_routes(catalog['removed'])
+    if catalog['added'] or catalog['removed']:
+        logging.info("Switched to route catalog version %s: %d added (%s), %d removed (%s)",
+                     catalog['version'],
+                     len(catalog['added']), ', '.join(get_route_key(route) for route in catalog['added']),
+                     len(catalog['removed']), ', '.join(get_route_key(route) for route in catalog['removed']))
+
+def get_route_catalog():
+    """
+    每轮开始时获取本轮使用的路由目录：优先切换后台刷新好的目录，
+    否则检查 Redis 中的目录版本号，其他 worker 更新了目录时重新加载；Redis 不可用时沿用当前目录
+    """
+    global pending_route_catalog
+
+    with route_catalog_lock:
+        catalog, pending_route_catalog = pending_route_catalog, None
+        current = route_catalog
+
+    if catalog is None:
+        try:
+            version = redis_client.hget(CATALOG_VERSION_KEY, 'version')
+            if version is not None and (current is None or int(version) != current['version']):
+                # 目录与版本号在同一个事务中读取，保证两者一致
+                pipe = redis_client.pipeline()
+                pipe.hget(CATALOG_VERSION_KEY, 'version')
+                pipe.get(ROUTES_CACHE_KEY)
+                version, cached_data = pipe.execute()
+                if cached_data:
+                    catalog = prepare_route_catalog(json.loads(cached_data), int(version))
+        except redis.exceptions.RedisError as e:
+            logging.warning("Unable to check route catalog version in Redis: %s", e)
+
+    if catalog is not None:
+        activate_route_catalog(catalog)
+    with route_catalog_lock:
+        return route_catalog['data'] if route_catalog else None
+
+def refresh_route_catalog():
+    """
+    重新获取 /all 并发布到 Redis；目录版本变化时为新增路由准备数据表，
+    准备好的目录在下一轮开始时切换
+    """
+    global pending_route_catalog
+
+    data = fetch_all_routes()
+    if not data:
+        return
+    if not data.get('routes'):
+        # 上游返回空目录时保留当前目录，避免所有路由被移除
+        logging.warning("Ignoring empty /all catalog")
+        return
+    version = cache_routes(data)
+    if version is None:
+        return
+
+    with route_catalog_lock:
+        latest = pending_route_catalog or route_catalog
+    if latest is not None and latest['version'] == version:
+        return
+    catalog = prepare_route_catalog(data, version)
+    logging.info("Route catalog version %s ready: %d added, %d removed", version, len(catalog['added']), len(catalog['removed']))
+    with route_catalog_lock:
+        pending_route_catalog = catalog
+
+def run_catalog_refresher():
+    """
+    后台线程：每隔 CATALOG_REFRESH_INTERVAL 秒刷新一次路由目录
+    """
+    while True:
+        time.sleep(CATALOG_REFRESH_INTERVAL)
+        try:
+            refresh_route_catalog()
+        except Exception as e:
+            logging.error("Error refreshing route catalog: %s", e)
+
+def get_host_semaphore(url):
+    """
+    获取目标主机对应的信号量，用于限制对同一主机的并发请求数
+    """
+    host = urlparse(url).netloc
+    with host_semaphores_lock:
+        semaphore = host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(FETCH_PER_HOST_LIMIT)
+            host_semaphores[host] = semaphore
+        return semaphore
+
+def build_route_url(path):
+    """
+    根据路由 path 构建具体请求的 URL
+    """
+    if path.startswith('/'):
+        return f"{API_URL}{path}"
+    return f"{API_URL}/{path}"
+
+def fetch_route_data(request_url, deadline):
+    """
+    在工作线程中请求单个路由的数据，受主机并发限制和本轮截止时间约束
+    返回 (data, not_modified)
+    """
+    semaphore = get_host_semaphore(request_url)
+    remaining = deadline - time.monotonic()
+    if remaining <= 0 or not semaphore.acquire(timeout=remaining):
+        raise TimeoutError(f"Cycle deadline reached before fetching {request_url}")
+    try:
+        logging.debug("Fetching data from %s", request_url)
+        return http_get_json(request_url, deadline=deadline)
+    finally:
+        semaphore.release()
+
+def is_route_due(key, now):
+    """
+    自适应模式下判断路由是否到了下一次抓取时间，未启用自适应或尚无记录时总是返回 True
+    允许 5% 的提前量，避免调度触发的微小偏差导致整整跳过一个周期
+    """
+    if not ADAPTIVE_POLLING:
+        return True
+    with route_poll_state_lock:
+        state = route_poll_state.get(key)
+        if state is None:
+            return True
+        return state['last_polled'] + state['interval'] * 0.95 <= now
+
+def compute_payload_hash(data_list):
+    """
+    计算一个路由 data 列表的整体哈希，用于判断两次抓取的内容是否完全相同
+    """
+    return hashlib.md5(json.dumps(data_list, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def measure_change_rate(previous_ids, current_ids):
+    """
+    计算两次抓取之间的变化率：新增或排名发生变化的数据项占当前数据项的比例
+    """
+    if not current_ids:
+        return 0.0 if not previous_ids else 1.0
+    previous_positions = {item_id: position for position, item_id in enumerate(previous_ids)}
+    changed = sum(1 for position, item_id in enumerate(current_ids) if previous_positions.get(item_id) != position)
+    return changed / len(current_ids)
+
+def observe_route_payload(key, data_list, not_modified, polled_at):
+    """
+    记录一次抓取结果并更新路由的变化率与抓取间隔：
+    变化率越高间隔越接近 ADAPTIVE_MIN_INTERVAL，完全不变时逐渐增长到 ADAPTIVE_MAX_INTERVAL
+    返回内容是否与上一次完全相同（304 视为相同）；上一次写入失败时哈希已被清除，本次总是视为有变化
+    """
+    payload_hash = compute_payload_hash(data_list)
+    with route_poll_state_lock:
+        state = route_poll_state.get(key)
+        unchanged = (state is not None and state['payload_hash'] is not None
+                     and (not_modified or payload_hash == state['payload_hash']))
+        if unchanged:
+            change = 0.0
+            item_ids = state['item_ids']
+        else:
+            item_ids = [compute_item_id(key, item) for item in data_list]
+            change = measure_change_rate(state['item_ids'], item_ids) if state else 1.0
+
+        change_rate = change if state is None else (
+            ADAPTIVE_SMOOTHING * change + (1 - ADAPTIVE_SMOOTHING) * state['change_rate']
+        )
+        interval = ADAPTIVE_MAX_INTERVAL - (ADAPTIVE_MAX_INTERVAL - ADAPTIVE_MIN_INTERVAL) * change_rate
+        interval = max(ADAPTIVE_MIN_INTERVAL, min(ADAPTIVE_MAX_INTERVAL, interval))
+        route_poll_state[key] = {
+            'interval': interval,
+            'last_polled': polled_at,
+            'change_rate': change_rate,
+            'payload_hash': payload_hash,
+            'item_ids': item_ids,
+        }
+    logging.debug("Route %s change %.2f, change rate %.2f, next poll in %.0fs", key, change, change_rate, interval)
+    return unchanged
+
+def forget_route_payload(key):
+    """
+    Redis 或数据库写入失败时清除路由记录的内容哈希，下一次抓取即使内容相同也会重新写入
+    """
+    with route_poll_state_lock:
+        state = route_poll_state.get(key)
+        if state is not None:
+            state['payload_hash'] = None
+
+def get_route_poll_state():
+    """
+    获取每个路由的自适应抓取间隔、变化率和上次抓取时间
+    """
+    with route_poll_state_lock:
+        return {
+            key: {'interval': state['interval'], 'change_rate': state['change_rate'], 'last_polled': state['last_polled']}
+            for key, state in route_poll_state.items()
+        }
+
+def parse_update_time(name, data):
+    """
+    解析数据中的 updateTime（UTC）并转换为东八区时间，缺失或格式错误时返回 None
+    """
+    update_time_str = data.get('updateTime')
+    if not update_time_str:
+        logging.warning("No updateTime found in data for %s", name)
+        return None
+    try:
+        return datetime.fromisoformat(update_time_str.replace('Z', '+00:00')) + timedelta(hours=8)
+    except ValueError:
+        logging.error("Invalid updateTime format for %s: %s", name, update_time_str)
+        return None
+
+def write_route_to_db(snapshot, modes=None, completed=None):
+    """
+    按存储模式将单个路由快照写入 TimescaleDB
+    modes: 要写入的布局（'legacy'、'normalized'），默认按 STORAGE_MODE
+    completed: 传入列表时记录已写入成功的布局，数据库中途不可用时只需缓冲剩余的布局
+    返回写入统计：旧布局为 {'inserted': n, 'merged': m}，规范化布局为 {'samples': n, 'items': m}
+    """
+    if modes is None:
+        modes = pending_storage_modes()
+    counts = {}
+    # 将整个路由快照批量写入 TimescaleDB
+    for mode in modes:
+        if mode == 'legacy':
+            counts.update(bulk_insert_into_timescaledb(snapshot))
+        else:
+            counts.update(bulk_insert_normalized(snapshot))
+        if completed is not None:
+            completed.append(mode)
+    return counts
+
+def pending_storage_modes(completed=()):
+    """
+    获取按 STORAGE_MODE 需要写入、但尚未写入成功的存储布局
+    """
+    return [mode for mode in ('legacy', 'normalized') if STORAGE_MODE in (mode, 'both') and mode not in completed]
+
+def replay_route_batches(batches, modes):
+    """
+    重放同一路由、同一年份的多个缓冲批次，每种布局合并为一次写入
+    batches: [(snapshot, ingestion_time)]，按写入顺序排列
+    """
+    counts = {}
+    for mode in modes:
+        if mode == 'legacy':
+            counts.update(replay_legacy_batches(batches))
+        else:
+            counts.update(replay_normalized_batches(batches))
+    return counts
+
+class WriteSpool:
+    """
+    数据库不可用或过慢时的本地追加式缓冲（SQLite）
+    每条记录是一个路由批次（规范化后的 data 列表及原始采集时间），数据库恢复后按写入顺序重放；
+    重放使用原始采集时间并按唯一键跳过已写入的行，重复重放不会产生重复数据
+    总大小超过 max_bytes 时丢弃最早的记录；因数据库连接以外的原因无法写入的批次移入 dead_letter 表，
+    连同错误信息保留以便排查，不会阻塞后面的重放
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """
+        首次使用时打开 SQLite 文件并建表
+        """
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS spool (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    route TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letter (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    route TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    error TEXT NOT NULL,
+                    failed_at TEXT NOT NULL
+                )
+            """)
+            SPOOL_ENTRIES.set(self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0])
+        return self._conn
+
+    def encode(self, batch, modes):
+        """
+        将路由批次序列化为缓冲记录，modes 为尚未写入的存储布局
+        """
+        snapshot = batch['snapshot']
+        return json.dumps({
+            'name': batch['name'],
+            'sanitized_name': batch['sanitized_name'],
+            'key': batch['key'],
+            'update_time': snapshot.update_time.isoformat(),
+            'ingestion_time': batch['collected_at'].isoformat(),
+            'modes': modes,
+            'data_list': snapshot.raw_items(),
+        }, ensure_ascii=False)
+
+    def append(self, batch, modes):
+        """
+        追加一个路由批次，modes 为尚未写入的存储布局
+        """
+        payload = self.encode(batch, modes)
+        size = len(payload.encode('utf-8'))
+        if size > self.max_bytes:
+            logging.error("Batch for %s larger than spool limit, dropped", batch['name'])
+            SPOOL_BATCHES.labels(event='dropped').inc()
+            return False
+        with self._lock:
+            conn = self._connection()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM spool").fetchone()[0]
+            if total + size > self.max_bytes:
+                # 超出空间上限时丢弃最早的记录
+                dropped = 0
+                for entry_id, entry_size in conn.execute("SELECT id, size FROM spool ORDER BY id").fetchall():
+                    if total + size <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM spool WHERE id = ?", [entry_id])
+                    total -= entry_size
+                    dropped += 1
+                logging.error("Spool full, dropped %d oldest batches", dropped)
+                SPOOL_BATCHES.labels(event='dropped').inc(dropped)
+            conn.execute("INSERT INTO spool (route, size, payload) VALUES (?, ?, ?)", [batch['name'], size, payload])
+            SPOOL_ENTRIES.set(conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0])
+        SPOOL_BATCHES.labels(event='spooled').inc()
+        return True
+
+    def peek(self, limit):
+        """
+        按写入顺序读取最早的 limit 条记录，返回 [(id, payload)]，payload 由 decode 解析
+        """
+        with self._lock:
+            return self._connection().execute("SELECT id, payload FROM spool ORDER BY id LIMIT ?", [limit]).fetchall()
+
+    @staticmethod
+    def decode(payload):
+        """
+        解析一条缓冲记录，还原 updateTime 和采集时间
+        """
+        batch = json.loads(payload)
+        batch['update_time'] = datetime.fromisoformat(batch['update_time'])
+        batch['ingestion_time'] = datetime.fromisoformat(batch['ingestion_time'])
+        return batch
+
+    def dead_letter(self, batch, modes, error):
+        """
+        将无法写入的路由批次直接写入死信表
+        """
+        payload = self.encode(batch, modes)
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO dead_letter (route, size, payload, error, failed_at) VALUES (?, ?, ?, ?, ?)",
+                [batch['name'], len(payload.encode('utf-8')), payload, error, datetime.now().astimezone().isoformat()]
+            )
+        SPOOL_BATCHES.labels(event='dead_lettered').inc()
+
+    def bury(self, entry_id, error):
+        """
+        将重放失败且重试无意义的缓冲记录移入死信表
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                conn.execute("""
+                    INSERT INTO dead_letter (route, size, payload, error, failed_at)
+                    SELECT route, size, payload, ?, ? FROM spool WHERE id = ?
+                """, [error, datetime.now().astimezone().isoformat(), entry_id])
+                conn.execute("DELETE FROM spool WHERE id = ?", [entry_id])
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                # 回滚事务，连接不会停留在未结束的事务中
+                conn.execute("ROLLBACK")
+                raise
+            SPOOL_ENTRIES.set(conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0])
+        SPOOL_BATCHES.labels(event='dead_lettered').inc()
+
+    def delete(self, entry_ids):
+        """
+        删除已重放的记录
+        """
+        if not entry_ids:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("DELETE FROM spool WHERE id = ?", [[entry_id] for entry_id in entry_ids])
+            SPOOL_ENTRIES.set(conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0])
+
+# 本地写入缓冲
+write_spool = WriteSpool(SPOOL_PATH, SPOOL_MAX_MB * 1024 * 1024) if SPOOL_ENABLED else None
+
+def group_spool_entries(entries):
+    """
+    将缓冲记录按路由、待写入布局和年份分组，组内保持写入顺序，返回 {(key, modes, year): [(id, snapshot, ingestion_time)]}
+    无法解析的记录直接移入死信表
+    """
+    groups = {}
+    for entry_id, payload in entries:
+        try:
+            batch = write_spool.decode(payload)
+            snapshot = normalize_route_snapshot(batch['name'], batch['sanitized_name'], batch['key'],
+                                                batch['data_list'], batch['update_time'])
+        except Exception as e:
+            logging.error("Spooled batch %d is malformed, moving it to the dead-letter table: %s", entry_id, e)
+            write_spool.bury(entry_id, f"malformed: {e}")
+            continue
+        year = get_year_for_timestamp(None, batch['update_time'])
+        group_key = (batch['key'], tuple(batch['modes']), year)
+        groups.setdefault(group_key, []).append((entry_id, snapshot, batch['ingestion_time']))
+    return groups
+
+def replay_spool_group(key, modes, group):
+    """
+    合并重放一组缓冲记录，返回写入成功的记录 ID；数据库不可用时抛出 OperationalError
+    因其他原因失败时逐条重试，仍然失败的记录移入死信表
+    """
+    try:
+        replay_route_batches([(snapshot, ingestion_time) for _, snapshot, ingestion_time in group], modes)
+        return [entry_id for entry_id, _, _ in group]
+    except psycopg2.OperationalError:
+        raise
+    except Exception as e:
+        if len(group) == 1:
+            logging.error("Spooled batch %d for %s cannot be written, moving it to the dead-letter table: %s",
+                          group[0][0], key, e)
+            write_spool.bury(group[0][0], str(e))
+            return []
+        logging.warning("Merged replay of %d batches for %s failed, retrying one by one: %s", len(group), key, e)
+    done = []
+    for entry in group:
+        done.extend(replay_spool_group(key, modes, [entry]))
+    return done
+
+def replay_spool():
     """
-    global conn, cursor, current_db, table_checked_cache
-    
-    # 优先使用update_time的年份，如果没有则使用时间戳的年份
-    if update_time:
-        year = update_time.year
-    else:
-        # 将时间戳转换为datetime对象
+    重放本地缓冲中的批次：同一路由、同一年份的批次合并为每种布局一次写入，数据库仍不可用时停止，等待下一次检查
+    因连接以外的原因无法写入的批次移入死信表，不会阻塞后面的记录
+    返回本次重放的批次数
+    """
+    replayed = 0
+    while True:
+        entries = write_spool.peek(SPOOL_REPLAY_BATCH)
+        if not entries:
+            break
+        done = []
         try:
-            dt = datetime.fromtimestamp(timestamp)
-            year = dt.year
-        except (ValueError, OverflowError):
-            logging.error(f"Invalid timestamp {timestamp}, using current year")
-            year = datetime.now().year
-    
-    # 检查是否需要切换数据库（跨年）
-    current_year = redis_client.get(CURRENT_YEAR_KEY)
-    db_name = get_db_name_for_year(year)
-    
-    if current_year is None or int(current_year) != year or current_db != db_name:
-        # 更新当前年份缓存
-        redis_client.set(CURRENT_YEAR_KEY, year)
-        logging.info(f"Year changed or initialized to {year}")
-        
-        # 切换到对应年份的数据库
-        conn, cursor, current_db = init_db_connection(year)
-        
-        # 清理表检查缓存，因为切换了数据库
-        table_checked_cache.clear()
-        logging.info(f"Cleared table cache due to database switch to {current_db}")
-    
-    # 确保表存在
-    return ensure_table_exists(base_name)
+            for (key, modes, _), group in group_spool_entries(entries).items():
+                done.extend(replay_spool_group(key, modes, group))
+                read_cache.invalidate_route(key)
+        except psycopg2.OperationalError as e:
+            logging.warning("Database still unavailable, spool replay paused: %s", e)
+            break
+        finally:
+            write_spool.delete(done)
+            replayed += len(done)
+            SPOOL_BATCHES.labels(event='replayed').inc(len(done))
+    if replayed:
+        logging.info("Replayed %s spooled batches into TimescaleDB", replayed)
+    return replayed
 
-def insert_into_timescaledb(base_name, update_time, data_item, sort_order):
+def run_spool_replayer():
     """
-    将数据插入到 TimescaleDB，避免冗余数据
+    后台线程：定期重放本地缓冲
     """
-    global conn, cursor
-    try:
-        # 获取时间戳，确保即使值为None也转换为0
-        timestamp_value = data_item.get("timestamp")
-        item_timestamp = 0 if timestamp_value is None else timestamp_value
-        
-        # 判断时间戳是毫秒还是秒级
-        # 如果大于 32503680000（1000年的秒数），则认为是毫秒并转换为秒
-        if item_timestamp > 32503680000:
-            item_timestamp = item_timestamp / 1000
-        
-        # 处理无效时间戳
-        current_timestamp = int(time.time())
-        # 允许的时间范围：1970年至当前时间后10年
-        if item_timestamp <= 0 or item_timestamp > (current_timestamp + 315360000):  # 当前时间 + 10年的秒数
-            # 对于无效时间戳，使用update_time的时间戳而不是当前时间
-            if update_time:
-                item_timestamp = int(update_time.timestamp())
-                logging.debug(f"Using update_time as timestamp for item with title '{data_item.get('title')}'")
-            else:
-                item_timestamp = current_timestamp
-                logging.warning(f"Invalid timestamp {timestamp_value} for item with title '{data_item.get('title')}', using current time instead")
-        
-        # 将时间戳转换为datetime对象
+    while True:
+        time.sleep(SPOOL_REPLAY_INTERVAL)
         try:
-            item_datetime = datetime.fromtimestamp(item_timestamp)
-        except (ValueError, OverflowError) as e:
-            logging.error(f"Error converting timestamp {item_timestamp} to datetime: {e}")
-            logging.warning(f"Using update_time for item with title '{data_item.get('title')}'")
-            item_timestamp = int(update_time.timestamp()) if update_time else current_timestamp
-            item_datetime = update_time if update_time else datetime.now()
-        
-        # 检查数据年份是否超过updateTime年份10年，如果超过则忽略
-        if item_datetime.year < (update_time.year - 10):
-            logging.warning(f"Ignoring data item with title '{data_item.get('title')}' as its year {item_datetime.year} is more than 10 years before update time year {update_time.year}")
+            replay_spool()
+        except Exception as e:
+            logging.error("Unexpected error replaying spool: %s", e)
+
+class IngestPipeline:
+    """
+    分阶段的采集流水线：抓取 -> 规范化 -> Redis 写入 / TimescaleDB 写入
+    阶段之间通过有界队列连接，每个阶段有独立的并发数；
+    规范化后的数据先进入 Redis 队列再进入数据库队列；放入数据库队列不会阻塞，
+    数据库积压满 PIPELINE_QUEUE_SIZE 时批次改为写入本地缓冲（未启用时丢弃），Redis 的更新不受数据库影响
+    """
+
+    STAGES = ('fetch', 'normalize', 'redis', 'db')
+
+    def __init__(self):
+        self.queues = {
+            'normalize': queue.Queue(maxsize=PIPELINE_QUEUE_SIZE),
+            'redis': queue.Queue(maxsize=PIPELINE_QUEUE_SIZE),
+            'db': queue.Queue(maxsize=PIPELINE_QUEUE_SIZE),
+        }
+        self.handlers = {
+            'normalize': (self._normalize, PIPELINE_NORMALIZE_WORKERS),
+            'redis': (self._write_redis, PIPELINE_REDIS_WORKERS),
+            'db': (self._write_db, PIPELINE_DB_WORKERS),
+        }
+        self.route_counts = {}
+        self.unchanged_routes = []
+        # 本轮的当前时间，规范化时间戳时所有路由共用
+        self.cycle_timestamp = int(time.time())
+        # 每个路由本轮的汇总：耗时、数量和错误
+        self.route_summaries = {}
+        self.stats = {
+            stage: {'processed': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'max_queue_depth': 0}
+            for stage in self.STAGES
+        }
+        self._lock = threading.Lock()
+        self._workers = {}
+
+    def start(self):
+        """
+        启动规范化、Redis 和数据库阶段的工作线程
+        """
+        for stage, (handler, count) in self.handlers.items():
+            self._workers[stage] = []
+            for index in range(max(count, 1)):
+                worker = threading.Thread(
+                    target=self._run_worker, args=(stage, handler),
+                    name=f"{stage}-{index}", daemon=True
+                )
+                worker.start()
+                self._workers[stage].append(worker)
+
+    def _run_worker(self, stage, handler):
+        """
+        工作线程主循环：从阶段队列取出批次并处理，收到 None 时退出
+        """
+        stage_queue = self.queues[stage]
+        while True:
+            batch = stage_queue.get()
+            PIPELINE_QUEUE_DEPTH.labels(stage=stage).set(stage_queue.qsize())
+            if batch is None:
+                break
+            started = time.monotonic()
+            error = False
+            try:
+                handler(batch)
+            except Exception as e:
+                error = True
+                logging.error("Error in %s stage for %s: %s", stage, batch['name'], e)
+                self.summarize(batch['key'], error=f"{stage}: {e}")
+                if stage in ('redis', 'db'):
+                    forget_route_payload(batch['key'])
+            finally:
+                self.record(stage, time.monotonic() - started, error)
+
+    def record(self, stage, seconds, error=False):
+        """
+        记录一个批次在某个阶段的耗时
+        """
+        PIPELINE_STAGE_SECONDS.labels(stage=stage).set(seconds)
+        with self._lock:
+            stats = self.stats[stage]
+            stats['processed'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if error:
+                stats['errors'] += 1
+
+    def summarize(self, key, error=None, **fields):
+        """
+        合并路由本轮的汇总字段，error 会追加到错误列表
+        """
+        with self._lock:
+            summary = self.route_summaries.setdefault(key, {'errors': []})
+            summary.update(fields)
+            if error is not None:
+                summary['errors'].append(error)
+
+    def put(self, stage, batch):
+        """
+        将批次放入阶段队列，队列已满时阻塞（反压）
+        数据库队列从不阻塞：队列已满时批次改为写入本地缓冲，未启用缓冲时丢弃，避免规范化阶段停顿而拖慢 Redis 更新
+        """
+        stage_queue = self.queues[stage]
+        if stage == 'db':
+            try:
+                stage_queue.put_nowait(batch)
+            except queue.Full:
+                if write_spool is not None:
+                    logging.warning("Database stage backlogged, spooling batch for %s", batch['name'])
+                    self.spool(batch)
+                else:
+                    logging.error("Database stage backlogged, dropping batch for %s", batch['name'])
+                    PIPELINE_DROPPED.inc()
+                    self.summarize(batch['key'], error="db: queue full, batch dropped")
+                    forget_route_payload(batch['key'])
+                return
+        else:
+            stage_queue.put(batch)
+        PIPELINE_QUEUE_DEPTH.labels(stage=stage).set(stage_queue.qsize())
+        with self._lock:
+            self.stats[stage]['max_queue_depth'] = max(self.stats[stage]['max_queue_depth'], stage_queue.qsize())
+
+    def fetch(self, key, request_url, deadline):
+        """
+        抓取阶段：在抓取线程中请求路由数据并记录耗时
+        """
+        started = time.monotonic()
+        try:
+            result = fetch_route_data(request_url, deadline)
+        except Exception as e:
+            self.record('fetch', time.monotonic() - started, error=True)
+            self.summarize(key, error=f"fetch: {e}", fetch_seconds=time.monotonic() - started)
+            raise
+        elapsed = time.monotonic() - started
+        self.record('fetch', elapsed)
+        self.summarize(key, fetch_seconds=elapsed, not_modified=result[1])
+        FETCH_SECONDS.labels(route=key).observe(elapsed)
+        return result
+
+    def _normalize(self, batch):
+        """
+        规范化阶段：解析 updateTime，并将 data 列表一次性规范化为路由快照，供 Redis 和数据库阶段共用
+        自适应模式下内容与上一次完全相同时只刷新 Redis 过期时间，跳过 Redis 和数据库写入
+        """
+        data_list = batch['data'].get('data', [])
+        self.summarize(batch['key'], items=len(data_list))
+        if ADAPTIVE_POLLING and observe_route_payload(batch['key'], data_list, batch['not_modified'], batch['polled_at']):
+            logging.debug("Payload of %s unchanged, skipping Redis and database writes", batch['name'])
+            refresh_redis_expiry("allbs:news:" + batch['key'])
+            with self._lock:
+                self.unchanged_routes.append(batch['name'])
+            self.summarize(batch['key'], unchanged=True)
             return
-        
-        # 根据updateTime的年份获取或创建对应年份的数据库和表
-        table_name = get_or_create_db_for_timestamp(base_name, item_timestamp, update_time)
-        if not table_name:
-            logging.error(f"Failed to get or create table for {base_name} with timestamp {item_timestamp}")
+        update_time = parse_update_time(batch['name'], batch['data'])
+        batch['snapshot'] = normalize_route_snapshot(batch['name'], batch['sanitized_name'], batch['key'],
+                                                     data_list, update_time, self.cycle_timestamp)
+        # 快照已包含所需的全部字段，不再保留原始响应
+        del batch['data']
+        batch['collected_at'] = datetime.now().astimezone()
+        self.put('redis', batch)
+        if update_time is not None:
+            self.put('db', batch)
+
+    def _write_redis(self, batch):
+        """
+        Redis 阶段：缓存数据到 Redis 有序集合，启用 TRENDS_ENABLED 时同时发布排名趋势
+        """
+        started = time.monotonic()
+        counts = cache_in_redis_sorted_set("allbs:news:" + batch['key'], batch['snapshot'])
+        self.summarize(batch['key'], redis_seconds=time.monotonic() - started, redis=counts,
+                       error=None if counts is not None else "redis: write failed")
+        if counts is None:
+            forget_route_payload(batch['key'])
+        if TRENDS_ENABLED:
+            try:
+                trends = update_route_trends(batch['key'], batch['snapshot'], batch['collected_at'].timestamp())
+                self.summarize(batch['key'], trends=trends)
+            except redis.exceptions.RedisError as e:
+                logging.error("Error publishing trends of %s: %s", batch['key'], e)
+                self.summarize(batch['key'], error=f"trends: {e}")
+        read_cache.invalidate_route(batch['key'])
+
+    def _write_db(self, batch):
+        """
+        数据库阶段：批量写入 TimescaleDB
+        """
+        started = time.monotonic()
+        completed = []
+        try:
+            counts = write_route_to_db(batch['snapshot'], completed=completed)
+        except psycopg2.OperationalError as e:
+            if write_spool is None:
+                raise
+            logging.warning("Database unavailable for %s (%s), spooling batch", batch['name'], e)
+            self.spool(batch, completed)
             return
-        
-        # 检查表是否有唯一约束
-        cursor.execute("""
-            SELECT conname FROM pg_constraint 
-            WHERE conrelid = %s::regclass AND contype = 'u'
-            LIMIT 1
-        """, [table_name])
-        has_constraint = cursor.fetchone() is not None
-        
-        # 提取需要的字段
-        title = data_item.get('title')
-        desc = data_item.get('desc')
-        cover = data_item.get('cover')
-        hot = str(data_item.get('hot', ''))  # 转换为字符串
-        url = data_item.get('url')
-        mobile_url = data_item.get('mobileUrl')
-        
-        if has_constraint:
-            # 如果有约束，使用ON CONFLICT处理
-            insert_query = sql.SQL("""
-                INSERT INTO {} (update_time, title, "desc", cover, item_timestamp, hot, url, mobile_url, sort_order)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (ingestion_time, title, item_timestamp) DO UPDATE
-                SET hot = CONCAT(EXCLUDED.hot, ',', {table}.hot),
-                    sort_order = CONCAT(EXCLUDED.sort_order, ',', {table}.sort_order)
-            """).format(sql.Identifier(table_name), table=sql.Identifier(table_name))
-        else:
-            # 如果没有约束，先检查是否存在相同记录
-            check_query = sql.SQL("""
-                SELECT COUNT(*) FROM {} 
-                WHERE title = %s AND item_timestamp = %s
-                AND ingestion_time::date = CURRENT_DATE
-            """).format(sql.Identifier(table_name))
-            
-            cursor.execute(check_query, [title, item_timestamp])
-            exists = cursor.fetchone()[0] > 0
-            
-            if exists:
-                # 记录已存在，更新hot和sort_order
-                update_query = sql.SQL("""
-                    UPDATE {} SET 
-                        hot = CONCAT(hot, ',', %s),
-                        sort_order = CONCAT(sort_order, ',', %s),
-                        update_time = %s
-                    WHERE title = %s AND item_timestamp = %s
-                    AND ingestion_time::date = CURRENT_DATE
-                """).format(sql.Identifier(table_name))
-                
-                cursor.execute(update_query, [
-                    hot, sort_order, update_time, title, item_timestamp
-                ])
-                logging.info(f"Updated existing record in {table_name}: {title}")
-                return
-            else:
-                # 记录不存在，直接插入
-                insert_query = sql.SQL("""
-                    INSERT INTO {} (update_time, title, "desc", cover, item_timestamp, hot, url, mobile_url, sort_order)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """).format(sql.Identifier(table_name))
+        except psycopg2.Error as e:
+            # 表无法创建、数据被拒绝等错误重试无意义，保留到死信表后按阶段错误处理
+            if write_spool is not None:
+                write_spool.dead_letter(batch, pending_storage_modes(completed), str(e))
+            raise
+        read_cache.invalidate_route(batch['key'])
+        self.summarize(batch['key'], db_seconds=time.monotonic() - started, db=counts)
+        with self._lock:
+            self.route_counts[batch['name']] = counts
 
-        cursor.execute(insert_query, [
-            update_time,
-            title,
-            desc,
-            cover,
-            item_timestamp,
-            hot,
-            url,
-            mobile_url,
-            sort_order
-        ])
-        logging.info(f"Inserted/Updated data into {table_name}: {title}")
-    except psycopg2.Error as e:
-        logging.error(f"Error inserting/updating data into {table_name}: {e}")
-        # 如果是连接错误，尝试重新连接
-        if isinstance(e, psycopg2.OperationalError):
-            logging.info("Attempting to reconnect to database...")
-            year = datetime.fromtimestamp(item_timestamp).year
-            conn, cursor, current_db = init_db_connection(year)
+    def close(self):
+        """
+        依次关闭各阶段：等待规范化阶段处理完毕后再关闭 Redis 和数据库阶段
+        """
+        for stage in ('normalize', 'redis', 'db'):
+            for _ in self._workers.get(stage, []):
+                self.queues[stage].put(None)
+            for worker in self._workers.get(stage, []):
+                worker.join()
+
+    def spool(self, batch, completed=()):
+        """
+        将批次中尚未写入的存储布局写入本地缓冲
+        """
+        spooled = write_spool.append(batch, pending_storage_modes(completed))
+        self.summarize(batch['key'], spooled=spooled, error=None if spooled else "db: spool full")
+        if not spooled:
+            forget_route_payload(batch['key'])
+
+    def log_route_summaries(self):
+        """
+        每个路由输出一条本轮汇总日志，替代逐条的写入日志；JSON 格式下汇总字段作为结构化字段输出
+        """
+        with self._lock:
+            summaries = {key: dict(summary) for key, summary in self.route_summaries.items()}
+        for key, summary in sorted(summaries.items()):
+            logging.info("Route %s: fetch %.3fs, %d items, redis %.3fs %s, db %.3fs %s, %d errors%s",
+                         key, summary.get('fetch_seconds', 0.0), summary.get('items', 0),
+                         summary.get('redis_seconds', 0.0), summary.get('redis'),
+                         summary.get('db_seconds', 0.0), summary.get('db'),
+                         len(summary['errors']), ' (unchanged)' if summary.get('unchanged') else '',
+                         extra={'fields': {'event': 'route_summary', 'route': key, **summary}})
+
+    def is_successful(self):
+        """
+        本轮是否成功：至少有一个路由写入（或内容未变化），且所有路由的汇总中都没有抓取或写入错误
+        """
+        with self._lock:
+            summaries = list(self.route_summaries.values())
+        written = any(
+            summary.get('unchanged') or summary.get('redis') is not None or summary.get('db') is not None
+            for summary in summaries
+        )
+        return written and not any(summary['errors'] for summary in summaries)
+
+    def get_event_versions(self):
+        """
+        获取本轮追加了变更事件的路由及其事件版本号
+        """
+        with self._lock:
+            return {
+                key: summary['redis']['version']
+                for key, summary in self.route_summaries.items()
+                if summary.get('redis') and summary['redis'].get('version') is not None
+            }
+
+    def get_stats(self):
+        """
+        获取各阶段的处理数量、平均/最大耗时以及当前和最大队列深度
+        """
+        with self._lock:
+            snapshot = {}
+            for stage, stats in self.stats.items():
+                stage_stats = dict(stats)
+                stage_stats['avg_seconds'] = stats['total_seconds'] / stats['processed'] if stats['processed'] else 0.0
+                stage_queue = self.queues.get(stage)
+                stage_stats['queue_depth'] = stage_queue.qsize() if stage_queue else 0
+                snapshot[stage] = stage_stats
+            return snapshot
+
+def get_pipeline_stats():
+    """
+    获取正在运行的流水线的各阶段统计，没有运行中的流水线时返回上一轮的统计
+    """
+    pipeline = current_pipeline
+    if pipeline is not None:
+        return pipeline.get_stats()
+    return last_pipeline_stats
+
+def send_worker_heartbeat():
+    """
+    在 Redis 中登记当前 worker 的心跳，并清理心跳已过期的 worker，使其路由在下一轮重新分配
+    """
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.zadd(WORKERS_KEY, {WORKER_ID: now})
+    pipe.zremrangebyscore(WORKERS_KEY, '-inf', now - WORKER_TTL)
+    pipe.execute()
+
+def run_worker_heartbeat():
+    """
+    后台线程：每隔 WORKER_HEARTBEAT_INTERVAL 秒发送一次心跳
+    """
+    while True:
+        try:
+            send_worker_heartbeat()
+        except redis.exceptions.RedisError as e:
+            logging.error("Error sending worker heartbeat: %s", e)
+        time.sleep(WORKER_HEARTBEAT_INTERVAL)
 
-def cache_in_redis_sorted_set(key, data_list, update_time=None):
+def deregister_worker():
     """
-    使用有序集合（Sorted Set）缓存 data 列表，使用 timestamp 作为分数
-    在存储前清除旧数据
+    正常退出时移除当前 worker，其他 worker 不必等心跳过期即可接管路由
     """
     try:
-        # 清除现有的有序集合
-        redis_client.delete(key)
-        logging.info(f"Cleared existing Redis sorted set with key: {key}")
-
-        # 添加新的数据到有序集合
-        pipeline = redis_client.pipeline()
-        for item in data_list:
-            # 获取时间戳，确保即使值为None也转换为0
-            timestamp_value = item.get('timestamp')
-            timestamp = 0 if timestamp_value is None else timestamp_value
-                
-            # 转换毫秒级时间戳为秒级
-            if timestamp > 32503680000:  # 判断是否为毫秒级时间戳
-                timestamp = timestamp / 1000
-                
-            # 处理无效时间戳（与PostgreSQL逻辑保持一致）
-            current_timestamp = int(time.time())
-            # 允许的时间范围：1970年至当前时间后10年
-            if timestamp <= 0 or timestamp > (current_timestamp + 315360000):  # 当前时间 + 10年的秒数
-                # 对于无效时间戳，使用update_time的时间戳或当前时间
-                if update_time:
-                    timestamp = int(update_time.timestamp())
-                    logging.debug(f"Using update_time as timestamp for Redis item with title '{item.get('title')}'")
-                else:
-                    timestamp = current_timestamp
-                    logging.warning(f"Invalid timestamp {timestamp_value} for Redis item with title '{item.get('title')}', using current time instead")
-                
-            # 确保item的所有值都不为None，将None转换为空字符串
-            item_copy = {k: ('' if v is None else v) for k, v in item.items()}
-            # 更新item_copy中的timestamp为处理后的值
-            item_copy['timestamp'] = timestamp
-            member = json.dumps(item_copy, ensure_ascii=False)
-            pipeline.zadd(key, {member: timestamp})
-        pipeline.execute()
+        redis_client.zrem(WORKERS_KEY, WORKER_ID)
+    except redis.exceptions.RedisError as e:
+        logging.error("Error deregistering worker %s: %s", WORKER_ID, e)
 
-        # 设置缓存过期时间（小时转换为秒）
-        cache_expire_seconds = REDIS_CACHE_HOURS * 3600
-        redis_client.expire(key, cache_expire_seconds)
-        logging.info(f"Cached {len(data_list)} items in Redis sorted set with key: {key}, expires in {REDIS_CACHE_HOURS} hours")
+def get_live_workers():
+    """
+    读取心跳未过期的 worker 列表（始终包含当前 worker），Redis 不可用时沿用上一次的结果
+    """
+    global live_workers
 
-        # 如果启用了第二个Redis，则也存储到第二个Redis
-        if ENABLE_REDIS2 and redis_client2:
-            try:
-                redis_client2.delete(key)
-                pipeline2 = redis_client2.pipeline()
-                for item in data_list:
-                    # 获取时间戳，确保即使值为None也转换为0
-                    timestamp_value = item.get('timestamp')
-                    timestamp = 0 if timestamp_value is None else timestamp_value
-                        
-                    # 转换毫秒级时间戳为秒级
-                    if timestamp > 32503680000:  # 判断是否为毫秒级时间戳
-                        timestamp = timestamp / 1000
-                        
-                    # 处理无效时间戳（与PostgreSQL逻辑保持一致）
-                    current_timestamp = int(time.time())
-                    # 允许的时间范围：1970年至当前时间后10年
-                    if timestamp <= 0 or timestamp > (current_timestamp + 315360000):  # 当前时间 + 10年的秒数
-                        # 对于无效时间戳，使用update_time的时间戳或当前时间
-                        if update_time:
-                            timestamp = int(update_time.timestamp())
-                        else:
-                            timestamp = current_timestamp
-                        
-                    # 确保item的所有值都不为None，将None转换为空字符串
-                    item_copy = {k: ('' if v is None else v) for k, v in item.items()}
-                    # 更新item_copy中的timestamp为处理后的值
-                    item_copy['timestamp'] = timestamp
-                    member = json.dumps(item_copy, ensure_ascii=False)
-                    pipeline2.zadd(key, {member: timestamp})
-                pipeline2.execute()
-
-                redis_client2.expire(key, cache_expire_seconds)
-                logging.info(f"Cached {len(data_list)} items in second Redis sorted set with key: {key}, expires in {REDIS_CACHE_HOURS} hours")
-            except redis.exceptions.RedisError as e:
-                logging.error(f"Error caching data in second Redis: {e}")
+    try:
+        workers = redis_client.zrangebyscore(WORKERS_KEY, time.time() - WORKER_TTL, '+inf')
     except redis.exceptions.RedisError as e:
-        logging.error(f"Error caching data in Redis: {e}")
+        logging.error("Error reading live workers, using last known list: %s", e)
+        return live_workers
+    if WORKER_ID not in workers:
+        workers.append(WORKER_ID)
+    live_workers = sorted(workers)
+    LIVE_WORKERS.set(len(live_workers))
+    return live_workers
 
-def process_initial_routes(all_data):
+def get_route_owner(key, workers):
     """
-    处理初始的 /all 路由数据，创建表并缓存
+    使用最高随机权重（rendezvous）哈希确定路由所属的 worker：
+    worker 增减时只有原本属于该 worker 的路由会重新分配
     """
-    routes = all_data.get('routes', [])
-    if not routes:
-        logging.error("No routes found in /all data")
-        return
+    return max(workers, key=lambda worker: hashlib.md5(f"{worker}\x1f{key}".encode('utf-8')).digest())
 
-    # 获取当前年份用于初始化
-    current_year = datetime.now().year
-    redis_client.set(CURRENT_YEAR_KEY, current_year)
-    
-    for route in routes:
-        name = route.get("name")
-        path = route.get("path")
-        if not name or not path:
-            logging.warning(f"Invalid route data: {route}")
-            continue
+def assign_routes(routes):
+    """
+    分片模式下只保留分配给当前 worker 的路由
+    分配给其他 worker 的路由清理内存中的抓取和趋势状态，之后重新分配回来时从 Redis 恢复，不会沿用过期的状态
+    """
+    global owned_route_keys
 
-        sanitized_name = sanitize_table_name(name)
-        
-        # 确保表存在，使用当前年份
-        ensure_table_exists(sanitized_name)
+    workers = get_live_workers()
+    owned = [route for route in routes if get_route_owner(get_route_key(route), workers) == WORKER_ID]
+    keys = {get_route_key(route) for route in routes}
+    owned_keys = {get_route_key(route) for route in owned}
+    released = [route for route in routes
+                if get_route_key(route) in owned_route_keys and get_route_key(route) not in owned_keys]
+    if released:
+        logging.info("Sharding: %d routes moved to other workers, dropping their local state", len(released))
+        retire_routes(released)
+    owned_route_keys = (owned_route_keys - keys) | owned_keys
+    OWNED_ROUTES.set(len(owned))
+    logging.info("Sharding: %s owns %d of %d routes across %d workers", WORKER_ID, len(owned), len(routes), len(workers))
+    return owned
 
-    # 缓存 /all 结果
-    cache_routes(all_data)
+def acquire_route_leases(routes):
+    """
+    为本轮要处理的路由获取租约；租约仍被其他 worker 持有的路由（重新分配后上一轮尚未结束）本轮跳过
+    返回 (获得租约的路由, 租约键列表)；Redis 不可用时不使用租约
+    """
+    keys = [LEASE_KEY_PREFIX + get_route_key(route) for route in routes]
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, WORKER_ID, nx=True, ex=ROUTE_LEASE_SECONDS)
+        results = pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error("Error acquiring route leases, processing owned routes without leases: %s", e)
+        return routes, []
+
+    leased = [route for route, acquired in zip(routes, results) if acquired]
+    if len(leased) < len(routes):
+        skipped = [get_route_key(route) for route, acquired in zip(routes, results) if not acquired]
+        logging.warning("Skipping %d routes still leased by another worker: %s", len(skipped), ', '.join(skipped))
+    return leased, [key for key, acquired in zip(keys, results) if acquired]
+
+def release_route_leases(lease_keys):
+    """
+    本轮写入完成后释放仍由当前 worker 持有的租约
+    """
+    if not lease_keys:
+        return
+    try:
+        release_leases_script(keys=lease_keys, args=[WORKER_ID])
+    except redis.exceptions.RedisError as e:
+        logging.error("Error releasing route leases, they expire in %ss: %s", ROUTE_LEASE_SECONDS, e)
 
-def process_routes_periodic():
+def process_routes_periodic(schedule_keys=None):
     """
     定期任务：使用缓存的 routes 进行数据请求和存储
+    各路由的抓取、规范化、Redis 写入与 TimescaleDB 写入在流水线的不同阶段并发执行，
+    超过本轮截止时间仍未返回的路由将被跳过
+    schedule_keys: 本次触发的调度键，只处理属于这些调度的路由，None 表示处理全部路由
+    返回每个路由写入 TimescaleDB 的统计
     """
+    global current_pipeline, last_pipeline_stats
+
     logging.info("Starting periodic task")
-    cached_routes_data = get_cached_routes()
+    cached_routes_data = get_route_catalog()
     if not cached_routes_data:
         logging.error("No cached routes data available for periodic task")
         return
 
     routes = cached_routes_data.get('routes', [])
+    if schedule_keys is not None:
+        routes = [route for route in routes if get_route_schedule_key(route) in schedule_keys]
     if not routes:
         logging.warning("No routes to process in cached data")
         return
 
+    # 分片模式下只处理分配给当前 worker 的路由
+    if SHARDING_ENABLED:
+        routes = assign_routes(routes)
+        if not routes:
+            return {}
+
+    # 自适应模式下跳过还没到下一次抓取时间的路由
+    polled_at = time.time()
+    due_routes = [route for route in routes if is_route_due((route.get("path") or '').lstrip('/'), polled_at)]
+    if len(due_routes) < len(routes):
+        logging.info("Adaptive polling: %d of %d routes due this cycle", len(due_routes), len(routes))
+        routes = due_routes
+        if not routes:
+            return {}
+
+    # 租约保证同一路由同一时间只被一个 worker 处理
+    lease_keys = []
+    if SHARDING_ENABLED:
+        routes, lease_keys = acquire_route_leases(routes)
+        if not routes:
+            return {}
+
+    cycle_started = time.monotonic()
+    deadline = cycle_started + CYCLE_DEADLINE_SECONDS
+    deadline_reached = False
+    pipeline = IngestPipeline()
+    pipeline.start()
+    current_pipeline = pipeline
+
+    executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix='fetch')
+    futures = {}
     for route in routes:
         name = route.get("name")
         path = route.get("path")
         if not name or not path:
-            logging.warning(f"Invalid route data: {route}")
+            logging.warning("Invalid route data: %s", route)
             continue
 
-        sanitized_name = sanitize_table_name(name)
-        key = path.lstrip('/')
+        request_url = build_route_url(path)
+        future = executor.submit(pipeline.fetch, path.lstrip('/'), request_url, deadline)
+        futures[future] = (name, sanitize_table_name(name), path.lstrip('/'), request_url)
 
-        # 构建具体请求的 URL
-        if path.startswith('/'):
-            request_url = f"{API_URL}{path}"
-        else:
-            request_url = f"{API_URL}/{path}"
-        logging.info(f"Fetching data from {request_url}")
+    try:
+        # 哪个路由先返回就先进入下一阶段，不必等待最慢的路由
+        for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+            name, sanitized_name, key, request_url = futures[future]
+            try:
+                data, not_modified = future.result()
+            except (requests.RequestException, ValueError, TimeoutError) as e:
+                logging.error("Error fetching data from %s: %s", request_url, e)
+                continue
 
-        try:
-            response = requests.get(request_url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-        except requests.RequestException as e:
-            logging.error(f"Error fetching data from {request_url}: {e}")
-            continue
+            pipeline.put('normalize', {
+                'name': name,
+                'sanitized_name': sanitized_name,
+                'key': key,
+                'data': data,
+                'not_modified': not_modified,
+                'polled_at': polled_at,
+            })
+    except FuturesTimeoutError:
+        deadline_reached = True
+        unfinished = [futures[future][0] for future in futures if not future.done()]
+        logging.error("Cycle deadline of %ss reached, skipping %d routes: %s",
+                      CYCLE_DEADLINE_SECONDS, len(unfinished), ', '.join(unfinished))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        # 等待已进入流水线的数据全部写入
+        pipeline.close()
+        release_route_leases(lease_keys)
+        last_pipeline_stats = pipeline.get_stats()
+        current_pipeline = None
+        cycle_seconds = time.monotonic() - cycle_started
+        CYCLE_SECONDS.observe(cycle_seconds)
 
-        # 提取 updateTime
-        update_time_str = data.get('updateTime')
-        update_time = None
-        if not update_time_str:
-            logging.warning(f"No updateTime found in data for {name}")
-        else:
-            try:
-                update_time = datetime.fromisoformat(update_time_str.replace('Z', '+00:00')) + timedelta(hours=8)
-            except ValueError as e:
-                logging.error(f"Invalid updateTime format for {name}: {update_time_str}")
-                update_time = None
-
-        # 缓存数据到 Redis 有序集合
-        data_list = data.get('data', [])
-        cache_in_redis_sorted_set("allbs:news:" + key, data_list, update_time)
-        
-        if update_time is None:
-            continue
+    if EVENTS_ENABLED:
+        publish_cycle_event(pipeline.get_event_versions(), len(futures), cycle_seconds, deadline_reached)
 
-        # 处理 data 列表并插入到 TimescaleDB
-        for index, item in enumerate(data_list):
-            insert_into_timescaledb(sanitized_name, update_time, item, str(index))
+    pipeline.log_route_summaries()
+    for stage, stats in last_pipeline_stats.items():
+        logging.info("Pipeline stage %s: %d batches, %d errors, avg %.3fs, max %.3fs, max queue depth %d",
+                     stage, stats['processed'], stats['errors'], stats['avg_seconds'],
+                     stats['max_seconds'], stats['max_queue_depth'],
+                     extra={'fields': {'event': 'stage_summary', 'stage': stage, **stats}})
+    if pipeline.unchanged_routes:
+        logging.info("%d routes unchanged since last fetch: %s",
+                     len(pipeline.unchanged_routes), ', '.join(pipeline.unchanged_routes))
+    logging.info("HTTP client stats: %s", get_http_stats())
+    if not deadline_reached and pipeline.is_successful():
+        LAST_SUCCESS.set_to_current_time()
+    return pipeline.route_counts
 
 def initialize():
     """
     初始化函数：调用 /all，处理路由，创建表，缓存结果
     """
     logging.info("Initializing application")
-    all_data = fetch_all_routes()
+    # 数据库连接池（包括建库和启用扩展）与 Redis 检查、/all 请求并行建立
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-connect') as executor:
+        db_future = executor.submit(init_db_connection)
+        connect_redis()
+        all_data = fetch_all_routes()
+        db_ready = db_future.result() is not None
+
+    if not db_ready:
+        if not SPOOL_ENABLED:
+            exit(1)
+        # 启用本地缓冲时继续运行，数据库恢复前的数据先写入缓冲
+        logging.warning("Database unavailable, writes will be spooled locally until it recovers")
+
     if all_data:
-        process_initial_routes(all_data)
+        process_initial_routes(all_data, db_ready)
     else:
         logging.error("Failed to initialize routes from /all")
         exit(1)
 
-def should_run_now(cron_expression):
+def parse_route_schedules(value):
     """
-    检查当前时间是否符合cron表达式
+    解析单独的路由调度配置，格式：路由=cron表达式;路由=cron表达式
+    路由可以是 path（不含前导斜杠）或名称，无效的表达式会被忽略
+    """
+    schedules = {}
+    for entry in value.split(';'):
+        if '=' not in entry:
+            continue
+        route_key, expression = entry.split('=', 1)
+        route_key = route_key.strip().lstrip('/')
+        expression = expression.strip()
+        if not route_key or not expression:
+            continue
+        if not croniter.is_valid(expression):
+            logging.error("Invalid cron expression '%s' for route %s, ignored", expression, route_key)
+            continue
+        schedules[route_key] = expression
+    return schedules
+
+def get_route_schedule_key(route):
+    """
+    获取路由所属的调度：在 ROUTE_SCHEDULES 中单独配置的路由返回其 path 或名称，否则返回默认调度键
+    """
+    path = (route.get("path") or '').lstrip('/')
+    name = route.get("name")
+    if path in ROUTE_SCHEDULES:
+        return path
+    if name in ROUTE_SCHEDULES:
+        return name
+    return DEFAULT_SCHEDULE_KEY
+
+class CronScheduler:
+    """
+    精确的 cron 调度器：睡眠到 croniter 计算出的下一次触发时间再执行任务
+    默认调度和每个单独的路由调度各自计算触发时间，同一时刻触发的调度合并为一次任务；
+    上一轮仍在运行时按 SCHEDULE_OVERLAP_POLICY 跳过或合并触发，并记录触发延迟（drift）
     """
-    try:
-        from croniter import croniter
-        from datetime import datetime
 
-        # 获取当前时间
+    def __init__(self, default_schedule, route_schedules, job):
+        self.job = job
+        self.expressions = {DEFAULT_SCHEDULE_KEY: default_schedule}
+        self.expressions.update(route_schedules)
         now = datetime.now()
+        self.iterators = {key: croniter(expression, now) for key, expression in self.expressions.items()}
+        self.next_times = {key: iterator.get_next(datetime) for key, iterator in self.iterators.items()}
+        self.stats = {'fired': 0, 'skipped': 0, 'coalesced': 0, 'last_drift': 0.0, 'max_drift': 0.0, 'total_drift': 0.0}
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending = set()
+        self._stop = threading.Event()
 
-        # 创建croniter对象
-        cron = croniter(cron_expression, now)
+    def run_forever(self):
+        """
+        调度主循环，直到 stop() 被调用
+        """
+        while not self._stop.is_set():
+            fire_time = min(self.next_times.values())
+            remaining = (fire_time - datetime.now()).total_seconds()
+            if remaining > 0:
+                # 分段睡眠，系统时间被调整时可以及时重新计算
+                self._stop.wait(min(remaining, 60))
+                continue
 
-        # 获取下一次执行时间
-        next_run = cron.get_next(datetime)
+            due = {key for key, next_time in self.next_times.items() if next_time <= fire_time}
+            now = datetime.now()
+            for key in due:
+                # 跳过已经错过的触发时间，避免追赶执行
+                next_time = self.iterators[key].get_next(datetime)
+                while next_time <= now:
+                    next_time = self.iterators[key].get_next(datetime)
+                self.next_times[key] = next_time
 
-        # 计算距离下一次执行的秒数
-        time_diff = (next_run - now).total_seconds()
+            drift = (now - fire_time).total_seconds()
+            with self._lock:
+                self.stats['last_drift'] = drift
+                self.stats['max_drift'] = max(self.stats['max_drift'], drift)
+                self.stats['total_drift'] += drift
+            logging.info("Cron schedule triggered at %s for %s (drift %.3fs)", now, ', '.join(sorted(due)), drift)
+            self.dispatch(due)
 
-        # 如果下一次执行时间在60秒内，认为应该执行
-        return time_diff < 60
-    except Exception as e:
-        logging.error(f"Error parsing cron expression '{cron_expression}': {e}")
-        return False
+    def dispatch(self, schedule_keys):
+        """
+        在后台线程中执行任务；上一轮仍在运行时按策略跳过或合并
+        """
+        with self._lock:
+            self.stats['fired'] += 1
+            if self._running:
+                if SCHEDULE_OVERLAP_POLICY == 'skip':
+                    self.stats['skipped'] += 1
+                    logging.warning("Previous cycle still running, skipping tick for %s", ', '.join(sorted(schedule_keys)))
+                else:
+                    self.stats['coalesced'] += 1
+                    self._pending.update(schedule_keys)
+                    logging.warning("Previous cycle still running, will run %s when it finishes", ', '.join(sorted(schedule_keys)))
+                return
+            self._running = True
+        threading.Thread(target=self._run, args=(set(schedule_keys),), name='cycle', daemon=True).start()
+
+    def _run(self, schedule_keys):
+        """
+        执行任务，结束后如果有合并的触发则立即再执行一次
+        """
+        while True:
+            try:
+                self.job(schedule_keys)
+            except Exception as e:
+                logging.error("Unexpected error in periodic task: %s", e)
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                schedule_keys = self._pending
+                self._pending = set()
+
+    def stop(self):
+        """
+        停止调度主循环
+        """
+        self._stop.set()
+
+    def get_stats(self):
+        """
+        获取触发、跳过、合并次数以及触发延迟统计
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['avg_drift'] = stats['total_drift'] / stats['fired'] if stats['fired'] else 0.0
+            stats['running'] = self._running
+            stats['next_runs'] = {key: next_time.isoformat() for key, next_time in self.next_times.items()}
+            return stats
+
+class ReadCache:
+    """
+    只读 API 的进程内 TTL + LRU 响应缓存，键的第一个元素为路由 path，
+    采集流水线写入某个路由后使该路由的缓存失效
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (过期时间, 值)，按最近使用排序
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        读取未过期的缓存值，不存在或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        写入缓存，超过 max_size 时淘汰最久未使用的条目
+        """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_route(self, path):
+        """
+        使某个路由的全部缓存失效
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                del self._entries[key]
+
+# 只读 API 的响应缓存
+read_cache = ReadCache(READ_CACHE_TTL, READ_CACHE_SIZE)
+
+# 已存在的年份数据库缓存：(过期时间, {year: db_name})
+year_databases_cache = (0, {})
+year_databases_cache_lock = threading.Lock()
+
+def get_existing_year_databases():
+    """
+    获取已存在的年份数据库 {year: db_name}，结果缓存 YEAR_DATABASES_CACHE_SECONDS 秒
+    只读查询只访问已存在的数据库，避免连接池为不存在的年份创建数据库
+    """
+    global year_databases_cache
+    with year_databases_cache_lock:
+        expires, databases = year_databases_cache
+        if expires > time.monotonic():
+            return databases
+        databases = dict(list_year_databases())
+        year_databases_cache = (time.monotonic() + YEAR_DATABASES_CACHE_SECONDS, databases)
+        return databases
+
+def get_years_for_range(start, end):
+    """
+    获取时间范围涉及且已存在的年份；single 布局下只有一个数据库，返回一个年份即可
+    """
+    if DB_LAYOUT == 'single':
+        return [end.year]
+    databases = get_existing_year_databases()
+    return [year for year in range(start.year, end.year + 1) if year in databases]
+
+# 跨年份查询的线程池
+federation_executor = ThreadPoolExecutor(max_workers=FEDERATION_WORKERS, thread_name_prefix='federation')
+
+def run_on_year(year, run_query):
+    """
+    在年份数据库的连接池中借出一个连接执行 run_query(cursor, db_name)
+    """
+    with db_cursor(year) as cursor:
+        return run_query(cursor, get_db_name_for_year(year))
+
+def federated_query(start, end, run_query):
+    """
+    跨年份查询：根据时间范围确定需要访问的年份数据库，
+    在各自的连接池上并行执行 run_query(cursor, db_name)，按年份顺序返回各数据库的结果列表
+    每个数据库都使用完整的时间范围过滤，跨年时的数据只存在于其中一个数据库，不会重复
+    """
+    years = get_years_for_range(start, end)
+    if len(years) == 1:
+        return [run_on_year(years[0], run_query)]
+    futures = [federation_executor.submit(run_on_year, year, run_query) for year in years]
+    return [future.result() for future in futures]
+
+def federated_merge(start, end, run_query, key):
+    """
+    跨年份查询并按 key 归并各数据库已排好序的结果，返回惰性迭代器
+    """
+    return heapq.merge(*federated_query(start, end, run_query), key=key)
+
+def resolve_route(path):
+    """
+    根据路由 path 从缓存的 /all 结果中查找路由名称，返回 (name, sanitized_name)，不存在时返回 None
+    """
+    cached_routes_data = get_cached_routes() or {}
+    for route in cached_routes_data.get('routes', []):
+        if (route.get('path') or '').strip('/') == path and route.get('name'):
+            return route['name'], sanitize_table_name(route['name'])
+    return None
+
+def table_exists(cursor, db_name, table_name):
+    """
+    判断表是否存在，优先使用表结构缓存
+    """
+    if get_table_metadata(db_name, table_name) is not None:
+        return True
+    cursor.execute("SELECT to_regclass(%s)", [table_name])
+    return cursor.fetchone()[0] is not None
+
+def query_current_list(path):
+    """
+    从 Redis 有序集合读取路由当前的热榜，按时间戳倒序
+    """
+    members = redis_client.zrevrange("allbs:news:" + path, 0, -1)
+    return [json.loads(member) for member in members]
+
+def query_route_trends(path, limit):
+    """
+    从 allbs:trends:<path> 读取动量最高的数据项
+    """
+    members = redis_client.zrevrange(TRENDS_KEY_PREFIX + path, 0, limit - 1, withscores=True)
+    return [dict(json.loads(member), momentum=score) for member, score in members]
+
+def query_item_history(sanitized_name, title, url, start, end):
+    """
+    查询一个数据项在时间范围内的排名和热度变化，各年份数据库并行查询后按时间归并
+    """
+    def run_query(cursor, db_name):
+        if STORAGE_MODE in ('normalized', 'both'):
+            if not table_exists(cursor, db_name, SAMPLES_TABLE):
+                return []
+            cursor.execute(sql.SQL("""
+                SELECT s.ingestion_time, s.rank, s.hot
+                FROM {samples} s
+                WHERE s.route = %s
+                AND s.item_id IN (
+                    SELECT item_id FROM {items}
+                    WHERE route = %s AND (title = %s OR url = %s)
+                )
+                AND s.ingestion_time >= %s AND s.ingestion_time < %s
+                ORDER BY s.ingestion_time
+            """).format(samples=sql.Identifier(SAMPLES_TABLE), items=sql.Identifier(ITEMS_TABLE)),
+                [sanitized_name, sanitized_name, title, url, start, end])
+            return [{'time': row[0], 'rank': row[1], 'hot': row[2]} for row in cursor.fetchall()]
+
+        table_name = f"records_{sanitized_name}"
+        if not table_exists(cursor, db_name, table_name):
+            return []
+        cursor.execute(sql.SQL("""
+            SELECT ingestion_time, update_time, hot, sort_order
+            FROM {}
+            WHERE (title = %s OR url = %s)
+            AND ingestion_time >= %s AND ingestion_time < %s
+            ORDER BY ingestion_time
+        """).format(sql.Identifier(table_name)), [title, url, start, end])
+        # hot/sort_order 为逗号拼接的字符串，最新的值在前
+        return [{
+            'time': row[0],
+            'update_time': row[1],
+            'hot': list(reversed(row[2].split(','))) if row[2] else [],
+            'rank': list(reversed(row[3].split(','))) if row[3] else [],
+        } for row in cursor.fetchall()]
+
+    return list(federated_merge(start, end, run_query, key=lambda entry: entry['time']))
+
+def query_top_items(sanitized_name, start, end, limit):
+    """
+    查询路由在时间范围内的 Top-N：按最好排名排序，其次按最高热度；
+    各年份数据库并行聚合后再按数据项合并
+    """
+    def run_query(cursor, db_name):
+        if STORAGE_MODE in ('normalized', 'both'):
+            if not table_exists(cursor, db_name, SAMPLES_TABLE):
+                return []
+            cursor.execute(sql.SQL("""
+                SELECT i.title, i.url, MIN(s.rank), MAX(s.hot), COUNT(*), MAX(s.ingestion_time)
+                FROM {samples} s
+                JOIN {items} i ON i.item_id = s.item_id
+                WHERE s.route = %s AND s.ingestion_time >= %s AND s.ingestion_time < %s
+                GROUP BY i.title, i.url
+            """).format(samples=sql.Identifier(SAMPLES_TABLE), items=sql.Identifier(ITEMS_TABLE)),
+                [sanitized_name, start, end])
+            return cursor.fetchall()
+
+        table_name = f"records_{sanitized_name}"
+        if not table_exists(cursor, db_name, table_name):
+            return []
+        # sort_order 为逗号拼接的排名，取其中最好的排名
+        cursor.execute(sql.SQL("""
+            SELECT t.title, t.url, MIN(r.best_rank), NULL::bigint,
+                   SUM(array_length(string_to_array(t.sort_order, ','), 1)), MAX(t.update_time)
+            FROM {} t
+            CROSS JOIN LATERAL (
+                SELECT MIN(x::int) AS best_rank
+                FROM unnest(string_to_array(t.sort_order, ',')) AS x
+                WHERE x ~ '^[0-9]+$'
+            ) r
+            WHERE t.ingestion_time >= %s AND t.ingestion_time < %s
+            GROUP BY t.title, t.url
+        """).format(sql.Identifier(table_name)), [start, end])
+        return cursor.fetchall()
+
+    merged = {}
+    for rows in federated_query(start, end, run_query):
+        for title, url, best_rank, peak_hot, samples, last_seen in rows:
+            item = merged.setdefault((title, url), {
+                'title': title, 'url': url, 'best_rank': None, 'peak_hot': None, 'samples': 0, 'last_seen': None
+            })
+            if best_rank is not None and (item['best_rank'] is None or best_rank < item['best_rank']):
+                item['best_rank'] = best_rank
+            if peak_hot is not None and (item['peak_hot'] is None or peak_hot > item['peak_hot']):
+                item['peak_hot'] = peak_hot
+            item['samples'] += int(samples or 0)
+            if last_seen is not None and (item['last_seen'] is None or last_seen > item['last_seen']):
+                item['last_seen'] = last_seen
+
+    items = sorted(merged.values(), key=lambda item: (
+        item['best_rank'] if item['best_rank'] is not None else float('inf'),
+        -(item['peak_hot'] or 0),
+    ))
+    return items[:limit]
+
+def parse_query_time(value, default):
+    """
+    解析查询参数中的时间：ISO 8601 或 Unix 秒，未带时区的按本地时间处理
+    """
+    if not value:
+        return default
+    if re.fullmatch(r'\d+(\.\d+)?', value):
+        return datetime.fromtimestamp(float(value)).astimezone()
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.astimezone()
+
+def parse_query_limit(params, default=10):
+    """
+    解析查询参数中的 limit：必须是不小于 1 的整数，超过 READ_API_MAX_LIMIT 时截断
+    """
+    value = params.get('limit')
+    if value is None:
+        return default
+    if not re.fullmatch(r'\d+', value) or int(value) < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(int(value), READ_API_MAX_LIMIT)
+
+def json_default(value):
+    """
+    JSON 序列化 datetime 等类型
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    """
+    只读 HTTP API：
+    GET /api/routes                                   路由列表
+    GET /api/routes/<path>/current                    路由当前的热榜（Redis）
+    GET /api/routes/<path>/trends?limit=              按动量排序的排名趋势（Redis，需启用 TRENDS_ENABLED）
+    GET /api/routes/<path>/history?title=|url=&start=&end=   数据项的排名与热度历史
+    GET /api/routes/<path>/top?start=&end=&limit=     时间范围内的 Top-N
+    时间范围默认为最近一天，跨年的范围会自动查询对应的多个年份数据库
+    """
+
+    PATH_PATTERN = re.compile(r'^/api/routes/(?P<path>.+)/(?P<action>current|trends|history|top)$')
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        try:
+            if parsed.path.rstrip('/') == '/api/routes':
+                cached_routes_data = get_cached_routes() or {}
+                self.send_json(200, cached_routes_data.get('routes', []))
+                return
+
+            match = self.PATH_PATTERN.match(parsed.path)
+            if not match:
+                self.send_json(404, {'error': 'not found'})
+                return
+            path, action = match.group('path').strip('/'), match.group('action')
+
+            cache_key = (path, action, tuple(sorted(params.items())))
+            result = read_cache.get(cache_key)
+            if result is None:
+                result = self.query(path, action, params)
+                if result is None:
+                    self.send_json(404, {'error': f"unknown route {path}"})
+                    return
+                read_cache.set(cache_key, result)
+            self.send_json(200, result)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except (psycopg2.Error, redis.exceptions.RedisError) as e:
+            logging.error("Read API query %s failed: %s", self.path, e)
+            self.send_json(503, {'error': 'storage unavailable'})
+
+    def query(self, path, action, params):
+        """
+        执行查询，路由不在路由目录中时返回 None（各接口一致返回 404）
+        """
+        route = resolve_route(path)
+        if route is None:
+            return None
+        if action == 'current':
+            return {'route': path, 'items': query_current_list(path)}
+        if action == 'trends':
+            return {'route': path, 'items': query_route_trends(path, parse_query_limit(params))}
+
+        _, sanitized_name = route
+        end = parse_query_time(params.get('end'), datetime.now().astimezone())
+        start = parse_query_time(params.get('start'), end - timedelta(days=1))
+        if start >= end:
+            raise ValueError("start must be before end")
+
+        if action == 'history':
+            if not params.get('title') and not params.get('url'):
+                raise ValueError("title or url is required")
+            history = query_item_history(sanitized_name, params.get('title'), params.get('url'), start, end)
+            return {'route': path, 'start': start, 'end': end, 'history': history}
+
+        limit = parse_query_limit(params)
+        return {'route': path, 'start': start, 'end': end, 'items': query_top_items(sanitized_name, start, end, limit)}
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Read API %s - %s", self.address_string(), format % args)
+
+def start_read_api(port):
+    """
+    在后台线程中启动只读 HTTP API
+    """
+    server = ThreadingHTTPServer((READ_API_BIND, port), ReadApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='read-api', daemon=True).start()
+    logging.info("Serving read API on %s:%d", READ_API_BIND, port)
+    return server
 
 def run():
     """
-    主运行函数：初始化后进入循环，按照cron调度执行任务
+    主运行函数：初始化后按照cron调度执行任务
     """
+    global scheduler
+
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        logging.info("Serving Prometheus metrics on port %s", METRICS_PORT)
+    if READ_API_PORT:
+        start_read_api(READ_API_PORT)
+    if write_spool is not None:
+        threading.Thread(target=run_spool_replayer, name='spool-replay', daemon=True).start()
+
     initialize()
-    
-    logging.info(f"Starting periodic task with cron schedule: {CRON_SCHEDULE}")
-    
-    last_run_minute = -1
-    
-    while True:
-        current_time = datetime.now()
-        current_minute = current_time.minute
-        
-        # 每分钟检查一次是否需要执行任务
-        if current_minute != last_run_minute:
-            last_run_minute = current_minute
-            
-            if should_run_now(CRON_SCHEDULE):
-                logging.info(f"Cron schedule triggered at {current_time}")
-                process_routes_periodic()
-        
-        # 每30秒检查一次
-        time.sleep(30)
+
+    if CATALOG_REFRESH_INTERVAL > 0:
+        threading.Thread(target=run_catalog_refresher, name='catalog-refresh', daemon=True).start()
+    if SHARDING_ENABLED:
+        logging.info("Sharding enabled, worker id %s", WORKER_ID)
+        threading.Thread(target=run_worker_heartbeat, name='worker-heartbeat', daemon=True).start()
+        atexit.register(deregister_worker)
+
+    ROUTE_SCHEDULES.update(parse_route_schedules(ROUTE_SCHEDULES_CONFIG))
+    logging.info("Starting periodic task with cron schedule: %s (overlap policy: %s)", CRON_SCHEDULE, SCHEDULE_OVERLAP_POLICY)
+    for route_key, expression in ROUTE_SCHEDULES.items():
+        logging.info("Route %s uses its own cron schedule: %s", route_key, expression)
+
+    scheduler = CronScheduler(CRON_SCHEDULE, ROUTE_SCHEDULES, process_routes_periodic)
+    scheduler.run_forever()
 
 if __name__ == "__main__":
-    run()
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate-normalized':
+        # 迁移旧表到规范化布局：python app.py migrate-normalized [年份 ...]
+        migrate_to_normalized([int(year) for year in sys.argv[2:]])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'fold-years':
+        # 将年份数据库合并到一个数据库：DB_LAYOUT=single python app.py fold-years [年份 ...]
+        fold_year_databases([int(year) for year in sys.argv[2:]])
+    else:
+        run()
@@ -0,0 +1,468 @@
+"""
+采集周期基准测试
+
+启动一个本地的假 DailyHot API（/all 与各路由接口，可配置延迟和数据大小），
+使用本地的 Redis 和 TimescaleDB（通过与 app.py 相同的环境变量配置），
+数据库前缀（--db-prefix）和 Redis 数据库编号（--redis-db）必须与正式配置不同，
+基准不会写入正式数据，也不会覆盖 worker 正在使用的路由目录；
+端到端运行 process_routes_periodic，统计吞吐量、周期耗时 p50/p99、
+每轮数据库往返次数和 Redis 命令数（在客户端统计），并将结果保存为 JSON 便于不同版本之间对比；
+每个场景使用带运行编号的独立路由名，不会复用前一个场景或前一次运行留下的缓存、表和 Redis 状态
+
+--micro 只运行规范化的微基准（不需要 Redis 和 TimescaleDB）：对比逐个写入目标规范化原始 dict
+与一次构建 RouteSnapshot 后各写入目标共用的耗时、峰值内存和数据项占用的内存
+
+示例：
+    python benchmark.py --redis-db 15 --routes 10,50 --items 50,200 --cycles 5 --latency-ms 20 --output bench.json
+    python benchmark.py --micro --items 50,500 --output micro.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import string
+import argparse
+import platform
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    假 DailyHot API：返回服务器上预先生成好的 JSON，按配置的延迟响应
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        body = server.payloads.get(self.path.split('?', 1)[0])
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """
+    在后台线程中运行的假 API 服务器，payloads 为 path -> 响应字节
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), FakeApiHandler)
+        self.latency = latency
+        self.payloads = {}
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-api', daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class PayloadGenerator:
+    """
+    生成路由列表和每轮的路由数据；每轮按 change_rate 替换部分数据项并打乱部分排名，模拟真实的热榜变化
+    """
+
+    def __init__(self, route_count, item_count, desc_bytes, change_rate, seed, prefix='bench'):
+        self.route_count = route_count
+        self.item_count = item_count
+        self.desc_bytes = desc_bytes
+        self.change_rate = change_rate
+        self.random = random.Random(seed)
+        self.next_id = 0
+        self.items = {f"{prefix}-{index}": [self.new_item(index) for _ in range(item_count)] for index in range(route_count)}
+
+    def new_item(self, route_index):
+        """
+        生成一个新的数据项
+        """
+        self.next_id += 1
+        desc = ''.join(self.random.choices(string.ascii_letters, k=self.desc_bytes))
+        return {
+            'id': self.next_id,
+            'title': f"Route {route_index} item {self.next_id}",
+            'desc': desc,
+            'cover': '',
+            'timestamp': int(time.time() * 1000),
+            'hot': self.random.randint(1000, 10000000),
+            'url': f"https://example.com/{route_index}/{self.next_id}",
+            'mobileUrl': f"https://m.example.com/{route_index}/{self.next_id}",
+        }
+
+    def routes_payload(self):
+        """
+        /all 接口的返回
+        """
+        routes = [{'name': name, 'path': f"/{name}"} for name in self.items]
+        return json.dumps({'code': 200, 'count': len(routes), 'routes': routes}).encode('utf-8')
+
+    def advance(self):
+        """
+        生成下一轮所有路由的返回，path -> 响应字节
+        """
+        update_time = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        payloads = {}
+        for route_index, (name, items) in enumerate(self.items.items()):
+            for _ in range(int(len(items) * self.change_rate)):
+                items[self.random.randrange(len(items))] = self.new_item(route_index)
+            for item in items:
+                item['hot'] = max(item['hot'] + self.random.randint(-5000, 5000), 0)
+            items.sort(key=lambda item: item['hot'], reverse=True)
+            payloads[f"/{name}"] = json.dumps({
+                'code': 200, 'name': name, 'updateTime': update_time, 'data': items
+            }, ensure_ascii=False).encode('utf-8')
+        return payloads
+
+
+def percentile(values, fraction):
+    """
+    最近秩法计算分位数
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def count_db_statements(app):
+    """
+    从 dailyhot_db_statement_seconds 指标读取累计执行的数据库语句数（每条语句一次往返）
+    """
+    total = 0
+    for metric in app.DB_STATEMENT_SECONDS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith('_count'):
+                total += sample.value
+    return int(total)
+
+
+class RedisCommandCounter:
+    """
+    在客户端统计发往主 Redis 的命令数：包装 execute_command 和管道的 execute，
+    只计入使用主 Redis 连接池的客户端，同一服务器上其他数据库和客户端的命令不会被计入
+    """
+
+    def __init__(self, client):
+        import redis
+        self.pool = client.connection_pool
+        self.count = 0
+        self.lock = threading.Lock()
+        counter = self
+        execute_command = redis.Redis.execute_command
+        pipeline_execute = redis.client.Pipeline.execute
+
+        def counted_execute_command(client, *args, **options):
+            if client.connection_pool is counter.pool:
+                counter.add(1)
+            return execute_command(client, *args, **options)
+
+        def counted_pipeline_execute(pipeline, *args, **kwargs):
+            if pipeline.connection_pool is counter.pool and pipeline.command_stack:
+                # 事务管道另外发送 MULTI 和 EXEC
+                counter.add(len(pipeline.command_stack) + (2 if pipeline.transaction else 0))
+            return pipeline_execute(pipeline, *args, **kwargs)
+
+        redis.Redis.execute_command = counted_execute_command
+        redis.client.Pipeline.execute = counted_pipeline_execute
+
+    def add(self, count):
+        with self.lock:
+            self.count += count
+
+
+def run_scenario(app, server, route_count, item_count, args, prefix, redis_counter):
+    """
+    运行一个场景：初始化路由后先预热一轮，再计时运行 args.cycles 轮
+    prefix: 本场景的路由名前缀，各场景互不相同，不会复用之前场景的进程内缓存和 Redis/数据库状态
+    """
+    generator = PayloadGenerator(route_count, item_count, args.desc_bytes, args.change_rate, args.seed, prefix)
+    server.payloads = {'/all': generator.routes_payload()}
+    server.payloads.update(generator.advance())
+    app.initialize()
+    app.process_routes_periodic()
+
+    durations = []
+    db_statements = []
+    redis_commands = []
+    http_requests = []
+    for _ in range(args.cycles):
+        server.payloads.update(generator.advance())
+        db_before = count_db_statements(app)
+        redis_before = redis_counter.count
+        http_before = app.get_http_stats()['requests']
+
+        started = time.perf_counter()
+        app.process_routes_periodic()
+        durations.append(time.perf_counter() - started)
+
+        db_statements.append(count_db_statements(app) - db_before)
+        redis_commands.append(redis_counter.count - redis_before)
+        http_requests.append(app.get_http_stats()['requests'] - http_before)
+
+    items_per_cycle = route_count * item_count
+    result = {
+        'routes': route_count,
+        'items_per_route': item_count,
+        'cycles': args.cycles,
+        'items_per_second': items_per_cycle * len(durations) / sum(durations) if durations else 0.0,
+        'cycle_seconds_p50': percentile(durations, 0.5),
+        'cycle_seconds_p99': percentile(durations, 0.99),
+        'cycle_seconds_max': max(durations) if durations else 0.0,
+        'db_round_trips_per_cycle': sum(db_statements) / len(db_statements) if db_statements else 0.0,
+        'redis_commands_per_cycle': sum(redis_commands) / len(redis_commands) if redis_commands else 0.0,
+        'http_requests_per_cycle': sum(http_requests) / len(http_requests) if http_requests else 0.0,
+        'pipeline_stats': app.get_pipeline_stats(),
+    }
+    print(f"routes={route_count} items={item_count}: {result['items_per_second']:.0f} items/s, "
+          f"p50 {result['cycle_seconds_p50']:.3f}s, p99 {result['cycle_seconds_p99']:.3f}s, "
+          f"{result['db_round_trips_per_cycle']:.1f} DB round-trips, "
+          f"{result['redis_commands_per_cycle']:.1f} Redis commands per cycle")
+    return result
+
+
+def normalize_per_sink(app, data_list, update_time, route):
+    """
+    对照组：每个写入目标各自遍历原始 dict 规范化（快照之前的方式），
+    Redis、旧布局和规范化布局各自重新计算当前时间、时间戳、数据项 ID 和内容哈希，并各自复制 dict
+    """
+    current_timestamp = int(time.time())
+    members = {}
+    for item in data_list:
+        timestamp = app.normalize_item_timestamp(item.get('timestamp'), update_time, current_timestamp, item.get('title'))
+        item_copy = {k: ('' if v is None else v) for k, v in item.items()}
+        item_copy['timestamp'] = timestamp
+        members[json.dumps(item_copy, ensure_ascii=False)] = timestamp
+
+    current_timestamp = int(time.time())
+    rows = []
+    for index, item in enumerate(data_list):
+        title = item.get('title')
+        timestamp = app.normalize_item_timestamp(item.get('timestamp'), update_time, current_timestamp, title)
+        if datetime.fromtimestamp(timestamp).year < update_time.year - 10:
+            continue
+        timestamp = int(timestamp)
+        rows.append({
+            'update_time': update_time, 'title': title, 'desc': item.get('desc'), 'cover': item.get('cover'),
+            'item_timestamp': timestamp, 'hot': str(item.get('hot', '')), 'url': item.get('url'),
+            'mobile_url': item.get('mobileUrl'), 'sort_order': str(index),
+            'item_id': app.compute_item_id(route, item), 'content_hash': app.compute_content_hash(item, timestamp),
+        })
+
+    current_timestamp = int(time.time())
+    items = {}
+    samples = []
+    for rank, item in enumerate(data_list):
+        item_id = app.compute_item_id(route, item)
+        title = item.get('title')
+        timestamp = int(app.normalize_item_timestamp(item.get('timestamp'), update_time, current_timestamp, title))
+        items[item_id] = (
+            item_id, route, title, item.get('desc'), item.get('cover'), item.get('url'), item.get('mobileUrl'),
+            timestamp, app.compute_content_hash(item, timestamp)
+        )
+        samples.append((route, item_id, rank, app.parse_hot_value(item.get('hot'))))
+    return members, rows, items, samples
+
+
+def normalize_with_snapshot(app, data_list, update_time, route):
+    """
+    一次构建 RouteSnapshot，Redis、旧布局和规范化布局共用
+    """
+    snapshot = app.normalize_route_snapshot(route, route, route, data_list, update_time)
+    return app.prepare_redis_members(snapshot), app.prepare_db_rows(snapshot), app.prepare_normalized_rows(snapshot)
+
+
+def measure_normalizer(func, app, data_list, update_time, iterations):
+    """
+    测量一种规范化方式：每个路由的平均耗时，以及 tracemalloc 记录的单次处理峰值内存
+    """
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(app, data_list, update_time, 'bench')
+    seconds = (time.perf_counter() - started) / iterations
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(app, data_list, update_time, 'bench')
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return {'seconds_per_route': seconds, 'peak_bytes': peak}
+
+
+def measure_retained(build):
+    """
+    测量 build() 返回的对象保留的内存
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return retained
+
+
+def run_micro(app, item_count, args):
+    """
+    规范化微基准：对比逐个写入目标规范化与共用 RouteSnapshot 的耗时和内存，
+    以及每个规范化后的数据项使用 dict 与使用 __slots__ 的 HotItem 时占用的内存
+    """
+    generator = PayloadGenerator(1, item_count, args.desc_bytes, args.change_rate, args.seed)
+    data = json.loads(generator.advance()['/bench-0'])
+    data_list = data['data']
+    update_time = app.parse_update_time('bench-0', data)
+
+    per_sink = measure_normalizer(normalize_per_sink, app, data_list, update_time, args.micro_iterations)
+    snapshot = measure_normalizer(normalize_with_snapshot, app, data_list, update_time, args.micro_iterations)
+
+    items = app.normalize_route_snapshot('bench', 'bench', 'bench', data_list, update_time).items
+    slots = [slot for slot in app.HotItem.__slots__ if slot != 'raw']
+    dict_bytes = measure_retained(lambda: [{slot: getattr(item, slot) for slot in slots} for item in items])
+    slotted_bytes = measure_retained(lambda: [
+        app.HotItem(None, *(getattr(item, slot) for slot in slots)) for item in items
+    ])
+
+    result = {
+        'items_per_route': item_count,
+        'iterations': args.micro_iterations,
+        'per_sink': per_sink,
+        'snapshot': snapshot,
+        'speedup': per_sink['seconds_per_route'] / snapshot['seconds_per_route'] if snapshot['seconds_per_route'] else 0.0,
+        'item_bytes_dict': dict_bytes / item_count if item_count else 0.0,
+        'item_bytes_slots': slotted_bytes / item_count if item_count else 0.0,
+    }
+    print(f"items={item_count}: per-sink {per_sink['seconds_per_route'] * 1000:.2f}ms peak {per_sink['peak_bytes']} B, "
+          f"snapshot {snapshot['seconds_per_route'] * 1000:.2f}ms peak {snapshot['peak_bytes']} B "
+          f"({result['speedup']:.2f}x); normalized item {result['item_bytes_dict']:.0f} B as dict, "
+          f"{result['item_bytes_slots']:.0f} B with __slots__")
+    return result
+
+
+def parse_int_list(value):
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DailyHot ingest cycle against a local fake API')
+    parser.add_argument('--routes', type=parse_int_list, default=[10, 50], help='comma separated route counts')
+    parser.add_argument('--items', type=parse_int_list, default=[50], help='comma separated items per route')
+    parser.add_argument('--cycles', type=int, default=5, help='measured cycles per scenario')
+    parser.add_argument('--latency-ms', type=float, default=20, help='fake API response latency')
+    parser.add_argument('--desc-bytes', type=int, default=100, help='size of each item description')
+    parser.add_argument('--change-rate', type=float, default=0.2, help='share of items replaced each cycle')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    parser.add_argument('--db-prefix', default='daily_hot_bench',
+                        help='database name prefix for benchmark data, must differ from TIMESCALEDB_DB')
+    parser.add_argument('--redis-db', type=int,
+                        help='Redis database number for benchmark data, required and must differ from REDIS_DB')
+    parser.add_argument('--micro', action='store_true',
+                        help='only run the normalizer microbenchmark, no Redis or TimescaleDB needed')
+    parser.add_argument('--micro-iterations', type=int, default=200, help='iterations per microbenchmark')
+    args = parser.parse_args()
+
+    if args.micro:
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ.setdefault('METRICS_PORT', '0')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import app
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'micro': [run_micro(app, item_count, args) for item_count in args.items],
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Results written to {args.output}")
+        return
+
+    # 基准会初始化路由目录并写入数据，数据库前缀和 Redis 数据库都必须与正式配置隔离
+    if args.redis_db is None:
+        parser.error('--redis-db is required: pick a Redis database not used by any worker')
+    if args.redis_db == int(os.getenv('REDIS_DB', 0)):
+        parser.error(f'--redis-db {args.redis_db} is the configured REDIS_DB, refusing to overwrite live data')
+    if args.db_prefix == os.getenv('TIMESCALEDB_DB', 'daily_hot'):
+        parser.error(f'--db-prefix {args.db_prefix} is the configured TIMESCALEDB_DB, refusing to write live data')
+
+    server = FakeApiServer(args.latency_ms / 1000)
+    server.start()
+
+    # app 在导入时读取配置，需先指向假 API，并覆盖数据库、Redis 和本地缓冲配置；
+    # 副本 Redis 不参与基准，避免假数据同步到其他实例
+    os.environ['API_URL'] = server.url
+    os.environ['TIMESCALEDB_DB'] = args.db_prefix
+    os.environ['REDIS_DB'] = str(args.redis_db)
+    os.environ['ENABLE_REDIS2'] = 'false'
+    os.environ['REDIS_REPLICA_URLS'] = ''
+    os.environ['SPOOL_PATH'] = os.path.join('spool', f'{args.db_prefix}.sqlite3')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('METRICS_PORT', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    redis_counter = RedisCommandCounter(app.redis_client)
+
+    # 路由名带上运行编号和场景编号，每个场景都从冷状态开始
+    run_id = format(int(time.time()), 'x')[-6:]
+    results = []
+    try:
+        for route_count in args.routes:
+            for item_count in args.items:
+                prefix = f"bench-{run_id}-{len(results)}"
+                results.append(run_scenario(app, server, route_count, item_count, args, prefix, redis_counter))
+    finally:
+        server.stop()
+
+    version_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VERSION')
+    version = open(version_file).read().strip() if os.path.exists(version_file) else None
+    report = {
+        'version': version,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': {
+            'latency_ms': args.latency_ms,
+            'desc_bytes': args.desc_bytes,
+            'change_rate': args.change_rate,
+            'storage_mode': app.STORAGE_MODE,
+            'fetch_concurrency': app.FETCH_CONCURRENCY,
+            'redis_incremental': app.REDIS_INCREMENTAL,
+            'item_dedup': app.ITEM_DEDUP,
+        },
+        'scenarios': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# 导入 app 前设置本地缓冲路径，测试不在仓库目录中创建缓冲文件
+os.environ.setdefault('SPOOL_PATH', os.path.join(tempfile.mkdtemp(prefix='dailyhot-test-'), 'spool.sqlite3'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
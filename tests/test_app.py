@@ -0,0 +1,104 @@
+import json
+
+import app
+
+
+def test_parse_hot_value_units():
+    assert app.parse_hot_value('12.5万') == 125000
+    assert app.parse_hot_value('3亿') == 300000000
+    assert app.parse_hot_value(42) == 42
+    assert app.parse_hot_value('热') is None
+
+
+def test_parse_hot_value_non_finite():
+    # json.loads 会把 NaN、Infinity 解析为浮点数
+    for hot in json.loads('[NaN, Infinity, -Infinity]'):
+        assert app.parse_hot_value(hot) is None
+    assert app.parse_hot_value('1' + '0' * 400 + '亿') is None
+
+
+def test_read_api_unknown_route_returns_404(monkeypatch):
+    import urllib.error
+    import urllib.request
+
+    monkeypatch.setattr(app, 'get_cached_routes', lambda: {'routes': [{'name': 'weibo', 'path': '/weibo'}]})
+    monkeypatch.setattr(app, 'query_current_list', lambda path: [{'title': 'a'}])
+    monkeypatch.setattr(app, 'query_route_trends', lambda path, limit: [])
+    monkeypatch.setattr(app, 'READ_API_BIND', '127.0.0.1')
+    monkeypatch.setattr(app, 'read_cache', app.ReadCache(app.READ_CACHE_TTL, app.READ_CACHE_SIZE))
+    server = app.start_read_api(0)
+    base = f"http://127.0.0.1:{server.server_address[1]}/api/routes"
+    try:
+        with urllib.request.urlopen(f"{base}/weibo/current") as response:
+            assert json.loads(response.read())['items'] == [{'title': 'a'}]
+        for action in ('current', 'trends', 'history?title=a', 'top'):
+            try:
+                urllib.request.urlopen(f"{base}/unknown/{action}")
+            except urllib.error.HTTPError as e:
+                assert e.code == 404
+            else:
+                raise AssertionError(f"{action} returned 200 for an unknown route")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_spool_bury_rolls_back_on_error(tmp_path):
+    spool = app.WriteSpool(str(tmp_path / 'spool.sqlite3'), 1024 * 1024)
+    conn = spool._connection()
+    conn.execute("INSERT INTO spool (route, size, payload) VALUES ('weibo', 2, '{}')")
+    (entry_id,) = conn.execute("SELECT id FROM spool").fetchone()
+    conn.execute("DROP TABLE dead_letter")
+    try:
+        spool.bury(entry_id, 'boom')
+    except app.sqlite3.Error:
+        pass
+    else:
+        raise AssertionError("bury should fail without the dead_letter table")
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0] == 1
+
+
+def test_normalize_route_snapshot_skips_only_bad_items():
+    data_list = json.loads("""[
+        {"title": "ok", "url": "https://example.com/1", "hot": "1.5万", "timestamp": 1700000000000},
+        {"title": "nan hot", "url": "https://example.com/2", "hot": NaN, "timestamp": NaN},
+        {"title": "string timestamp", "url": "https://example.com/3", "hot": Infinity, "timestamp": "1700000000"},
+        "not an item"
+    ]""")
+    snapshot = app.normalize_route_snapshot('weibo', 'weibo', 'allbs:news:weibo', data_list, None, 1700000100)
+    assert [item.title for item in snapshot.items] == ['ok', 'nan hot', 'string timestamp']
+    assert [item.hot_value for item in snapshot.items] == [15000, None, None]
+    assert snapshot.items[1].item_timestamp == 1700000100
+    assert snapshot.items[2].item_timestamp == 1700000000
+
+
+def test_assign_routes_drops_state_of_released_routes(monkeypatch):
+    routes = [{'name': f'route{index}', 'path': f'/route{index}'} for index in range(20)]
+    keys = [app.get_route_key(route) for route in routes]
+    monkeypatch.setattr(app, 'owned_route_keys', set())
+    monkeypatch.setattr(app, 'get_live_workers', lambda: [app.WORKER_ID])
+    assert app.assign_routes(routes) == routes
+    for key in keys:
+        app.trend_state[key] = {'collected_at': 0, 'items': {}}
+
+    workers = [app.WORKER_ID, 'other-worker']
+    monkeypatch.setattr(app, 'get_live_workers', lambda: workers)
+    owned = {app.get_route_key(route) for route in app.assign_routes(routes)}
+    assert 0 < len(owned) < len(routes)
+    for key in keys:
+        assert (key in app.trend_state) == (key in owned)
+        app.trend_state.pop(key, None)
+
+
+def test_route_event_carries_removed_items(monkeypatch):
+    published = []
+    monkeypatch.setattr(app, 'publish_event', lambda stream_key, version_key, fields: published.append(fields) or 1)
+    removed = json.dumps({'title': '旧标题', 'url': 'https://example.com/old', 'timestamp': 1}, ensure_ascii=False)
+    added = json.dumps({'title': 'new', 'url': 'https://example.com/new', 'timestamp': 2})
+    assert app.publish_route_event('weibo', {'added': [added], 'removed': [removed]}, 1) == 1
+    fields = published[0]
+    assert fields['removed'] == app.fingerprint_member(removed)
+    assert json.loads(fields['removed_items']) == [
+        {'fp': app.fingerprint_member(removed), 'title': '旧标题', 'url': 'https://example.com/old'}
+    ]